@@ -86,6 +86,29 @@ namespace dials { namespace algorithms { namespace boost_python {
       .def("__call__", &DispersionThreshold::threshold_w_gain<double>)
       ;
 
+    class_<DispersionThresholdStaticMask>("DispersionThresholdStaticMask", no_init)
+      .def(init< int2,
+                 int2,
+                 double,
+                 double,
+                 double,
+                 int,
+                 bool >((
+                    arg("image_size"),
+                    arg("kernel_size"),
+                    arg("n_sigma_b"),
+                    arg("n_sigma_s"),
+                    arg("threshold"),
+                    arg("min_count"),
+                    arg("use_float") = false)))
+      .def("__call__", &DispersionThresholdStaticMask::threshold<int>)
+      .def("__call__", &DispersionThresholdStaticMask::threshold<double>)
+      .def("__call__", &DispersionThresholdStaticMask::threshold_w_gain<int>)
+      .def("__call__", &DispersionThresholdStaticMask::threshold_w_gain<double>)
+      .def("num_mask_updates", &DispersionThresholdStaticMask::num_mask_updates)
+      .def("num_fallback", &DispersionThresholdStaticMask::num_fallback)
+      ;
+
 
     class_<DispersionThresholdDebug>("DispersionThresholdDebug", no_init)
       .def(init<const af::const_ref<double, af::c_grid<2> > &,
@@ -11,6 +11,7 @@
 #ifndef DIALS_ALGORITHMS_IMAGE_THRESHOLD_UNIMODAL_H
 #define DIALS_ALGORITHMS_IMAGE_THRESHOLD_UNIMODAL_H
 
+#include <algorithm>
 #include <cmath>
 #include <vector>
 #include <iostream>
@@ -646,6 +647,408 @@ namespace dials { namespace algorithms {
   };
 
 
+  /**
+   * A version of the dispersion threshold for images which share the same
+   * mask (e.g. the images in a sweep). The number of valid pixels in the
+   * local area, and the terms of the threshold that depend on it, only depend
+   * on the mask so are computed once and reused. Only the summed area tables
+   * of the pixel values are computed for each image. If the mask changes
+   * then the mask terms are recomputed.
+   *
+   * The result is the same as the DispersionThreshold class. Optionally, the
+   * local sums and the threshold can be computed in single precision, which
+   * is faster but may classify pixels very close to the threshold
+   * differently; this is intended for detectors with integer counts.
+   */
+  class DispersionThresholdStaticMask {
+  public:
+
+    typedef DispersionThreshold::Data<double> Data;
+
+    DispersionThresholdStaticMask(int2 image_size,
+              int2 kernel_size,
+              double nsig_b,
+              double nsig_s,
+              double threshold,
+              int min_count,
+              bool use_float)
+        : image_size_(image_size),
+          kernel_size_(kernel_size),
+          nsig_b_(nsig_b),
+          nsig_s_(nsig_s),
+          threshold_(threshold),
+          min_count_(min_count),
+          use_float_(use_float),
+          has_mask_(false),
+          num_mask_updates_(0),
+          num_fallback_(0),
+          fallback_(image_size, kernel_size, nsig_b, nsig_s, threshold, min_count) {
+
+      // Check the input
+      DIALS_ASSERT(threshold_ >= 0);
+      DIALS_ASSERT(nsig_b >= 0 && nsig_s >= 0);
+      DIALS_ASSERT(image_size.all_gt(0));
+      DIALS_ASSERT(kernel_size.all_gt(0));
+
+      // Ensure the min counts are valid
+      std::size_t num_kernel = (2*kernel_size[0]+1)*(2*kernel_size[1]+1);
+      if (min_count_ <= 0) {
+        min_count_ = num_kernel;
+      } else {
+        DIALS_ASSERT(min_count_ <= num_kernel && min_count_ > 1);
+      }
+
+      // Allocate the buffers for the mask terms
+      std::size_t size = image_size[0] * image_size[1];
+      mask_.resize(size);
+      count_.resize(size);
+      sqrt_term_.resize(size);
+      if (use_float_) {
+        sum_x_.resize(image_size[1]);
+        sum_y_.resize(image_size[1]);
+      } else {
+        buffer_.resize(sizeof(Data) * size);
+      }
+    }
+
+    /** @returns The number of times the mask terms have been computed */
+    std::size_t num_mask_updates() const {
+      return num_mask_updates_;
+    }
+
+    /** @returns The number of images using the standard algorithm */
+    std::size_t num_fallback() const {
+      return num_fallback_;
+    }
+
+    /**
+     * Compute the threshold for the given image and mask.
+     * @param src - The input image array.
+     * @param mask - The mask array.
+     * @param dst - The destination array.
+     */
+    template <typename T>
+    void threshold(
+        const af::const_ref< T, af::c_grid<2> > &src,
+        const af::const_ref< bool, af::c_grid<2> > &mask,
+        af::ref< bool, af::c_grid<2> > dst) {
+      DIALS_ASSERT(src.accessor().all_eq(image_size_));
+      DIALS_ASSERT(src.accessor().all_eq(mask.accessor()));
+      DIALS_ASSERT(src.accessor().all_eq(dst.accessor()));
+      update_mask(mask);
+      if (has_overload(src)) {
+        num_fallback_++;
+        fallback_.threshold(src, mask, dst);
+      } else if (use_float_) {
+        compute_threshold_float(src, (const double *)0, dst);
+      } else {
+        compute_threshold(src, (const double *)0, dst);
+      }
+    }
+
+    /**
+     * Compute the threshold for the given image and mask.
+     * @param src - The input image array.
+     * @param mask - The mask array.
+     * @param gain - The gain array
+     * @param dst - The destination array.
+     */
+    template <typename T>
+    void threshold_w_gain(
+        const af::const_ref< T, af::c_grid<2> > &src,
+        const af::const_ref< bool, af::c_grid<2> > &mask,
+        const af::const_ref< double, af::c_grid<2> > &gain,
+        af::ref< bool, af::c_grid<2> > dst) {
+      DIALS_ASSERT(src.accessor().all_eq(image_size_));
+      DIALS_ASSERT(src.accessor().all_eq(mask.accessor()));
+      DIALS_ASSERT(src.accessor().all_eq(gain.accessor()));
+      DIALS_ASSERT(src.accessor().all_eq(dst.accessor()));
+      update_mask(mask);
+      if (has_overload(src)) {
+        num_fallback_++;
+        fallback_.threshold_w_gain(src, mask, gain, dst);
+      } else if (use_float_) {
+        compute_threshold_float(src, &gain[0], dst);
+      } else {
+        compute_threshold(src, &gain[0], dst);
+      }
+    }
+
+  private:
+
+    /**
+     * Compute the number of valid pixels in the local area and the terms of
+     * the threshold which depend on it, if the mask has changed.
+     * @param mask The mask array
+     */
+    void update_mask(const af::const_ref< bool, af::c_grid<2> > &mask) {
+      if (has_mask_ && std::equal(mask.begin(), mask.end(), mask_.begin())) {
+        return;
+      }
+      std::copy(mask.begin(), mask.end(), mask_.begin());
+      has_mask_ = true;
+      num_mask_updates_++;
+
+      // Get the size of the image
+      std::size_t ysize = image_size_[0];
+      std::size_t xsize = image_size_[1];
+
+      // The summed area table of the mask
+      std::vector<int> table(ysize * xsize);
+      for (std::size_t j = 0, k = 0; j < ysize; ++j) {
+        int m = 0;
+        for (std::size_t i = 0; i < xsize; ++i, ++k) {
+          m += mask[k] ? 1 : 0;
+          table[k] = (j == 0) ? m : table[k-xsize] + m;
+        }
+      }
+
+      // The kernel size
+      int kxsize = kernel_size_[1];
+      int kysize = kernel_size_[0];
+
+      // Compute the number of valid pixels in the local area
+      for (std::size_t j = 0, k = 0; j < ysize; ++j) {
+        for (std::size_t i = 0 ; i < xsize; ++i, ++k) {
+          int i0 = i - kxsize - 1, i1 = i + kxsize;
+          int j0 = j - kysize - 1, j1 = j + kysize;
+          i1 = i1 < xsize ? i1 : xsize - 1;
+          j1 = j1 < ysize ? j1 : ysize - 1;
+          int k0 = j0*xsize;
+          int k1 = j1*xsize;
+          int m = table[k1+i1];
+          if (i0 >= 0 && j0 >= 0) {
+            m += table[k0+i0] - (table[k1+i0] + table[k0+i1]);
+          } else if (i0 >= 0) {
+            m -= table[k1+i0];
+          } else if (j0 >= 0) {
+            m -= table[k0+i1];
+          }
+          count_[k] = (mask[k] && m >= min_count_) ? m : 0;
+          sqrt_term_[k] = count_[k] > 0 ? std::sqrt(2*((double)m-1)) : 0;
+        }
+      }
+    }
+
+    /**
+     * Check if any valid pixels are too large for the summed area table, in
+     * which case the standard algorithm is used.
+     * @param src The input array
+     */
+    template <typename T>
+    bool has_overload(const af::const_ref< T, af::c_grid<2> > &src) const {
+      const T BIG = (1 << 24);
+      for (std::size_t k = 0; k < src.size(); ++k) {
+        if (mask_[k] && !(src[k] < BIG)) {
+          return true;
+        }
+      }
+      return false;
+    }
+
+    /**
+     * Compute the threshold using the summed area table of the pixel values
+     * @param src The input array
+     * @param gain The gain array (or null)
+     * @param dst The output array
+     */
+    template <typename T>
+    void compute_threshold(
+        const af::const_ref< T, af::c_grid<2> > &src,
+        const double *gain,
+        af::ref< bool, af::c_grid<2> > dst) {
+
+      // Cast the buffer to the table type
+      typedef DispersionThreshold::Data<T> TableData;
+      DIALS_ASSERT(sizeof(TableData) <= sizeof(Data));
+      TableData *table = reinterpret_cast<TableData*>(&buffer_[0]);
+
+      // Get the size of the image
+      std::size_t ysize = src.accessor()[0];
+      std::size_t xsize = src.accessor()[1];
+
+      // Create the summed area table of the pixel values
+      for (std::size_t j = 0, k = 0; j < ysize; ++j) {
+        T x = 0;
+        T y = 0;
+        for (std::size_t i = 0; i < xsize; ++i, ++k) {
+          int mm = mask_[k] ? 1 : 0;
+          x += mm * src[k];
+          y += mm * src[k] * src[k];
+          if (j == 0) {
+            table[k].x = x;
+            table[k].y = y;
+          } else {
+            table[k].x = table[k-xsize].x + x;
+            table[k].y = table[k-xsize].y + y;
+          }
+        }
+      }
+
+      // The kernel size
+      int kxsize = kernel_size_[1];
+      int kysize = kernel_size_[0];
+
+      // Calculate the local mean at every point
+      for (std::size_t j = 0, k = 0; j < ysize; ++j) {
+        for (std::size_t i = 0 ; i < xsize; ++i, ++k) {
+          dst[k] = false;
+          if (count_[k] == 0 || !(src[k] > threshold_)) {
+            continue;
+          }
+          int i0 = i - kxsize - 1, i1 = i + kxsize;
+          int j0 = j - kysize - 1, j1 = j + kysize;
+          i1 = i1 < xsize ? i1 : xsize - 1;
+          j1 = j1 < ysize ? j1 : ysize - 1;
+          int k0 = j0*xsize;
+          int k1 = j1*xsize;
+
+          // Compute the sum of the pixel values and the sum of the squared
+          // pixel values in the local area
+          double x = 0;
+          double y = 0;
+          if (i0 >= 0 && j0 >= 0) {
+            const TableData& d00 = table[k0+i0];
+            const TableData& d10 = table[k1+i0];
+            const TableData& d01 = table[k0+i1];
+            x += d00.x - (d10.x + d01.x);
+            y += d00.y - (d10.y + d01.y);
+          } else if (i0 >= 0) {
+            const TableData& d10 = table[k1+i0];
+            x -= d10.x;
+            y -= d10.y;
+          } else if (j0 >= 0) {
+            const TableData& d01 = table[k0+i1];
+            x -= d01.x;
+            y -= d01.y;
+          }
+          const TableData& d11 = table[k1+i1];
+          x += d11.x;
+          y += d11.y;
+
+          // Compute the thresholds
+          double m = count_[k];
+          if (x >= 0) {
+            if (gain == 0) {
+              double a = m * y - x * x - x * (m-1);
+              double b = m * src[k] - x;
+              double c = x * nsig_b_ * sqrt_term_[k];
+              double d = nsig_s_ * std::sqrt(x * m);
+              dst[k] = a > c && b > d;
+            } else {
+              double a = m * y - x * x;
+              double b = m * src[k] - x;
+              double c = gain[k] * x * (m-1+nsig_b_ * sqrt_term_[k]);
+              double d = nsig_s_ * std::sqrt(gain[k] * x * m);
+              dst[k] = a > c && b > d;
+            }
+          }
+        }
+      }
+    }
+
+    /**
+     * Compute the threshold in single precision. The local sums are computed
+     * as the sum over the rows of the kernel followed by the sum over the
+     * columns so that the inner loops run over contiguous memory and the
+     * values stay small.
+     * @param src The input array
+     * @param gain The gain array (or null)
+     * @param dst The output array
+     */
+    template <typename T>
+    void compute_threshold_float(
+        const af::const_ref< T, af::c_grid<2> > &src,
+        const double *gain,
+        af::ref< bool, af::c_grid<2> > dst) {
+
+      // Get the size of the image
+      int ysize = src.accessor()[0];
+      int xsize = src.accessor()[1];
+
+      // The kernel size
+      int kxsize = kernel_size_[1];
+      int kysize = kernel_size_[0];
+
+      // Parameters in single precision
+      float nsig_b = nsig_b_;
+      float nsig_s = nsig_s_;
+      float *sum_x = &sum_x_[0];
+      float *sum_y = &sum_y_[0];
+
+      for (int j = 0; j < ysize; ++j) {
+
+        // Sum the valid pixels over the rows in the kernel
+        int j0 = std::max(j - kysize, 0);
+        int j1 = std::min(j + kysize, ysize - 1);
+        std::fill(sum_x_.begin(), sum_x_.end(), 0.0f);
+        std::fill(sum_y_.begin(), sum_y_.end(), 0.0f);
+        for (int jj = j0; jj <= j1; ++jj) {
+          const T *s = &src[jj * xsize];
+          const bool *mk = &mask_[jj * xsize];
+          for (int i = 0; i < xsize; ++i) {
+            float v = mk[i] ? (float)s[i] : 0.0f;
+            sum_x[i] += v;
+            sum_y[i] += v * v;
+          }
+        }
+
+        // Sum over the columns in the kernel and compute the threshold
+        for (int i = 0, k = j * xsize; i < xsize; ++i, ++k) {
+          dst[k] = false;
+          if (count_[k] == 0 || !(src[k] > threshold_)) {
+            continue;
+          }
+          int i0 = std::max(i - kxsize, 0);
+          int i1 = std::min(i + kxsize, xsize - 1);
+          float x = 0;
+          float y = 0;
+          for (int ii = i0; ii <= i1; ++ii) {
+            x += sum_x[ii];
+            y += sum_y[ii];
+          }
+          float m = count_[k];
+          float p = src[k];
+          if (x >= 0) {
+            if (gain == 0) {
+              float a = m * y - x * x - x * (m-1);
+              float b = m * p - x;
+              float c = x * nsig_b * (float)sqrt_term_[k];
+              float d = nsig_s * std::sqrt(x * m);
+              dst[k] = a > c && b > d;
+            } else {
+              float g = gain[k];
+              float a = m * y - x * x;
+              float b = m * p - x;
+              float c = g * x * (m-1+nsig_b * (float)sqrt_term_[k]);
+              float d = nsig_s * std::sqrt(g * x * m);
+              dst[k] = a > c && b > d;
+            }
+          }
+        }
+      }
+    }
+
+    int2 image_size_;
+    int2 kernel_size_;
+    double nsig_b_;
+    double nsig_s_;
+    double threshold_;
+    int min_count_;
+    bool use_float_;
+    bool has_mask_;
+    std::size_t num_mask_updates_;
+    std::size_t num_fallback_;
+    DispersionThreshold fallback_;
+    af::shared<bool> mask_;
+    std::vector<int> count_;
+    std::vector<double> sqrt_term_;
+    std::vector<char> buffer_;
+    std::vector<float> sum_x_;
+    std::vector<float> sum_y_;
+  };
+
+
   /**
    * A class to help debug spot finding by exposing the results of various bits
    * of processing.
@@ -25,11 +25,39 @@ namespace dials { namespace algorithms { namespace boost_python {
     def("clean_3d", &clean_3d,
       (arg("dirty_beam"), arg("dirty_map"), arg("n_peaks"), arg("gamma")=1));
 
+    void (*map_centroids_selection)(
+        af::ref<double, af::c_grid<3> > const &,
+        af::const_ref<vec3<double> > const &,
+        af::ref<bool> const &,
+        double,
+        double) = &map_centroids_to_reciprocal_space_grid;
+
+    af::shared<std::size_t> (*map_centroids_indices)(
+        af::ref<double, af::c_grid<3> > const &,
+        af::const_ref<vec3<double> > const &,
+        af::const_ref<std::size_t> const &,
+        double,
+        double,
+        std::size_t) = &map_centroids_to_reciprocal_space_grid;
+
     def("map_centroids_to_reciprocal_space_grid",
-      &map_centroids_to_reciprocal_space_grid,
+      map_centroids_selection,
       (arg("grid"), arg("reciprocal_space_vectors"),
        arg("selection"), arg("d_min"), arg("b_iso")=0));
 
+    def("map_centroids_to_reciprocal_space_grid",
+      map_centroids_indices,
+      (arg("grid"), arg("reciprocal_space_vectors"),
+       arg("indices"), arg("d_min"), arg("b_iso")=0, arg("nthreads")=1));
+
+    class_<RealFFT3D>("RealFFT3D", no_init)
+      .def(init<const af::int3&>((
+        arg("gridding"))))
+      .def("gridding", &RealFFT3D::gridding)
+      .def("squared_real_part", &RealFFT3D::squared_real_part, (
+        arg("grid"),
+        arg("result")))
+      ;
   }
 
 }
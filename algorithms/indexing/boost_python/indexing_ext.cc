@@ -11,6 +11,7 @@
 #include <boost/python.hpp>
 #include <boost/python/def.hpp>
 #include <dials/algorithms/indexing/index.h>
+#include <dials/algorithms/indexing/real_space_grid_search.h>
 
 namespace dials { namespace algorithms { namespace boost_python {
 
@@ -56,11 +57,21 @@ namespace dials { namespace algorithms { namespace boost_python {
       .def("crystal_ids", &w_t::crystal_ids);
   }
 
+  void export_real_space_grid_search() {
+    def("real_space_grid_search_functional",
+      &real_space_grid_search_functional,
+      (arg("reciprocal_space_vectors"),
+       arg("vectors"),
+       arg("nthreads")=1,
+       arg("block_size")=16));
+  }
+
   BOOST_PYTHON_MODULE(dials_algorithms_indexing_ext)
   {
     export_fft3d();
     export_assign_indices();
     export_assign_indices_local();
+    export_real_space_grid_search();
   }
 
 }}} // namespace = dials::algorithms::boost_python
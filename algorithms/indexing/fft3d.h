@@ -18,7 +18,12 @@
 #include <scitbx/math/utils.h>
 
 #include <cstdlib>
+#include <vector>
+#include <algorithm>
+#include <boost/bind.hpp>
+#include <boost/thread.hpp>
 #include <scitbx/array_family/versa_matrix.h>
+#include <scitbx/fftpack/real_to_complex_3d.h>
 #include <dials/array_family/scitbx_shared_and_versa.h>
 #include <dials/algorithms/spot_prediction/rotation_angles.h>
 #include <dxtbx/model/scan_helpers.h>
@@ -219,6 +224,251 @@ namespace dials { namespace algorithms {
     }
   }
 
+  namespace detail {
+
+    /**
+     * The parameters for mapping the points to the grid
+     */
+    struct MapCentroidsParams {
+      int n_points;
+      double d_min;
+      double b_iso;
+    };
+
+    /**
+     * Compute the grid point and value for a chunk of the reciprocal lattice
+     * points and bin them by the slab of the grid they fall in. Points
+     * outside the resolution limit or the grid are given a grid offset of -1.
+     */
+    inline
+    void map_centroids_bin_chunk(
+        af::const_ref<vec3<double> > reciprocal_space_vectors,
+        af::const_ref<std::size_t> indices,
+        af::ref<long> offset,
+        af::ref<double> value,
+        std::vector< std::vector<std::size_t> > *bins,
+        std::size_t first,
+        std::size_t last,
+        MapCentroidsParams params) {
+      const int n_points = params.n_points;
+      const double d_min = params.d_min;
+      const double b_iso = params.b_iso;
+      const double rlgrid = 2 / (d_min * n_points);
+      const double one_over_rlgrid = 1/rlgrid;
+      const int half_n_points = n_points/2;
+      const std::size_t nslabs = bins->size();
+      for (std::size_t i = first; i < last; ++i) {
+        offset[i] = -1;
+        const vec3<double> v = reciprocal_space_vectors[indices[i]];
+        const double v_length = v.length();
+        const double d_spacing = 1/v_length;
+        if (d_spacing < d_min) {
+          continue;
+        }
+        vec3<int> coord;
+        for (int j=0; j<3; j++) {
+          coord[j] = scitbx::math::iround(v[j] * one_over_rlgrid) + half_n_points;
+        }
+        if ((coord.max() >= n_points) || coord.min() < 0) {
+          continue;
+        }
+        offset[i] = ((long)coord[0] * n_points + coord[1]) * n_points + coord[2];
+        value[i] = (b_iso != 0) ? std::exp(-b_iso * v_length * v_length / 4.0) : 1;
+        (*bins)[coord[0] * nslabs / n_points].push_back(i);
+      }
+    }
+
+    /**
+     * Set the grid points in one slab of the grid. The bins of each chunk
+     * are in the order of the reciprocal lattice points, so where points
+     * share a grid point the last one is used as in the single threaded
+     * version.
+     */
+    inline
+    void map_centroids_fill_slab(
+        af::ref<double, af::c_grid<3> > grid,
+        af::const_ref<long> offset,
+        af::const_ref<double> value,
+        const std::vector< std::vector< std::vector<std::size_t> > > *bins,
+        std::size_t slab) {
+      for (std::size_t c = 0; c < bins->size(); ++c) {
+        const std::vector<std::size_t> &bin = (*bins)[c][slab];
+        for (std::size_t k = 0; k < bin.size(); ++k) {
+          grid[offset[bin[k]]] = value[bin[k]];
+        }
+      }
+    }
+
+  }
+
+  /**
+   * Map the reciprocal lattice points to the grid using multiple threads.
+   * The points are divided into chunks which are binned by the slab of the
+   * grid they fall in, then each slab of the grid is filled by its own
+   * thread so no two threads write to the same part of the grid.
+   * @param grid The reciprocal space grid
+   * @param reciprocal_space_vectors The reciprocal lattice points
+   * @param indices The indices of the points to map
+   * @param d_min The resolution limit
+   * @param b_iso The isotropic B factor for the value at each point
+   * @param nthreads The number of threads
+   * @returns The indices of the points mapped to the grid
+   */
+  inline
+  af::shared<std::size_t> map_centroids_to_reciprocal_space_grid(
+    af::ref<double, af::c_grid<3> > const & grid,
+    af::const_ref<vec3<double> > const & reciprocal_space_vectors,
+    af::const_ref<std::size_t> const & indices,
+    double d_min,
+    double b_iso,
+    std::size_t nthreads)
+  {
+    typedef af::c_grid<3>::index_type index_t;
+    index_t const gridding_n_real = index_t(grid.accessor());
+    DIALS_ASSERT(d_min >= 0);
+    DIALS_ASSERT(nthreads > 0);
+    DIALS_ASSERT(gridding_n_real[0] == gridding_n_real[1]);
+    DIALS_ASSERT(gridding_n_real[0] == gridding_n_real[2]);
+    for (std::size_t i = 0; i < indices.size(); ++i) {
+      DIALS_ASSERT(indices[i] < reciprocal_space_vectors.size());
+    }
+    const int n_points = gridding_n_real[0];
+    nthreads = std::max((std::size_t)1, std::min(nthreads, (std::size_t)n_points));
+    detail::MapCentroidsParams params;
+    params.n_points = n_points;
+    params.d_min = d_min;
+    params.b_iso = b_iso;
+
+    // Compute the grid points and bin them by slab
+    af::shared<long> offset(indices.size());
+    af::shared<double> value(indices.size());
+    std::vector< std::vector< std::vector<std::size_t> > > bins(nthreads,
+        std::vector< std::vector<std::size_t> >(nthreads));
+    std::size_t chunk_size = (indices.size() + nthreads - 1) / nthreads;
+    if (nthreads == 1) {
+      detail::map_centroids_bin_chunk(
+          reciprocal_space_vectors, indices, offset.ref(), value.ref(),
+          &bins[0], 0, indices.size(), params);
+      detail::map_centroids_fill_slab(
+          grid, offset.const_ref(), value.const_ref(), &bins, 0);
+    } else {
+      boost::thread_group bin_threads;
+      for (std::size_t c = 0; c < nthreads; ++c) {
+        bin_threads.create_thread(boost::bind(
+              &detail::map_centroids_bin_chunk,
+              reciprocal_space_vectors, indices, offset.ref(), value.ref(),
+              &bins[c],
+              std::min(c * chunk_size, indices.size()),
+              std::min((c + 1) * chunk_size, indices.size()),
+              params));
+      }
+      bin_threads.join_all();
+
+      // Fill each slab of the grid
+      boost::thread_group fill_threads;
+      for (std::size_t s = 0; s < nthreads; ++s) {
+        fill_threads.create_thread(boost::bind(
+              &detail::map_centroids_fill_slab,
+              grid, offset.const_ref(), value.const_ref(), &bins, s));
+      }
+      fill_threads.join_all();
+    }
+
+    // The indices of the points which were used
+    af::shared<std::size_t> result;
+    for (std::size_t i = 0; i < indices.size(); ++i) {
+      if (offset[i] >= 0) {
+        result.push_back(indices[i]);
+      }
+    }
+    return result;
+  }
+
+
+  /**
+   * A real to complex 3D FFT of a real grid, giving the square of the real
+   * part of the transform on the full grid. The transform is done in place in
+   * a buffer padded for the half complex result, and the other half of the
+   * result is filled in from the Hermitian symmetry F(-h) = F*(h). The FFT
+   * plan and the buffer are allocated once and reused for each transform.
+   */
+  class RealFFT3D {
+  public:
+
+    /**
+     * Create the FFT plan and buffer
+     * @param gridding The dimensions of the real grid
+     */
+    RealFFT3D(const af::int3 &gridding)
+      : fft_(gridding),
+        buffer_(af::c_grid<3>(
+              fft_.m_real()[0],
+              fft_.m_real()[1],
+              fft_.m_real()[2]), 0) {}
+
+    /** @returns The dimensions of the real grid */
+    af::int3 gridding() const {
+      return fft_.n_real();
+    }
+
+    /**
+     * Compute the square of the real part of the FFT of the grid. The grid
+     * is copied into the buffer before the transform so the result may be
+     * written back into the grid.
+     * @param grid The real grid
+     * @param result The square of the real part of the transform
+     */
+    void squared_real_part(
+        const af::const_ref< double, af::c_grid<3> > &grid,
+        af::ref< double, af::c_grid<3> > result) {
+      const af::int3 n = fft_.n_real();
+      for (std::size_t i = 0; i < 3; ++i) {
+        DIALS_ASSERT(grid.accessor()[i] == n[i]);
+        DIALS_ASSERT(result.accessor()[i] == n[i]);
+      }
+      const std::size_t n0 = n[0];
+      const std::size_t n1 = n[1];
+      const std::size_t n2 = n[2];
+      const std::size_t m2 = buffer_.accessor()[2];
+
+      // Copy the grid into the buffer, leaving the padding as zero
+      for (std::size_t i = 0; i < n0; ++i) {
+        for (std::size_t j = 0; j < n1; ++j) {
+          for (std::size_t k = 0; k < n2; ++k) {
+            buffer_(i, j, k) = grid(i, j, k);
+          }
+          for (std::size_t k = n2; k < m2; ++k) {
+            buffer_(i, j, k) = 0.0;
+          }
+        }
+      }
+
+      // The transform leaves the complex value for (i, j, k) in the buffer at
+      // (i, j, 2k) and (i, j, 2k+1) for k <= n2 / 2
+      fft_.forward(buffer_.ref());
+      const std::size_t nc = n2 / 2 + 1;
+      for (std::size_t i = 0; i < n0; ++i) {
+        for (std::size_t j = 0; j < n1; ++j) {
+          for (std::size_t k = 0; k < nc; ++k) {
+            double re = buffer_(i, j, 2 * k);
+            result(i, j, k) = re * re;
+          }
+          const std::size_t ii = (n0 - i) % n0;
+          const std::size_t jj = (n1 - j) % n1;
+          for (std::size_t k = nc; k < n2; ++k) {
+            double re = buffer_(ii, jj, 2 * (n2 - k));
+            result(i, j, k) = re * re;
+          }
+        }
+      }
+    }
+
+  private:
+
+    scitbx::fftpack::real_to_complex_3d<double> fft_;
+    af::versa< double, af::c_grid<3> > buffer_;
+  };
+
 
 }}
 
@@ -31,9 +31,37 @@
 
 class indexer_fft3d(indexer_base):
 
+  # The real to complex FFT for the current gridding. This is a class
+  # attribute as the stills indexer does not call this __init__.
+  _real_fft_3d = None
+
   def __init__(self, reflections, imagesets, params):
     super(indexer_fft3d, self).__init__(reflections, imagesets, params)
 
+  def index(self):
+    # The FFT buffer is the size of the grid, so only keep it while indexing
+    try:
+      return super(indexer_fft3d, self).index()
+    finally:
+      self._real_fft_3d = None
+
+  def real_fft_3d(self):
+    '''
+    Get the real to complex 3D FFT for the current gridding. The FFT plan and
+    its buffer are reused by later indexing attempts with the same gridding
+    and released when indexing finishes.
+
+    :return: The FFT
+
+    '''
+    from dials.algorithms.indexing import RealFFT3D
+    if (self._real_fft_3d is None or
+        tuple(self._real_fft_3d.gridding()) != tuple(self.gridding)):
+      # Free the old buffer before allocating the new one
+      self._real_fft_3d = None
+      self._real_fft_3d = RealFFT3D(self.gridding)
+    return self._real_fft_3d
+
   def find_lattices(self):
     if self.params.multiple_lattice_search.cluster_analysis_search:
       self.find_basis_vector_combinations_cluster_analysis()
@@ -69,6 +97,10 @@ def find_lattices(self):
     return experiments
 
   def map_centroids_to_reciprocal_space_grid(self):
+    '''
+    Map the unindexed reflections to the reciprocal space grid.
+
+    '''
     d_min = self.params.fft3d.reciprocal_space_grid.d_min
 
     n_points = self.gridding[0]
@@ -82,18 +114,22 @@ def map_centroids_to_reciprocal_space_grid(self):
 
     logger.info("FFT gridding: (%i,%i,%i)" %self.gridding)
 
-    grid = flex.double(flex.grid(self.gridding), 0)
+    # Reuse the grid from the last attempt if it is the right size
+    grid = getattr(self, 'reciprocal_space_grid', None)
+    if grid is not None and tuple(grid.all()) == tuple(self.gridding):
+      grid.fill(0)
+    else:
+      grid = flex.double(flex.grid(self.gridding), 0)
 
-    selection = self.reflections['id'] == -1
+    selection = (self.reflections['id'] == -1).iselection()
 
     if self.params.b_iso is libtbx.Auto:
       self.params.b_iso = -4 * d_min**2 * math.log(0.05)
       logger.debug("Setting b_iso = %.1f" %self.params.b_iso)
     from dials.algorithms.indexing import map_centroids_to_reciprocal_space_grid
-    map_centroids_to_reciprocal_space_grid(
+    reflections_used_for_indexing = map_centroids_to_reciprocal_space_grid(
       grid, self.reflections['rlp'], selection,
-      d_min, b_iso=self.params.b_iso)
-    reflections_used_for_indexing = selection.iselection()
+      d_min, b_iso=self.params.b_iso, nthreads=self.params.nproc)
 
     self.reciprocal_space_grid = grid
     self.reflections_used_for_indexing = reflections_used_for_indexing
@@ -129,22 +165,18 @@ def fft(self):
 
     #gb_to_bytes = 1073741824
     #bytes_to_gb = 1/gb_to_bytes
-    #(128**3)*8*2*bytes_to_gb
-    #0.03125
-    #(256**3)*8*2*bytes_to_gb
-    #0.25
-    #(512**3)*8*2*bytes_to_gb
-    #2.0
-
-    fft = fftpack.complex_to_complex_3d(self.gridding)
-    grid_complex = flex.complex_double(
-      reals=self.reciprocal_space_grid,
-      imags=flex.double(self.reciprocal_space_grid.size(), 0))
-    grid_transformed = fft.forward(grid_complex)
-    #self.grid_real = flex.pow2(flex.abs(grid_transformed))
-    self.grid_real = flex.pow2(flex.real(grid_transformed))
-    #self.grid_real = flex.pow2(flex.imag(self.grid_transformed))
-    del grid_transformed
+    #(128**3)*8*bytes_to_gb
+    #0.015625
+    #(256**3)*8*bytes_to_gb
+    #0.125
+    #(512**3)*8*bytes_to_gb
+    #1.0
+
+    # The grid is real so use a real to complex FFT. The transform is written
+    # back into the reciprocal space grid to avoid allocating another grid.
+    fft = self.real_fft_3d()
+    fft.squared_real_part(self.reciprocal_space_grid, self.reciprocal_space_grid)
+    self.grid_real = self.reciprocal_space_grid
 
     if self.params.debug:
       self.debug_write_ccp4_map(map_data=self.grid_real, file_name="fft3d.map")
@@ -609,12 +641,9 @@ def find_peaks_clean(self):
                         self.imagesets[0].get_goniometer().get_rotation_axis(),
                         rlgrid, d_min, self.params.b_iso)
 
-    fft = fftpack.complex_to_complex_3d(self.gridding)
-    grid_complex = flex.complex_double(
-      reals=grid,
-      imags=flex.double(grid.size(), 0))
-    grid_transformed = fft.forward(grid_complex)
-    grid_real = flex.pow2(flex.real(grid_transformed))
+    fft = self.real_fft_3d()
+    grid_real = flex.double(flex.grid(self.gridding), 0)
+    fft.squared_real_part(grid, grid_real)
 
     gamma = 1
     peaks = flex.vec3_double()
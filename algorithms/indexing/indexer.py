@@ -12,6 +12,7 @@
 
 from __future__ import absolute_import, division
 import math
+import platform
 import logging
 logger = logging.getLogger(__name__)
 
@@ -1321,74 +1322,6 @@ def choose_best_orientation_matrix(self, candidate_orientation_matrices):
         volume_cutoff=filter_params.volume_cutoff,
         n_indexed_cutoff=filter_params.n_indexed_cutoff)
 
-    def run_one_refinement(args):
-      params, reflections, experiments = args
-      indexed_reflections = reflections.select(reflections['id'] > -1)
-
-      from dials.command_line import check_indexing_symmetry
-      grid_search_scope = params.indexing.check_misindexing.grid_search_scope
-
-      best_offset = (0,0,0)
-      best_cc = 0.0
-      best_nref = 0
-
-      if grid_search_scope > 0:
-        offsets, ccs, nref \
-          = check_indexing_symmetry.get_indexing_offset_correlation_coefficients(
-          indexed_reflections, experiments.crystals()[0],
-          grid=grid_search_scope, map_to_asu=True)
-
-        if len(offsets) > 1:
-          max_nref = flex.max(nref)
-
-          # select "best" solution - needs nref > 0.5 max nref && highest CC
-          # FIXME perform proper statistical test in here do not like heuristics
-
-          for offset, cc, n in zip(offsets, ccs, nref):
-            if n < (max_nref // 2):
-              continue
-            if cc > best_cc:
-              best_cc = cc
-              best_offset = offset
-              best_nref = n
-
-          #print offsets[13], nref[13], '%.2f' %ccs[13] # (0,0,0)
-          #print best_offset, best_nref, '%.2f' %best_cc
-
-          if best_offset != (0,0,0):
-            logger.debug('Applying h,k,l offset: (%i, %i, %i)' %best_offset
-                 + ' [cc = %.2f]' %best_cc)
-            indexed_reflections['miller_index'] = apply_hkl_offset(
-              indexed_reflections['miller_index'], best_offset)
-
-      from dials.algorithms.refinement import RefinerFactory
-      logger = logging.getLogger('dials.algorithms.refinement.refiner')
-      level = logger.getEffectiveLevel()
-      logger.setLevel(logging.ERROR)
-      disabled = logger.disabled
-      logger.disabled = True
-      try:
-        refiner = RefinerFactory.from_parameters_data_experiments(
-          params, indexed_reflections, experiments,
-          verbosity=0)
-        refiner.run()
-      except (RuntimeError, ValueError, Sorry) as e:
-        return
-      else:
-        rmsds = refiner.rmsds()
-        xy_rmsds = math.sqrt(rmsds[0]**2 + rmsds[1]**2)
-        model_likelihood = 1.0 - xy_rmsds
-        soln = Solution(model_likelihood=model_likelihood,
-                        crystal=experiments.crystals()[0],
-                        rmsds=rmsds,
-                        n_indexed=len(indexed_reflections),
-                        fraction_indexed=float(len(indexed_reflections))/len(reflections),
-                        hkl_offset=best_offset)
-        return soln
-      finally:
-        logger.disabled = disabled
-        logger.setLevel(level)
-
     import copy
     params = copy.deepcopy(self.all_params)
     params.refinement.parameterisation.auto_reduction.action = "fix"
@@ -1490,14 +1423,15 @@ def run_one_refinement(args):
 
       args.append((params, refl, experiments))
 
-    from libtbx import easy_mp
-    results = easy_mp.parallel_map(
-      run_one_refinement,
-      args,
-      processes=self.params.nproc,
-      preserve_exception_message=True,
-    )
+    nproc = min(self.params.nproc, len(args))
+    if platform.system() == "Windows":
+      nproc = 1
+    n_indexed = [(refl['id'] > -1).count(True) for _, refl, _ in args]
+    results = refine_candidates(
+      args, n_indexed, solutions.min_n_indexed_fraction, nproc)
 
+    # Add the solutions in the order of the candidates so that the choice of
+    # solution does not depend on the order in which they were refined
     for soln in results:
       if soln is None:
         continue
@@ -1752,6 +1686,145 @@ class Solution(group_args):
   pass
 
 
+# The candidate models being refined by choose_best_orientation_matrix
+_candidates = []
+
+def run_one_refinement(index):
+  '''
+  Refine one of the candidate models stored by choose_best_orientation_matrix.
+
+  :param index: The index of the candidate
+  :return: The index and the solution, or None if refinement failed
+
+  '''
+  params, reflections, experiments = _candidates[index]
+  indexed_reflections = reflections.select(reflections['id'] > -1)
+
+  from dials.command_line import check_indexing_symmetry
+  grid_search_scope = params.indexing.check_misindexing.grid_search_scope
+
+  best_offset = (0,0,0)
+  best_cc = 0.0
+  best_nref = 0
+
+  if grid_search_scope > 0:
+    offsets, ccs, nref \
+      = check_indexing_symmetry.get_indexing_offset_correlation_coefficients(
+      indexed_reflections, experiments.crystals()[0],
+      grid=grid_search_scope, map_to_asu=True)
+
+    if len(offsets) > 1:
+      max_nref = flex.max(nref)
+
+      # select "best" solution - needs nref > 0.5 max nref && highest CC
+      # FIXME perform proper statistical test in here do not like heuristics
+
+      for offset, cc, n in zip(offsets, ccs, nref):
+        if n < (max_nref // 2):
+          continue
+        if cc > best_cc:
+          best_cc = cc
+          best_offset = offset
+          best_nref = n
+
+      #print offsets[13], nref[13], '%.2f' %ccs[13] # (0,0,0)
+      #print best_offset, best_nref, '%.2f' %best_cc
+
+      if best_offset != (0,0,0):
+        logger.debug('Applying h,k,l offset: (%i, %i, %i)' %best_offset
+             + ' [cc = %.2f]' %best_cc)
+        indexed_reflections['miller_index'] = apply_hkl_offset(
+          indexed_reflections['miller_index'], best_offset)
+
+  from dials.algorithms.refinement import RefinerFactory
+  refiner_logger = logging.getLogger('dials.algorithms.refinement.refiner')
+  level = refiner_logger.getEffectiveLevel()
+  refiner_logger.setLevel(logging.ERROR)
+  disabled = refiner_logger.disabled
+  refiner_logger.disabled = True
+  try:
+    refiner = RefinerFactory.from_parameters_data_experiments(
+      params, indexed_reflections, experiments,
+      verbosity=0)
+    refiner.run()
+  except (RuntimeError, ValueError, Sorry) as e:
+    return index, None
+  else:
+    rmsds = refiner.rmsds()
+    xy_rmsds = math.sqrt(rmsds[0]**2 + rmsds[1]**2)
+    model_likelihood = 1.0 - xy_rmsds
+    soln = Solution(model_likelihood=model_likelihood,
+                    crystal=experiments.crystals()[0],
+                    rmsds=rmsds,
+                    n_indexed=len(indexed_reflections),
+                    fraction_indexed=float(len(indexed_reflections))/len(reflections),
+                    hkl_offset=best_offset)
+    return index, soln
+  finally:
+    refiner_logger.disabled = disabled
+    refiner_logger.setLevel(level)
+
+
+def refine_candidates(candidates, n_indexed, min_n_indexed_fraction, nproc,
+                      refine=run_one_refinement):
+  '''
+  Refine the candidate models, those indexing the most reflections first.
+  Once a candidate has been refined, any candidate indexing fewer than
+  min_n_indexed_fraction of the reflections indexed by the best refined
+  candidate is not refined at all.
+
+  The workers are forked after the candidates are stored so each gets a
+  read-only copy of the reflection tables rather than having them pickled.
+  At most nproc candidates are refined at once, so with nproc > 1 only the
+  first nproc - 1 candidates skipped by the serial search may be refined as
+  well, before any result comes back. The solution filter removes them again.
+
+  :param candidates: The (params, reflections, experiments) of each candidate
+  :param n_indexed: The number of reflections indexed by each candidate
+  :param min_n_indexed_fraction: The fraction of the best n_indexed needed
+  :param nproc: The number of processes
+  :param refine: The function refining the candidate at an index
+  :return: The solution of each candidate, or None if it was not refined or
+           refinement failed
+
+  '''
+  order = sorted(range(len(candidates)), key=lambda i: -n_indexed[i])
+  results = [None] * len(candidates)
+  best_n_indexed = [0]
+
+  def remaining():
+    for i in order:
+      if n_indexed[i] < min_n_indexed_fraction * best_n_indexed[0]:
+        logger.debug("Skipping %d candidates indexing too few reflections" %
+                     (len(order) - order.index(i)))
+        return
+      yield i
+
+  def refined(result):
+    i, soln = result
+    results[i] = soln
+    if soln is not None:
+      best_n_indexed[0] = max(best_n_indexed[0], soln.n_indexed)
+
+  _candidates[:] = candidates
+  try:
+    if nproc > 1:
+      from dials.util.mp import bounded_parallel_map
+      bounded_parallel_map(
+        func           = refine,
+        iterable       = remaining(),
+        nproc          = nproc,
+        callback       = refined,
+        max_pending    = nproc,
+        preserve_order = False)
+    else:
+      for i in remaining():
+        refined(refine(i))
+  finally:
+    del _candidates[:]
+  return results
+
+
 def filter_doubled_cell(solutions):
   from dials.algorithms.indexing.compare_orientation_matrices import difference_rotation_matrix_axis_angle
   accepted_solutions = []
@@ -1785,6 +1858,11 @@ def filter_doubled_cell(solutions):
 
 # Tracker for solutions based on code in rstbx/dps_core/basis_choice.py
 class SolutionTrackerFilter(object):
+
+  # Solutions indexing fewer than this fraction of the reflections indexed by
+  # the best solution are rejected before any of the other filters
+  min_n_indexed_fraction = 0.05
+
   def __init__(self, check_doubled_cell=True, likelihood_cutoff=0.8,
                volume_cutoff=1.25, n_indexed_cutoff=0.9):
     self.check_doubled_cell = check_doubled_cell
@@ -1831,7 +1909,7 @@ def update_analysis(self):
     # pre-filter out solutions that only account for a very small
     # percentage of the indexed spots relative to the best one
     self.filtered_solutions = self.filter_by_n_indexed(
-      self.all_solutions, n_indexed_cutoff=0.05) # 5 percent
+      self.all_solutions, n_indexed_cutoff=self.min_n_indexed_fraction)
 
     if self.check_doubled_cell:
       self.filtered_solutions = filter_doubled_cell(self.filtered_solutions)
@@ -1869,6 +1947,10 @@ def __str__(self):
 
 
 class SolutionTrackerWeighted(object):
+
+  # The scores are relative to all the solutions so none can be rejected early
+  min_n_indexed_fraction = 0
+
   def __init__(self, power=2, volume_weight=1, n_indexed_weight=1, rmsd_weight=1):
     self.volume_weight = volume_weight
     self.n_indexed_weight = n_indexed_weight
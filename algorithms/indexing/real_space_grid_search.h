@@ -0,0 +1,129 @@
+/*
+ * real_space_grid_search.h
+ *
+ *  Copyright (C) 2014 Diamond Light Source
+ *
+ *  Author: Richard Gildea
+ *
+ *  This code is distributed under the BSD license, a copy of which is
+ *  included in the root directory of this package.
+ */
+#ifndef DIALS_ALGORITHMS_INDEXING_REAL_SPACE_GRID_SEARCH_H
+#define DIALS_ALGORITHMS_INDEXING_REAL_SPACE_GRID_SEARCH_H
+
+#include <cmath>
+#include <vector>
+#include <algorithm>
+#include <boost/bind.hpp>
+#include <boost/thread.hpp>
+#include <scitbx/constants.h>
+#include <scitbx/vec3.h>
+#include <dials/array_family/scitbx_shared_and_versa.h>
+#include <dials/error.h>
+
+namespace dials { namespace algorithms {
+
+  using scitbx::vec3;
+
+  namespace detail {
+
+    /**
+     * Evaluate the functional for the blocks of search vectors taken by one
+     * thread. For each block the dot products of a chunk of reciprocal
+     * lattice points with the vectors in the block are computed and their
+     * cosines summed, so the chunk stays in cache for the whole block.
+     */
+    inline
+    void real_space_grid_search_functional_thread(
+        af::const_ref< vec3<double> > reciprocal_space_vectors,
+        af::const_ref< vec3<double> > vectors,
+        af::ref<double> result,
+        std::size_t block_size,
+        std::size_t thread,
+        std::size_t nthreads) {
+      const std::size_t chunk_size = 1024;
+      const double two_pi = 2.0 * scitbx::constants::pi;
+      const std::size_t n = reciprocal_space_vectors.size();
+      std::vector<double> dot(chunk_size * block_size);
+      for (std::size_t k0 = thread * block_size; k0 < vectors.size();
+           k0 += nthreads * block_size) {
+        std::size_t k1 = std::min(k0 + block_size, vectors.size());
+        for (std::size_t k = k0; k < k1; ++k) {
+          result[k] = 0.0;
+        }
+        for (std::size_t j0 = 0; j0 < n; j0 += chunk_size) {
+          std::size_t j1 = std::min(j0 + chunk_size, n);
+
+          // The block of the matrix product (rlps x vectors)
+          for (std::size_t k = k0; k < k1; ++k) {
+            double *d = &dot[(k - k0) * chunk_size];
+            for (std::size_t j = j0; j < j1; ++j) {
+              d[j - j0] = reciprocal_space_vectors[j] * vectors[k];
+            }
+          }
+
+          // Sum the cosines in the same order as a single sum over all the
+          // reciprocal lattice points
+          for (std::size_t k = k0; k < k1; ++k) {
+            const double *d = &dot[(k - k0) * chunk_size];
+            double sum = result[k];
+            for (std::size_t j = 0; j < j1 - j0; ++j) {
+              sum += std::cos(two_pi * d[j]);
+            }
+            result[k] = sum;
+          }
+        }
+      }
+    }
+
+  }
+
+  /**
+   * Evaluate the real space grid search functional
+   *
+   *   f(v) = sum_j cos(2 pi s_j . v)
+   *
+   * for a list of search vectors v, where s_j are the reciprocal lattice
+   * points. The vectors are evaluated in blocks and the blocks are shared
+   * between threads. The result for each vector is the same as evaluating the
+   * sum for that vector on its own.
+   * @param reciprocal_space_vectors The reciprocal lattice points
+   * @param vectors The search vectors
+   * @param nthreads The number of threads
+   * @param block_size The number of vectors evaluated together
+   * @returns The functional for each vector
+   */
+  inline
+  af::shared<double> real_space_grid_search_functional(
+      const af::const_ref< vec3<double> > &reciprocal_space_vectors,
+      const af::const_ref< vec3<double> > &vectors,
+      std::size_t nthreads = 1,
+      std::size_t block_size = 16) {
+    DIALS_ASSERT(nthreads > 0);
+    DIALS_ASSERT(block_size > 0);
+    af::shared<double> result(vectors.size(), 0.0);
+    std::size_t nblocks = (vectors.size() + block_size - 1) / block_size;
+    nthreads = std::max((std::size_t)1, std::min(nthreads, nblocks));
+    if (nthreads == 1) {
+      detail::real_space_grid_search_functional_thread(
+          reciprocal_space_vectors, vectors, result.ref(), block_size, 0, 1);
+    } else {
+      boost::thread_group threads;
+      for (std::size_t t = 0; t < nthreads; ++t) {
+        threads.create_thread(boost::bind(
+              &detail::real_space_grid_search_functional_thread,
+              reciprocal_space_vectors,
+              vectors,
+              result.ref(),
+              block_size,
+              t,
+              nthreads));
+      }
+      threads.join_all();
+    }
+    return result;
+  }
+
+}} // namespace dials::algorithms
+
+#endif // DIALS_ALGORITHMS_INDEXING_REAL_SPACE_GRID_SEARCH_H
@@ -21,6 +21,7 @@
      indexer_base, optimise_basis_vectors
 from dials.algorithms.indexing.indexer import \
      is_approximate_integer_multiple
+from dials.algorithms.indexing import real_space_grid_search_functional
 from dxtbx.model.experiment_list import Experiment, ExperimentList
 
 
@@ -70,13 +71,12 @@ def compute_functional(vector):
     logger.info(
       "Number of search vectors: %i" %(len(SST.angles) * len(unique_cell_dimensions)))
     vectors = flex.vec3_double()
-    function_values = flex.double()
     for i, direction in enumerate(SST.angles):
       for l in unique_cell_dimensions:
         v = matrix.col(direction.dvec) * l
-        f = compute_functional(v.elems)
         vectors.append(v.elems)
-        function_values.append(f)
+    function_values = real_space_grid_search_functional(
+      reciprocal_lattice_points, vectors, nthreads=self.params.nproc)
 
     perm = flex.sort_permutation(function_values, reverse=True)
     vectors = vectors.select(perm)
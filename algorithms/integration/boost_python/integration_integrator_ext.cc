@@ -276,6 +276,7 @@ namespace dials { namespace algorithms { namespace boost_python {
           return_internal_reference<>())
       .def("data", &ReflectionManager::data)
       .def("num_reflections", &ReflectionManager::num_reflections)
+      .def("shoebox_volume", &ReflectionManager::shoebox_volume)
       ;
 
     class_<ReflectionManagerPerImage>("ReflectionManagerPerImage", no_init)
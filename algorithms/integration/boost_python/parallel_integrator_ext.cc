@@ -168,6 +168,20 @@ namespace dials { namespace algorithms { namespace boost_python {
     self(reflection, ar);
   }
 
+  /**
+   * Record the end of a stage in the profiler counters
+   * @param self The counters
+   * @param stage The stage that has finished
+   * @param pixels The number of pixels processed
+   */
+  void IntegrationProfilerCounters_tick(
+        IntegrationProfiler::Counters &self,
+        std::size_t stage,
+        std::size_t pixels) {
+    DIALS_ASSERT(stage < IntegrationProfiler::NumStages);
+    self.tick((IntegrationProfiler::Stage)stage, pixels);
+  }
+
   /**
    * Initialise the reference calculator
    * @param sampler The sampler
@@ -343,6 +357,31 @@ namespace dials { namespace algorithms { namespace boost_python {
    */
   void export_integrator() {
 
+    class_<IntegrationProfiler::Counters>("IntegrationProfilerCounters")
+      .def("start", &IntegrationProfiler::Counters::start)
+      .def("tick", &IntegrationProfilerCounters_tick, (
+            arg("stage"),
+            arg("pixels")))
+      ;
+
+    class_<IntegrationProfiler>("IntegrationProfiler")
+      .def("accumulate", &IntegrationProfiler::accumulate)
+      .def("num_threads", &IntegrationProfiler::num_threads)
+      .def("time", &IntegrationProfiler::time, (
+            arg("thread"),
+            arg("stage")))
+      .def("count", &IntegrationProfiler::count, (
+            arg("thread"),
+            arg("stage")))
+      .def("pixels", &IntegrationProfiler::pixels, (
+            arg("thread"),
+            arg("stage")))
+      .def("num_stages", &IntegrationProfiler::num_stages)
+      .def("stage_name", &IntegrationProfiler::stage_name)
+      .staticmethod("num_stages")
+      .staticmethod("stage_name")
+      ;
+
     class_<ParallelIntegrator>("MultiThreadedIntegrator", no_init)
       .def(init<
           const af::reflection_table&,
@@ -354,6 +393,8 @@ namespace dials { namespace algorithms { namespace boost_python {
           std::size_t,
           std::size_t,
           bool,
+          bool,
+          std::size_t,
           bool>((
               arg("reflections"),
               arg("imageset"),
@@ -364,9 +405,20 @@ namespace dials { namespace algorithms { namespace boost_python {
               arg("nthreads") = 1,
               arg("buffer_size") = 0,
               arg("use_dynamic_mask") = true,
-              arg("debug") = false)))
+              arg("debug") = false,
+              arg("prefetch") = 0,
+              arg("profile") = false)))
       .def("reflections",
           &ParallelIntegrator::reflections)
+      .def("read_time",
+          &ParallelIntegrator::read_time)
+      .def("wait_time",
+          &ParallelIntegrator::wait_time)
+      .def("process_time",
+          &ParallelIntegrator::process_time)
+      .def("profiler",
+          &ParallelIntegrator::profiler,
+          return_internal_reference<>())
       .def("compute_required_memory",
           &ParallelIntegrator::compute_required_memory, (
             arg("imageset")))
@@ -33,6 +33,24 @@ namespace dials { namespace algorithms { namespace boost_python {
 
   }
 
+  template <typename FloatType>
+  void batch_profile_fitter_wrapper(const char *name) {
+
+    typedef BatchProfileFitter<FloatType> BatchProfileFitterType;
+
+    class_< BatchProfileFitterType >(name, no_init)
+      .def("intensity", &BatchProfileFitterType::intensity)
+      .def("variance", &BatchProfileFitterType::variance)
+      .def("correlation", &BatchProfileFitterType::correlation)
+      .def("niter", &BatchProfileFitterType::niter)
+      .def("maxiter", &BatchProfileFitterType::maxiter)
+      .def("error", &BatchProfileFitterType::error)
+      .def("success", &BatchProfileFitterType::success)
+      .def("__len__", &BatchProfileFitterType::size)
+      ;
+
+  }
+
   template <typename FloatType>
   ProfileFitter<FloatType> make_profile_fitter_1d_1(
           const af::const_ref< FloatType > &d,
@@ -99,6 +117,40 @@ namespace dials { namespace algorithms { namespace boost_python {
     return ProfileFitter<FloatType>(d, b, m, p, eps, maxiter);
   }
 
+  template <typename FloatType>
+  BatchProfileFitter<FloatType> make_batch_profile_fitter_1d(
+          const af::const_ref< FloatType, af::c_grid<2> > &d,
+          const af::const_ref< FloatType, af::c_grid<2> > &b,
+          const af::const_ref< bool, af::c_grid<2> > &m,
+          const af::const_ref< FloatType > &p,
+          double eps,
+          std::size_t maxiter) {
+    return BatchProfileFitter<FloatType>(d, b, m, p, eps, maxiter);
+  }
+
+  template <typename FloatType>
+  BatchProfileFitter<FloatType> make_batch_profile_fitter_3d(
+          const af::const_ref< FloatType, af::c_grid<4> > &d,
+          const af::const_ref< FloatType, af::c_grid<4> > &b,
+          const af::const_ref< bool, af::c_grid<4> > &m,
+          const af::const_ref< FloatType, af::c_grid<3> > &p,
+          double eps,
+          std::size_t maxiter) {
+    return BatchProfileFitter<FloatType>(d, b, m, p, eps, maxiter);
+  }
+
+  template <typename Func>
+  void def_make_batch_profile_fitter(Func func) {
+    def("BatchProfileFitter",
+        func, (
+          arg("data"),
+          arg("background"),
+          arg("mask"),
+          arg("profile"),
+          arg("eps")=1e-3,
+          arg("maxiter")=10));
+  }
+
   template <typename Func>
   void def_make_profile_fitter(Func func) {
     def("ProfileFitter",
@@ -129,6 +181,15 @@ namespace dials { namespace algorithms { namespace boost_python {
     def_make_profile_fitter(&make_profile_fitter_1d_n<double>);
     def_make_profile_fitter(&make_profile_fitter_2d_n<double>);
     def_make_profile_fitter(&make_profile_fitter_3d_n<double>);
+
+    batch_profile_fitter_wrapper<float>("BatchProfileFitterFloat");
+    batch_profile_fitter_wrapper<double>("BatchProfileFitterDouble");
+
+    def_make_batch_profile_fitter(&make_batch_profile_fitter_1d<float>);
+    def_make_batch_profile_fitter(&make_batch_profile_fitter_3d<float>);
+
+    def_make_batch_profile_fitter(&make_batch_profile_fitter_1d<double>);
+    def_make_batch_profile_fitter(&make_batch_profile_fitter_3d<double>);
   }
 
 }}} // namespace = dials::algorithms::boost_python
@@ -13,6 +13,7 @@
 
 #include <algorithm>
 #include <vector>
+#include <limits>
 #include <scitbx/vec2.h>
 #include <scitbx/array_family/tiny_types.h>
 #include <scitbx/array_family/tiny_algebra.h>
@@ -509,6 +510,476 @@ namespace dials { namespace algorithms {
     double error_;
   };
 
+  /**
+   * A class to do profile fitting of many reflections at once.
+   *
+   * All the reflections are fitted to the same reference profile, as when the
+   * shoeboxes have been transformed to the reference grid. The iterations are
+   * run in lock-step over all the reflections with the data stored pixel by
+   * pixel, so the inner loop runs over contiguous values of many reflections.
+   * Only pixels where the profile is positive take part in the iterations and
+   * reflections are dropped from the arrays once they have converged. The
+   * per-reflection sums are done in the same order as in ProfileFitter so the
+   * results are the same as fitting each reflection on its own.
+   *
+   * If a reflection cannot be fitted (where ProfileFitter would throw) its
+   * success flag is set to false instead.
+   */
+  template <typename T = double>
+  class BatchProfileFitter {
+  public:
+
+    typedef T float_type;
+
+    /**
+     * Profile fit a batch of reflections
+     *
+     * The data, background and mask arrays have dimensions (M, N) where M is
+     * the number of reflections and N is the size of the profile array.
+     */
+    BatchProfileFitter(
+        const af::const_ref<T, af::c_grid<2> > &d,
+        const af::const_ref<T, af::c_grid<2> > &b,
+        const af::const_ref<bool, af::c_grid<2> > &m,
+        const af::const_ref<T> &p,
+        double eps = 1e-3,
+        std::size_t maxiter = 10) {
+      fit(d, b, m, p, eps, maxiter);
+    }
+
+    /**
+     * Profile fit a batch of 3D reflections
+     *
+     * The data, background and mask arrays have dimensions (M, Z, Y, X) and
+     * the profile array has dimensions (Z, Y, X)
+     */
+    BatchProfileFitter(
+        const af::const_ref<T, af::c_grid<4> > &d,
+        const af::const_ref<T, af::c_grid<4> > &b,
+        const af::const_ref<bool, af::c_grid<4> > &m,
+        const af::const_ref<T, af::c_grid<3> > &p,
+        double eps = 1e-3,
+        std::size_t maxiter = 10) {
+      fit(detail::as_2d(d), detail::as_2d(b), detail::as_2d(m), p.as_1d(), eps, maxiter);
+    }
+
+    /**
+     * @returns The number of reflections
+     */
+    std::size_t size() const {
+      return success_.size();
+    }
+
+    /**
+     * @returns The intensities
+     */
+    af::shared<double> intensity() const {
+      return intensity_;
+    }
+
+    /**
+     * @returns The variances
+     */
+    af::shared<double> variance() const {
+      return variance_;
+    }
+
+    /**
+     * @returns The correlations
+     */
+    af::shared<double> correlation() const {
+      return correlation_;
+    }
+
+    /**
+     * @returns The number of iterations for each reflection
+     */
+    af::shared<std::size_t> niter() const {
+      return niter_;
+    }
+
+    /**
+     * @returns The maximum number of iterations
+     */
+    std::size_t maxiter() const {
+      return maxiter_;
+    }
+
+    /**
+     * @returns The error in the fit for each reflection
+     */
+    af::shared<double> error() const {
+      return error_;
+    }
+
+    /**
+     * @returns Which reflections were fitted
+     */
+    af::shared<bool> success() const {
+      return success_;
+    }
+
+  protected:
+
+    enum { TILE_SIZE = 32 };
+
+    /**
+     * Profile fit a batch of reflections
+     *
+     * The reflections are fitted a tile at a time so that the copy of the data
+     * stays in the cache.
+     *
+     * @param d The data array
+     * @param b The background array
+     * @param m The mask array
+     * @param p The profile array
+     * @param eps The tolerance
+     * @param maxiter The maximum number of iterations
+     */
+    void fit(
+        const af::const_ref<T, af::c_grid<2> > &d,
+        const af::const_ref<T, af::c_grid<2> > &b,
+        const af::const_ref<bool, af::c_grid<2> > &m,
+        const af::const_ref<T> &p,
+        double eps,
+        std::size_t maxiter) {
+
+      // Save the max iter
+      maxiter_ = maxiter;
+
+      // Check the input
+      DIALS_ASSERT(d.accessor().all_eq(b.accessor()));
+      DIALS_ASSERT(d.accessor().all_eq(m.accessor()));
+      DIALS_ASSERT(d.accessor()[1] == p.size());
+      DIALS_ASSERT(eps > 0.0);
+      DIALS_ASSERT(maxiter >= 1);
+
+      // Allocate the results
+      std::size_t M = d.accessor()[0];
+      intensity_.resize(M, 0.0);
+      variance_.resize(M, -1.0);
+      correlation_.resize(M, 0.0);
+      niter_.resize(M, 0);
+      error_.resize(M, 0.0);
+      success_.resize(M, false);
+
+      // Fit each tile of reflections
+      Tile tile(p);
+      for (std::size_t k0 = 0; k0 < M; k0 += TILE_SIZE) {
+        std::size_t k1 = std::min(k0 + TILE_SIZE, M);
+        tile.copy(k0, k1, d, b, m);
+        fit_tile(tile, k0, eps, maxiter);
+      }
+    }
+
+    /**
+     * The data of a tile of reflections stored as a structure of arrays with
+     * the reflections contiguous for each pixel, i.e. element (i, l) is at
+     * i*size+l. Masked pixels have zero data and background. The data minus
+     * background and the background are also stored for the pixels with a
+     * positive profile only, with masked pixels given an infinite background,
+     * so that they add nothing to the sums in the iterations.
+     */
+    struct Tile {
+      af::const_ref<T> p;
+      std::vector<std::size_t> pixels;
+      std::size_t size;
+      std::vector<T> d;
+      std::vector<T> b;
+      std::vector<T> m;
+      std::vector<T> db;
+      std::vector<T> bg;
+
+      Tile(const af::const_ref<T> &p_)
+        : p(p_),
+          size(0),
+          d(p_.size() * TILE_SIZE),
+          b(p_.size() * TILE_SIZE),
+          m(p_.size() * TILE_SIZE) {
+        for (std::size_t i = 0; i < p.size(); ++i) {
+          if (p[i] > 0) {
+            pixels.push_back(i);
+          }
+        }
+        db.resize(pixels.size() * TILE_SIZE);
+        bg.resize(pixels.size() * TILE_SIZE);
+      }
+
+      void copy(
+          std::size_t k0,
+          std::size_t k1,
+          const af::const_ref<T, af::c_grid<2> > &d_,
+          const af::const_ref<T, af::c_grid<2> > &b_,
+          const af::const_ref<bool, af::c_grid<2> > &m_) {
+        size = k1 - k0;
+        for (std::size_t l = 0; l < size; ++l) {
+          const T *dl = &d_(k0+l,0);
+          const T *bl = &b_(k0+l,0);
+          const bool *ml = &m_(k0+l,0);
+          for (std::size_t i = 0; i < p.size(); ++i) {
+            d[i*size+l] = ml[i] ? dl[i] : 0;
+            b[i*size+l] = ml[i] ? bl[i] : 0;
+            m[i*size+l] = ml[i] ? 1 : 0;
+          }
+        }
+        for (std::size_t j = 0; j < pixels.size(); ++j) {
+          std::size_t i = pixels[j];
+          for (std::size_t l = 0; l < size; ++l) {
+            if (m[i*size+l] > 0) {
+              db[j*size+l] = d[i*size+l] - b[i*size+l];
+              bg[j*size+l] = b[i*size+l];
+            } else {
+              db[j*size+l] = 0;
+              bg[j*size+l] = std::numeric_limits<T>::infinity();
+            }
+          }
+        }
+      }
+    };
+
+    /**
+     * Profile fit the reflections in a tile starting at reflection k0. The
+     * loops over reflections are innermost so the sums for each reflection are
+     * done in the same order as in ProfileFitter.
+     */
+    void fit_tile(Tile &tile, std::size_t k0, double eps, std::size_t maxiter) {
+
+      const double TINY = 1e-7;
+      const double MASSIVE = 1e10;
+
+      const af::const_ref<T> &p = tile.p;
+      std::size_t N = p.size();
+      std::size_t K = tile.pixels.size();
+      std::size_t L = tile.size;
+
+      // Compute the sums of the background and foreground for each reflection
+      // and check the input is valid
+      std::vector<double> sumd(L, 0);
+      std::vector<double> sumb(L, 0);
+      std::vector<double> sump(L, 0);
+      std::vector<double> minI(L, MASSIVE);
+      std::vector<double> bad(L, 0);
+      for (std::size_t i = 0; i < N; ++i) {
+        const T pi = p[i];
+        const T *di = &tile.d[i*L];
+        const T *bi = &tile.b[i*L];
+        const T *mi = &tile.m[i*L];
+        for (std::size_t l = 0; l < L; ++l) {
+          bad[l] += bi[l] >= 0 ? 0.0 : 1.0;
+          bad[l] += di[l] >= 0 ? 0.0 : 1.0;
+          sumd[l] += di[l];
+          sumb[l] += bi[l];
+          sump[l] += mi[l] * pi;
+        }
+        if (pi < 0) {
+          for (std::size_t l = 0; l < L; ++l) {
+            bad[l] += mi[l];
+          }
+        } else if (pi > 0) {
+          for (std::size_t l = 0; l < L; ++l) {
+            double q = mi[l] > 0 ? bi[l] / pi : MASSIVE;
+            minI[l] = q < minI[l] ? q : minI[l];
+          }
+        }
+      }
+
+      // The reflections to fit and their initial intensity estimates
+      std::vector<std::size_t> active;
+      std::vector<double> I0;
+      for (std::size_t l = 0; l < L; ++l) {
+        minI[l] = -minI[l];
+        if (bad[l] == 0 && sumb[l] >= 0 && sumd[l] >= 0 && sump[l] > 0 && minI[l] <= 0) {
+          double I = sumd[l] - sumb[l];
+          if (I < minI[l] + TINY) {
+            I = minI[l] + TINY;
+          }
+          active.push_back(l);
+          I0.push_back(I);
+        }
+      }
+
+      // Remove the reflections that are not being fitted
+      std::size_t pitch = L;
+      if (active.size() < L) {
+        compact(tile, active, pitch);
+      }
+
+      // Iterate to calculate the intensities. A reflection is finished if the
+      // intensity goes less than zero or if the tolerance is reached. The
+      // remaining reflections carry on until the number of iterations is
+      // reached.
+      std::size_t num = active.size();
+      std::vector<double> sum1(num);
+      std::vector<double> sum2(num);
+      std::vector<bool> done(num, false);
+      std::size_t num_active = num;
+      for (std::size_t niter = 0; niter < maxiter && num_active > 0; ++niter) {
+        std::fill(sum1.begin(), sum1.begin() + num, 0.0);
+        std::fill(sum2.begin(), sum2.begin() + num, 0.0);
+        std::fill(bad.begin(), bad.begin() + num, 0.0);
+        for (std::size_t j = 0; j < K; ++j) {
+          const T pj = p[tile.pixels[j]];
+          const T *dbj = &tile.db[j*pitch];
+          const T *bj = &tile.bg[j*pitch];
+          for (std::size_t a = 0; a < num; ++a) {
+            double v = bj[a] + I0[a] * pj;
+            bad[a] += v > 0 ? 0.0 : 1.0;
+            sum1[a] += dbj[a] * pj / v;
+            sum2[a] += pj * pj / v;
+          }
+        }
+
+        // Update the intensities of the unfinished reflections
+        for (std::size_t a = 0; a < num; ++a) {
+          if (done[a]) {
+            continue;
+          }
+          std::size_t l = active[a];
+          std::size_t k = k0 + l;
+          niter_[k] = niter;
+          if (bad[a] > 0 || !(sum2[a] > 0)) {
+            done[a] = true;
+            num_active--;
+            continue;
+          }
+          double I = sum1[a] / sum2[a];
+          double V = std::abs(I) + sumb[l];
+          intensity_[k] = I;
+          variance_[k] = V;
+          if ((error_[k] = std::abs(I - I0[a])) < eps) {
+            success_[k] = true;
+          } else if (I < minI[l] + TINY) {
+            I = (sumd[l] - sumb[l]) / sump[l];
+            intensity_[k] = I;
+            variance_[k] = std::abs(I) + sumb[l];
+            success_[k] = true;
+          } else {
+            I0[a] = I;
+            if (niter + 1 == maxiter) {
+              niter_[k] = maxiter;
+              success_[k] = true;
+            }
+            continue;
+          }
+          done[a] = true;
+          num_active--;
+        }
+
+        // Remove the finished reflections once enough of them have finished
+        if (num_active > 0 && 4 * num_active <= 3 * num) {
+          std::vector<std::size_t> keep;
+          keep.reserve(num_active);
+          for (std::size_t a = 0; a < num; ++a) {
+            if (!done[a]) {
+              keep.push_back(a);
+            }
+          }
+          DIALS_ASSERT(keep.size() == num_active);
+          for (std::size_t w = 0; w < num_active; ++w) {
+            active[w] = active[keep[w]];
+            I0[w] = I0[keep[w]];
+            done[w] = false;
+          }
+          compact(tile, keep, pitch);
+          num = num_active;
+        }
+      }
+
+      // Check the variances
+      std::vector<double> I(L, 0);
+      for (std::size_t l = 0; l < L; ++l) {
+        std::size_t k = k0 + l;
+        if (success_[k]) {
+          if (!(variance_[k] >= 0 && variance_[k] >= intensity_[k])) {
+            success_[k] = false;
+          }
+        }
+        if (success_[k]) {
+          I[l] = intensity_[k];
+        } else {
+          intensity_[k] = 0.0;
+          variance_[k] = -1.0;
+        }
+      }
+
+      // Compute the mean observed and predicted
+      std::vector<double> xb(L, 0);
+      std::vector<double> yb(L, 0);
+      std::vector<double> count(L, 0);
+      for (std::size_t i = 0; i < N; ++i) {
+        const T pi = p[i];
+        const T *di = &tile.d[i*L];
+        const T *bi = &tile.b[i*L];
+        const T *mi = &tile.m[i*L];
+        for (std::size_t l = 0; l < L; ++l) {
+          xb[l] += mi[l] * (I[l]*pi + bi[l]);
+          yb[l] += di[l];
+          count[l] += mi[l];
+        }
+      }
+      for (std::size_t l = 0; l < L; ++l) {
+        if (count[l] > 0) {
+          xb[l] /= count[l];
+          yb[l] /= count[l];
+        } else {
+          success_[k0+l] = false;
+        }
+      }
+
+      // Compute the variance
+      std::vector<double> sdxdy(L, 0);
+      std::vector<double> sdx2(L, 0);
+      std::vector<double> sdy2(L, 0);
+      for (std::size_t i = 0; i < N; ++i) {
+        const T pi = p[i];
+        const T *di = &tile.d[i*L];
+        const T *bi = &tile.b[i*L];
+        const T *mi = &tile.m[i*L];
+        for (std::size_t l = 0; l < L; ++l) {
+          double dx = (I[l]*pi + bi[l]) - xb[l];
+          double dy = di[l] - yb[l];
+          sdxdy[l] += mi[l] * (dx*dy);
+          sdx2[l] += mi[l] * (dx*dx);
+          sdy2[l] += mi[l] * (dy*dy);
+        }
+      }
+
+      // Compute the correlation
+      for (std::size_t l = 0; l < L; ++l) {
+        std::size_t k = k0 + l;
+        if (success_[k] && sdx2[l] > 0.0 && sdy2[l] > 0.0) {
+          correlation_[k] = sdxdy[l] / (std::sqrt(sdx2[l]) * std::sqrt(sdy2[l]));
+        }
+      }
+    }
+
+    /**
+     * Move the iteration data in the given columns (in increasing order) to
+     * the start of each row and set the pitch to the number of columns kept.
+     */
+    void compact(
+        Tile &tile,
+        const std::vector<std::size_t> &keep,
+        std::size_t &pitch) const {
+      std::size_t num = keep.size();
+      for (std::size_t j = 0; j < tile.pixels.size(); ++j) {
+        for (std::size_t w = 0; w < num; ++w) {
+          tile.db[j*num+w] = tile.db[j*pitch+keep[w]];
+          tile.bg[j*num+w] = tile.bg[j*pitch+keep[w]];
+        }
+      }
+      pitch = num;
+    }
+
+    af::shared<double> intensity_;
+    af::shared<double> variance_;
+    af::shared<double> correlation_;
+    af::shared<std::size_t> niter_;
+    af::shared<double> error_;
+    af::shared<bool> success_;
+    std::size_t maxiter_;
+  };
+
 
 }}
 
@@ -568,6 +568,21 @@ namespace dials { namespace algorithms {
       return lookup_.indices(index).size();
     }
 
+    /**
+     * @returns The total shoebox volume (in pixels) of the reflections in a job
+     */
+    std::size_t shoebox_volume(std::size_t index) {
+      DIALS_ASSERT(index < finished_.size());
+      af::const_ref<std::size_t> ind = lookup_.indices(index);
+      af::const_ref<int6> bbox = data_["bbox"];
+      std::size_t volume = 0;
+      for (std::size_t i = 0; i < ind.size(); ++i) {
+        const int6 &b = bbox[ind[i]];
+        volume += (b[1] - b[0]) * (b[3] - b[2]) * (b[5] - b[4]);
+      }
+      return volume;
+    }
+
     /**
      * @returns The reflections for a particular block.
      */
@@ -70,12 +70,38 @@ def generate_phil_scope():
           .help = "The maximum percentage of total physical memory to use for"
                   "allocating shoebox arrays."
 
+        share_frames = False
+          .type = bool
+          .help = "Process consecutive blocks of images together in each"
+                  "process so that the images in the overlap between blocks"
+                  "are read once and given to each block which needs them."
+                  "This avoids reading the overlapping images more than once"
+                  "at the cost of holding the shoeboxes of the overlapping"
+                  "blocks in memory at the same time."
+
       }
 
       use_dynamic_mask = True
         .type = bool
         .help = "Use dynamic mask if available"
 
+      cache {
+
+        shoeboxes = False
+          .type = bool
+          .help = "Read each block of images once and write the extracted"
+                  "shoeboxes to a cache on disk. Profile modelling, validation"
+                  "and integration then process the shoeboxes from the cache"
+                  "instead of reading the images again."
+
+        directory = None
+          .type = path
+          .help = "The directory for the shoebox cache. By default a temporary"
+                  "directory is created in the current directory and deleted"
+                  "after integration."
+
+      }
+
       debug {
 
         reference {
@@ -127,6 +153,12 @@ def generate_phil_scope():
           .type = bool
           .help = "Split shoeboxes into different files"
 
+        stage_timing = False
+          .type = bool
+          .help = "Record the time spent, the number of reflections and the"
+                  "number of pixels processed in each stage of the integration"
+                  "by each thread. Not available with integrator=volume."
+
       }
 
       integrator = *auto 3d flat3d 2d single2d stills volume 3d_threaded
@@ -192,6 +224,24 @@ def generate_phil_scope():
         nproc = 1
           .type = int(value_min=1)
           .help = "The number of processes to use per cluster job"
+
+        schedule = static *dynamic
+          .type = choice
+          .help = "The order in which jobs are given to the processes. For"
+                  "static the jobs are processed in order of frame range. For"
+                  "dynamic the cost of each job is estimated from the number"
+                  "of reflections and the shoebox volume, the jobs are started"
+                  "most expensive first and each free process takes the next"
+                  "job as soon as it is done. Integration jobs costing more"
+                  "than twice the mean are split into parts by the frame on"
+                  "which their reflections finish so the parts can be taken"
+                  "by processes which would otherwise be idle."
+
+        prefetch = 2
+          .type = int(value_min=0)
+          .help = "The number of images to read ahead in a background thread"
+                  "while integrating. If 0, each image is read on the"
+                  "integration thread."
       }
 
       summation {
@@ -224,12 +274,28 @@ def hist(data, width=80, symbol='#', prefix=''):
 
   '''
   from collections import Counter
-  from math import log10, floor
   assert len(data) > 0, "Need > 0 reflections"
+  return hist_from_counts(
+    sorted(Counter(data).items()),
+    width=width,
+    symbol=symbol,
+    prefix=prefix)
+
+def hist_from_counts(counts, width=80, symbol='#', prefix=''):
+  '''
+  A utility function to print a histogram from counts.
+
+  :param counts: The sorted list of (value, count)
+  :param width: The number of characters in each line
+  :param symbol: The plot symbol
+  :param prefix: String to prefix to each line
+  :return: The histogram string
+
+  '''
+  from math import log10, floor
+  assert len(counts) > 0, "Need > 0 reflections"
   assert width > 0, "Width should be > 0"
-  count = Counter(data)
-  count = sorted(count.items())
-  frame, count = zip(*count)
+  frame, count = zip(*counts)
   min_frame = min(frame)
   max_frame = max(frame)
   min_count = min(count)
@@ -262,8 +328,9 @@ def frame_hist(bbox, width=80, symbol='#', prefix=''):
   :return: The histogram string
 
   '''
-  return hist(
-    [z for b in bbox for z in range(b[4], b[5])],
+  from dials.algorithms.integration.processor import count_reflections_per_frame
+  return hist_from_counts(
+    count_reflections_per_frame(bbox),
     width=width,
     symbol=symbol,
     prefix=prefix)
@@ -279,8 +346,9 @@ def nframes_hist(bbox, width=80, symbol='#', prefix=''):
   :return: The histogram string
 
   '''
-  return hist(
-    [b[5] - b[4] for b in bbox],
+  from dials.algorithms.integration.processor import count_reflections_per_nframes
+  return hist_from_counts(
+    count_reflections_per_nframes(bbox),
     width=width,
     symbol=symbol,
     prefix=prefix)
@@ -317,6 +385,15 @@ def __init__(self):
       self.fitting = True
       self.validation = Parameters.Profile.Validation()
 
+  class Cache(object):
+    '''
+    Shoebox cache parameters
+
+    '''
+    def __init__(self):
+      self.shoeboxes = False
+      self.directory = None
+
   def __init__(self):
     '''
     Initialize
@@ -327,6 +404,7 @@ def __init__(self):
     self.integration = processor.Parameters()
     self.filter = Parameters.Filter()
     self.profile = Parameters.Profile()
+    self.cache = Parameters.Cache()
     self.debug_reference_filename = "reference_profiles.pickle"
     self.debug_reference_output = False
 
@@ -347,6 +425,7 @@ def from_phil(params):
     mp.method = params.mp.method
     mp.nproc = params.mp.nproc
     mp.njobs = params.mp.njobs
+    mp.schedule = params.mp.schedule
 
     # Set the lookup parameters
     lookup = processor.Lookup()
@@ -359,6 +438,7 @@ def from_phil(params):
     block.threshold = params.block.threshold
     block.force = params.block.force
     block.max_memory_usage = params.block.max_memory_usage
+    block.share_frames = params.block.share_frames
 
     # Set the modelling processor parameters
     result.modelling.mp = mp
@@ -377,6 +457,7 @@ def from_phil(params):
       result.integration.debug.output = params.debug.output
     result.integration.debug.select = params.debug.select
     result.integration.debug.separate_files = params.debug.separate_files
+    result.integration.debug.stage_timing = params.debug.stage_timing
     result.integration.summation = params.summation
 
     result.debug_reference_filename = params.debug.reference.filename
@@ -397,6 +478,10 @@ def from_phil(params):
     result.profile.validation.min_partition_size = \
       params.profile.validation.min_partition_size
 
+    # Set the shoebox cache parameters
+    result.cache.shoeboxes = params.cache.shoeboxes
+    result.cache.directory = params.cache.directory
+
     # Return the result
     return result
 
@@ -577,6 +662,73 @@ def __call__(self):
 
     self.reflections = integrated
 
+class ShoeboxCacheExecutor(Executor):
+  '''
+  The class to write the extracted shoeboxes to the shoebox cache
+
+  '''
+
+  def __init__(self, cache):
+    '''
+    Initialise the executor
+
+    :param cache: The shoebox cache
+
+    '''
+    self.cache = cache
+    self.stream = None
+    super(ShoeboxCacheExecutor, self).__init__()
+
+  def initialize(self, frame0, frame1, reflections):
+    '''
+    Open the cache file for the job
+
+    :param frame0: The first frame in the job
+    :param frame1: The last frame in the job
+    :param reflections: The reflections that will be processed
+
+    '''
+    logger.info(" Beginning shoebox extraction job %d" % job.index)
+    logger.info("")
+    logger.info(" Frames: %d -> %d" % (frame0, frame1))
+    logger.info(" Number of reflections: %d" % len(reflections))
+    logger.info("")
+    self.stream = self.cache.open(job.index, frame0, frame1, reflections)
+
+  def process(self, frame, reflections):
+    '''
+    Write the shoeboxes
+
+    :param frame: The frame being processed
+    :param reflections: The reflections to process
+
+    '''
+    self.cache.write(self.stream, frame, reflections)
+    logger.info(' Cached % 5d shoeboxes on image %d' % (len(reflections), frame))
+
+  def finalize(self):
+    '''
+    Close the cache file
+
+    '''
+    self.stream.close()
+    self.stream = None
+
+  def data(self):
+    '''
+    Return data
+
+    '''
+    return None
+
+  def __getinitargs__(self):
+    '''
+    Support for pickling
+
+    '''
+    return (self.cache,)
+
+
 class ProfileModellerExecutor(Executor):
   '''
   The class to do profile modelling calculations
@@ -802,16 +954,23 @@ class IntegratorExecutor(Executor):
 
   '''
 
-  def __init__(self, experiments, profile_fitter=None):
+  # Each reflection is processed independently so a job may be split
+  split_jobs = True
+
+  def __init__(self, experiments, profile_fitter=None, profile_stages=False):
     '''
     Initialize the executor
 
     :param experiments: The experiment list
+    :param profile_fitter: The profile fitter
+    :param profile_stages: Record the time spent in each stage
 
     '''
     self.experiments = experiments
     self.overlaps = None
     self.profile_fitter = profile_fitter
+    self.profile_stages = profile_stages
+    self.stage_timing = None
     super(IntegratorExecutor, self).__init__()
 
   def initialize(self, frame0, frame1, reflections):
@@ -858,6 +1017,11 @@ def initialize(self, frame0, frame1, reflections):
     # Find any overlaps
     self.overlaps = reflections.find_overlaps(self.experiments)
 
+    # Start the per stage timings for the job
+    if self.profile_stages:
+      from dials.algorithms.integration.processor import StageTimingInfo
+      self.stage_timing = StageTimingInfo()
+
   def process(self, frame, reflections):
     '''
     Process the reflections on a frame
@@ -867,6 +1031,23 @@ def process(self, frame, reflections):
 
     '''
     from dials.algorithms.shoebox import MaskCode
+    from dials.array_family import flex
+    from time import time
+
+    # Record the time spent in each stage if requested
+    stage_timing = self.stage_timing
+    if stage_timing is not None:
+      x0, x1, y0, y1, z0, z1 = reflections['bbox'].parts()
+      num_pixels = flex.sum((x1 - x0) * (y1 - y0) * (z1 - z0))
+      num_reflections = len(reflections)
+    def tick(name, start_time):
+      if stage_timing is None:
+        return None
+      end_time = time()
+      stage_timing.add(
+        name, end_time - start_time, num_reflections, num_pixels)
+      return end_time
+    st = time()
 
     # Check if pixels are overloaded
     reflections.is_overloaded(self.experiments)
@@ -876,13 +1057,18 @@ def process(self, frame, reflections):
 
     # Check for invalid pixels in foreground/background
     reflections.contains_invalid_pixels()
+    st = tick('mask', st)
 
     # Process the data
     reflections.compute_background(self.experiments)
+    st = tick('background', st)
     reflections.compute_centroid(self.experiments)
+    st = tick('centroid', st)
     reflections.compute_summed_intensity()
+    st = tick('summation', st)
     if self.profile_fitter:
       reflections.compute_fitted_intensity(self.profile_fitter)
+      st = tick('fitting', st)
 
     # from matplotlib import pylab
     # from dials.array_family import flex
@@ -944,7 +1130,7 @@ def __getinitargs__(self):
     Support for pickling
 
     '''
-    return (self.experiments, self.profile_fitter)
+    return (self.experiments, self.profile_fitter, self.profile_stages)
 
 
 class Integrator(object):
@@ -972,6 +1158,12 @@ def __init__(self,
     self.params = Parameters.from_phil(params.integration)
     self.profile_model_report = None
     self.integration_report = None
+    self._stage_timing = None
+    self._stage_timing_algorithms = {
+      'profile'    : params.profile.algorithm,
+      'background' : params.integration.background.algorithm,
+      'fitting'    : params.integration.profile.fitting,
+    }
 
   def integrate(self):
     '''
@@ -1031,6 +1223,12 @@ def integrate(self):
       self.params)
     initialize(self.reflections)
 
+    # Optionally read the images once and cache the shoeboxes for all passes
+    cache = None
+    images_cached = 0
+    if self.params.cache.shoeboxes:
+      cache, images_read = self.cache_shoeboxes()
+
     # Check if we want to do some profile fitting
     fitting_class = [e.profile.fitting_class() for e in self.experiments]
     fitting_avail = all(c is not None for c in fitting_class)
@@ -1099,6 +1297,7 @@ def integrate(self):
 
         # Process the reference profiles
         reference, profile_fitter_list, time_info = processor.process()
+        images_cached += time_info.images_cached
 
         # Set the reference spots info
         #self.reflections.set_selected(selection, reference)
@@ -1175,6 +1374,7 @@ def integrate(self):
 
           # Process the reference profiles
           reference, validation, time_info = processor.process()
+          images_cached += time_info.images_cached
 
           # Print the modeller report
           self.profile_validation_report = ProfileValidationReport(
@@ -1202,7 +1402,8 @@ def integrate(self):
     # Create the data processor
     executor = IntegratorExecutor(
       self.experiments,
-      profile_fitter)
+      profile_fitter,
+      self.params.integration.debug.stage_timing)
     processor = ProcessorBuilder(
       self.ProcessorClass,
       self.experiments,
@@ -1212,6 +1413,7 @@ def integrate(self):
 
     # Process the reflections
     self.reflections, _, time_info = processor.process()
+    images_cached += time_info.images_cached
 
     # Finalize the reflections
     finalize = self.FinalizerClass(
@@ -1234,9 +1436,83 @@ def integrate(self):
     logger.info(str(time_info))
     logger.info("")
 
+    # Print the per stage time info
+    self._stage_timing = time_info.stage_timing
+    if self._stage_timing is not None:
+      self._stage_timing.algorithms = self._stage_timing_algorithms
+      logger.info("Per stage timing information for integration")
+      logger.info(str(self._stage_timing))
+      logger.info("")
+
+    # Delete the shoebox cache and report the image reads saved
+    if cache is not None:
+      cache.remove()
+      if 'cache_index' in self.reflections:
+        del self.reflections['cache_index']
+      logger.info("Shoebox cache: read %d images once and processed %d images"
+                  " from the cache instead of reading them again" % (
+                    images_read, images_cached))
+      logger.info("")
+
     # Return the reflections
     return self.reflections
 
+  def cache_shoeboxes(self):
+    '''
+    Read the images once and write the shoeboxes of all the reflections to the
+    shoebox cache. The processing passes then use the same blocks of images
+    so that their jobs can be matched to the cached jobs.
+
+    :return: The shoebox cache and the number of images read
+
+    '''
+    from dials.algorithms.integration import processor
+    from dials.util.command_line import heading
+    from dials.array_family import flex
+
+    logger.info("=" * 80)
+    logger.info("")
+    logger.info(heading("Caching shoeboxes"))
+    logger.info("")
+
+    # Label the reflections so they can be found in the cache
+    self.reflections['cache_index'] = flex.size_t(range(len(self.reflections)))
+
+    # Extract and write the shoeboxes
+    cache = processor.ShoeboxCache(self.params.cache.directory)
+    params = processor.Parameters()
+    params.update(self.params.integration)
+    params.debug.output = False
+    params.cache = None
+    extractor = ProcessorBuilder(
+      self.ProcessorClass,
+      self.experiments,
+      self.reflections.copy(),
+      params).build()
+    extractor.executor = ShoeboxCacheExecutor(cache)
+    _, _, time_info = extractor.process()
+
+    # Use the same blocks for the processing passes
+    block = extractor.manager.params.block
+    for p in (self.params.modelling, self.params.integration):
+      p.block.size = block.size
+      p.block.units = block.units
+      p.cache = cache
+
+    # Print the time info
+    logger.info("")
+    logger.info("Timing information for shoebox caching")
+    logger.info(str(time_info))
+    logger.info("")
+    return cache, time_info.images_read
+
+  def stage_timing(self):
+    '''
+    Return the per stage timing info (None unless stage_timing was set)
+
+    '''
+    return self._stage_timing
+
   def report(self):
     '''
     Return the report of the processing
@@ -1361,6 +1637,7 @@ def __init__(self,
     self.params = params
     self.profile_model_report = None
     self.integration_report = None
+    self._stage_timing = None
 
   def initialise(self):
     '''
@@ -1493,6 +1770,7 @@ def integrate(self):
 
     # Process the reflections
     self.reflections = integrator.reflections()
+    self._stage_timing = integrator.stage_timing()
 
     # Do the finalisation
     self.finalise()
@@ -1524,6 +1802,13 @@ def report(self):
     result.combine(self.integration_report)
     return result
 
+  def stage_timing(self):
+    '''
+    Return the per stage timing info (None unless stage_timing was set)
+
+    '''
+    return self._stage_timing
+
   def summary(self, block_size, block_size_units):
     ''' Print a summary of the integration stuff. '''
     from libtbx.table_utils import format as table
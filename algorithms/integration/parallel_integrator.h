@@ -13,6 +13,9 @@
 #define DIALS_ALGORITHMS_INTEGRATION_PARALLEL_INTEGRATOR_H
 
 #include <boost/ptr_container/ptr_vector.hpp>
+#include <boost/shared_ptr.hpp>
+#include <boost/thread.hpp>
+#include <boost/date_time/posix_time/posix_time_types.hpp>
 #include <dxtbx/model/beam.h>
 #include <dxtbx/model/detector.h>
 #include <dxtbx/model/scan.h>
@@ -27,6 +30,10 @@
 #include <dials/algorithms/centroid/centroid.h>
 #include <dials/array_family/boost_python/flex_table_suite.h>
 #include <map>
+#include <vector>
+#include <algorithm>
+#include <deque>
+#include <string>
 
 #include <dials/algorithms/integration/interfaces.h>
 
@@ -367,6 +374,199 @@ namespace dials { namespace algorithms {
   };
 
 
+  /**
+   * @returns The wall clock time in seconds
+   */
+  inline
+  double wall_time() {
+    using namespace boost::posix_time;
+    static const ptime epoch(boost::gregorian::date(1970, 1, 1));
+    return (microsec_clock::universal_time() - epoch).total_microseconds() / 1e6;
+  }
+
+
+  /**
+   * A class to record the time spent, the number of reflections and the
+   * number of shoebox pixels processed in each stage of the integration by
+   * each thread. Each reflection is timed into a local Counters object which is
+   * added to the totals for the calling thread once the reflection is done, so
+   * the lock is only taken once per reflection.
+   */
+  class IntegrationProfiler {
+  public:
+
+    enum Stage {
+      Extract,
+      Mask,
+      Background,
+      Centroid,
+      Summation,
+      Fitting,
+      Finalize,
+      NumStages
+    };
+
+    /**
+     * The counters for a single thread
+     */
+    class Counters {
+    public:
+
+      Counters()
+        : last_(0) {
+        std::fill(time_, time_ + NumStages, 0.0);
+        std::fill(count_, count_ + NumStages, 0);
+        std::fill(pixels_, pixels_ + NumStages, 0);
+      }
+
+      /**
+       * Start timing the first stage
+       */
+      void start() {
+        last_ = wall_time();
+      }
+
+      /**
+       * Record the end of a stage and start timing the next one
+       * @param stage The stage that has finished
+       * @param pixels The number of pixels processed
+       */
+      void tick(Stage stage, std::size_t pixels) {
+        double now = wall_time();
+        time_[stage] += now - last_;
+        count_[stage] += 1;
+        pixels_[stage] += pixels;
+        last_ = now;
+      }
+
+      /**
+       * Add another set of counters
+       */
+      void add(const Counters &other) {
+        for (std::size_t i = 0; i < NumStages; ++i) {
+          time_[i] += other.time_[i];
+          count_[i] += other.count_[i];
+          pixels_[i] += other.pixels_[i];
+        }
+      }
+
+      double time(std::size_t stage) const {
+        DIALS_ASSERT(stage < NumStages);
+        return time_[stage];
+      }
+
+      std::size_t count(std::size_t stage) const {
+        DIALS_ASSERT(stage < NumStages);
+        return count_[stage];
+      }
+
+      std::size_t pixels(std::size_t stage) const {
+        DIALS_ASSERT(stage < NumStages);
+        return pixels_[stage];
+      }
+
+    private:
+
+      double last_;
+      double time_[NumStages];
+      std::size_t count_[NumStages];
+      std::size_t pixels_[NumStages];
+    };
+
+    IntegrationProfiler() {}
+
+    IntegrationProfiler(const IntegrationProfiler &other)
+      : thread_index_(other.thread_index_),
+        counters_(other.counters_) {}
+
+    IntegrationProfiler& operator=(const IntegrationProfiler &other) {
+      thread_index_ = other.thread_index_;
+      counters_ = other.counters_;
+      return *this;
+    }
+
+    /**
+     * @returns The name of the stage
+     */
+    static
+    const char* stage_name(std::size_t stage) {
+      static const char *names[NumStages] = {
+        "extract",
+        "mask",
+        "background",
+        "centroid",
+        "summation",
+        "fitting",
+        "finalize"
+      };
+      DIALS_ASSERT(stage < NumStages);
+      return names[stage];
+    }
+
+    /**
+     * @returns The number of stages
+     */
+    static
+    std::size_t num_stages() {
+      return NumStages;
+    }
+
+    /**
+     * Add the counters to the totals for the calling thread
+     * @param counters The counters for a reflection
+     */
+    void accumulate(const Counters &counters) {
+      boost::lock_guard<boost::mutex> guard(mutex_);
+      boost::thread::id id = boost::this_thread::get_id();
+      std::map<boost::thread::id, std::size_t>::iterator it =
+        thread_index_.find(id);
+      if (it == thread_index_.end()) {
+        it = thread_index_.insert(
+            std::make_pair(id, counters_.size())).first;
+        counters_.push_back(Counters());
+      }
+      counters_[it->second].add(counters);
+    }
+
+    /**
+     * @returns The number of threads that processed reflections
+     */
+    std::size_t num_threads() const {
+      return counters_.size();
+    }
+
+    /**
+     * @returns The time spent by a thread in a stage
+     */
+    double time(std::size_t thread, std::size_t stage) const {
+      DIALS_ASSERT(thread < counters_.size());
+      return counters_[thread].time(stage);
+    }
+
+    /**
+     * @returns The number of reflections processed by a thread in a stage
+     */
+    std::size_t count(std::size_t thread, std::size_t stage) const {
+      DIALS_ASSERT(thread < counters_.size());
+      return counters_[thread].count(stage);
+    }
+
+    /**
+     * @returns The number of pixels processed by a thread in a stage
+     */
+    std::size_t pixels(std::size_t thread, std::size_t stage) const {
+      DIALS_ASSERT(thread < counters_.size());
+      return counters_[thread].pixels(stage);
+    }
+
+  private:
+
+    std::map<boost::thread::id, std::size_t> thread_index_;
+    std::vector<Counters> counters_;
+    boost::mutex mutex_;
+  };
+
+
   /**
    * A class to integrate a single reflection
    */
@@ -382,6 +582,8 @@ namespace dials { namespace algorithms {
      * @param zstart The first image index
      * @param underload The underload value
      * @param overload The overload value
+     * @param debug Keep the shoeboxes
+     * @param profiler The stage profiler (NULL to disable)
      */
     ReflectionIntegrator(
           const MaskCalculatorIface &compute_mask,
@@ -391,7 +593,8 @@ namespace dials { namespace algorithms {
           int zstart,
           double underload,
           double overload,
-          bool debug)
+          bool debug,
+          IntegrationProfiler *profiler = NULL)
       : compute_mask_(compute_mask),
         compute_background_(compute_background),
         compute_intensity_(compute_intensity),
@@ -399,7 +602,8 @@ namespace dials { namespace algorithms {
         zstart_(zstart),
         underload_(underload),
         overload_(overload),
-        debug_(debug) {}
+        debug_(debug),
+        profiler_(profiler) {}
 
     /**
      * Integrate a reflection using the following procedure:
@@ -424,6 +628,7 @@ namespace dials { namespace algorithms {
 
       af::Reflection reflection;
       std::vector< af::Reflection > adjacent_reflections;
+      IntegrationProfiler::Counters counters;
 
       // Get the reflection data
       get_reflection(
@@ -434,12 +639,15 @@ namespace dials { namespace algorithms {
           adjacent_reflections);
 
       // Extract the shoebox data
+      if (profiler_) counters.start();
       extract_shoebox(
           buffer_,
           reflection,
           zstart_,
           underload_,
           overload_);
+      std::size_t npixels = reflection.get< Shoebox<> >("shoebox").data.size();
+      if (profiler_) counters.tick(IntegrationProfiler::Extract, npixels);
 
       // Compute the mask
       compute_mask_(reflection);
@@ -451,20 +659,30 @@ namespace dials { namespace algorithms {
         adjacent_reflections[i]["shoebox"] = reflection.get< Shoebox<> >("shoebox");
         compute_mask_(adjacent_reflections[i], true);
       }
+      if (profiler_) counters.tick(IntegrationProfiler::Mask,
+          npixels * (1 + adjacent_reflections.size()));
 
       // Compute the background
       try {
         compute_background_(reflection);
       } catch (dials::error) {
+        if (profiler_) counters.tick(IntegrationProfiler::Background, npixels);
         finalize_shoebox(reflection, adjacent_reflections, underload_, overload_);
+        if (profiler_) {
+          counters.tick(IntegrationProfiler::Finalize, npixels);
+          profiler_->accumulate(counters);
+        }
         return;
       }
+      if (profiler_) counters.tick(IntegrationProfiler::Background, npixels);
 
       // Compute the centroid
       compute_centroid(reflection);
+      if (profiler_) counters.tick(IntegrationProfiler::Centroid, npixels);
 
       // Compute the summed intensity
       compute_summed_intensity(reflection);
+      if (profiler_) counters.tick(IntegrationProfiler::Summation, npixels);
 
       // Compute the profile fitted intensity
       try {
@@ -474,12 +692,19 @@ namespace dials { namespace algorithms {
         flags |= af::FailedDuringProfileFitting;
         reflection["flags"] = flags;
       }
+      if (profiler_) counters.tick(IntegrationProfiler::Fitting, npixels);
 
       // Erase the shoebox
       finalize_shoebox(reflection, adjacent_reflections, underload_, overload_);
+      if (profiler_) counters.tick(IntegrationProfiler::Finalize, npixels);
 
       // Set the reflection data
       set_reflection(index, reflection_list, reflection);
+
+      // Add the stage timings to the totals for this thread
+      if (profiler_) {
+        profiler_->accumulate(counters);
+      }
     }
 
 
@@ -764,6 +989,7 @@ namespace dials { namespace algorithms {
     double underload_;
     double overload_;
     bool debug_;
+    IntegrationProfiler *profiler_;
     mutable boost::mutex mutex_;
   };
 
@@ -1047,6 +1273,212 @@ namespace dials { namespace algorithms {
   };
 
 
+  /**
+   * Release the GIL for the lifetime of the object
+   */
+  class ScopedGILRelease {
+  public:
+
+    ScopedGILRelease()
+      : state_(PyEval_SaveThread()) {}
+
+    ~ScopedGILRelease() {
+      PyEval_RestoreThread(state_);
+    }
+
+  private:
+
+    PyThreadState *state_;
+  };
+
+
+  /**
+   * Acquire the GIL for the lifetime of the object
+   */
+  class ScopedGILAcquire {
+  public:
+
+    ScopedGILAcquire()
+      : state_(PyGILState_Ensure()) {}
+
+    ~ScopedGILAcquire() {
+      PyGILState_Release(state_);
+    }
+
+  private:
+
+    PyGILState_STATE state_;
+  };
+
+
+  /**
+   * A class to read the images ahead of the integration in a background
+   * thread. The images are decoded by the python format classes, so the reader
+   * thread takes the GIL while it reads each image; the integration thread must
+   * therefore release the GIL while it waits for the next image. The images are
+   * copied so that nothing shared with the imageset is touched outside the GIL.
+   */
+  class ImagePrefetcher {
+  public:
+
+    /**
+     * A decoded image
+     */
+    struct Frame {
+      std::size_t index;
+      Image<double> data;
+      Image<bool> mask;
+    };
+
+    /**
+     * Start reading the images
+     * @param imageset The imageset
+     * @param max_queued The maximum number of images to read ahead
+     * @param use_dynamic_mask Read the dynamic mask
+     */
+    ImagePrefetcher(
+          ImageSweep imageset,
+          std::size_t max_queued,
+          bool use_dynamic_mask)
+      : imageset_(imageset),
+        num_images_(imageset.size()),
+        max_queued_(max_queued),
+        use_dynamic_mask_(use_dynamic_mask),
+        stop_(false),
+        read_time_(0) {
+      DIALS_ASSERT(max_queued > 0);
+      PyEval_InitThreads();
+      thread_ = boost::thread(&ImagePrefetcher::run, this);
+    }
+
+    /**
+     * Stop the reader thread. Must be called with the GIL held.
+     */
+    ~ImagePrefetcher() {
+      {
+        boost::lock_guard<boost::mutex> lock(mutex_);
+        stop_ = true;
+      }
+      not_full_.notify_all();
+      ScopedGILRelease release;
+      thread_.join();
+    }
+
+    /**
+     * Get the next image. Must be called without the GIL.
+     * @param index The expected image index
+     * @returns The image
+     */
+    boost::shared_ptr<Frame> pop(std::size_t index) {
+      boost::unique_lock<boost::mutex> lock(mutex_);
+      while (queue_.empty() && error_.empty()) {
+        not_empty_.wait(lock);
+      }
+      if (queue_.empty()) {
+        throw DIALS_ERROR(error_);
+      }
+      boost::shared_ptr<Frame> frame = queue_.front();
+      queue_.pop_front();
+      not_full_.notify_one();
+      DIALS_ASSERT(frame->index == index);
+      return frame;
+    }
+
+    /**
+     * @returns The time spent reading images
+     */
+    double read_time() const {
+      boost::lock_guard<boost::mutex> lock(mutex_);
+      return read_time_;
+    }
+
+  protected:
+
+    /**
+     * Copy an image so it doesn't share memory with the imageset
+     */
+    template <typename T>
+    static Image<T> deep_copy(const Image<T> &image) {
+      Image<T> result;
+      for (std::size_t i = 0; i < image.n_tiles(); ++i) {
+        af::const_ref< T, af::c_grid<2> > src = image.tile(i).data().const_ref();
+        af::versa< T, af::c_grid<2> > dst(src.accessor());
+        std::copy(src.begin(), src.end(), dst.begin());
+        result.append(ImageTile<T>(dst));
+      }
+      return result;
+    }
+
+    /**
+     * Read the images into the queue
+     */
+    void run() {
+      for (std::size_t i = 0; i < num_images_; ++i) {
+
+        // Wait for space in the queue
+        {
+          boost::unique_lock<boost::mutex> lock(mutex_);
+          while (queue_.size() >= max_queued_ && !stop_) {
+            not_full_.wait(lock);
+          }
+          if (stop_) {
+            return;
+          }
+        }
+
+        // Read the image
+        boost::shared_ptr<Frame> frame(new Frame());
+        frame->index = i;
+        std::string error;
+        double start_time = wall_time();
+        {
+          ScopedGILAcquire gil;
+          try {
+            frame->data = deep_copy(imageset_.get_corrected_data(i));
+            if (use_dynamic_mask_) {
+              frame->mask = deep_copy(imageset_.get_dynamic_mask(i));
+            }
+          } catch (boost::python::error_already_set const &) {
+            PyErr_Print();
+            error = "Error reading image";
+          } catch (std::exception const &e) {
+            error = e.what();
+          }
+        }
+        double elapsed = wall_time() - start_time;
+
+        // Add the image to the queue
+        {
+          boost::lock_guard<boost::mutex> lock(mutex_);
+          read_time_ += elapsed;
+          if (!error.empty()) {
+            error_ = error;
+          } else {
+            queue_.push_back(frame);
+          }
+        }
+        not_empty_.notify_one();
+        if (!error.empty()) {
+          return;
+        }
+      }
+    }
+
+    ImageSweep imageset_;
+    std::size_t num_images_;
+    std::size_t max_queued_;
+    bool use_dynamic_mask_;
+    bool stop_;
+    double read_time_;
+    std::string error_;
+    std::deque< boost::shared_ptr<Frame> > queue_;
+    mutable boost::mutex mutex_;
+    boost::condition_variable not_empty_;
+    boost::condition_variable not_full_;
+    boost::thread thread_;
+  };
+
+
   /**
    * A class to perform parallel integration
    */
@@ -1065,6 +1497,8 @@ namespace dials { namespace algorithms {
      * @param buffer_size The buffer_size
      * @param use_dynamic_mask Use the dynamic mask if present
      * @param debug Add debug output
+     * @param prefetch The number of images to read ahead (0 to disable)
+     * @param profile Record the time spent in each stage of the integration
      */
     ParallelIntegrator(
           af::reflection_table reflections,
@@ -1076,7 +1510,12 @@ namespace dials { namespace algorithms {
           std::size_t nthreads,
           std::size_t buffer_size,
           bool use_dynamic_mask,
-          bool debug) {
+          bool debug,
+          std::size_t prefetch,
+          bool profile)
+        : read_time_(0),
+          wait_time_(0),
+          process_time_(0) {
 
       using dials::algorithms::shoebox::find_overlapping_multi_panel;
 
@@ -1154,7 +1593,8 @@ namespace dials { namespace algorithms {
           zstart,
           underload,
           overload,
-          debug);
+          debug,
+          profile ? &profiler_ : NULL);
 
       // Do the integration
       process(
@@ -1168,6 +1608,7 @@ namespace dials { namespace algorithms {
           flags,
           nthreads,
           use_dynamic_mask,
+          prefetch,
           logger);
 
       // Transform the row major reflection array to the reflection table
@@ -1181,6 +1622,34 @@ namespace dials { namespace algorithms {
       return reflections_;
     }
 
+    /**
+     * @returns The time spent reading and decoding images
+     */
+    double read_time() const {
+      return read_time_;
+    }
+
+    /**
+     * @returns The time the integration thread spent waiting for images
+     */
+    double wait_time() const {
+      return wait_time_;
+    }
+
+    /**
+     * @returns The total time spent reading and integrating
+     */
+    double process_time() const {
+      return process_time_;
+    }
+
+    /**
+     * @returns The per stage timings and counters (empty if not profiling)
+     */
+    const IntegrationProfiler& profiler() const {
+      return profiler_;
+    }
+
     /**
      * Static method to get the memory in bytes needed
      * @param imageset the imageset class
@@ -1248,6 +1717,9 @@ namespace dials { namespace algorithms {
      * 4. Loop through all reflections complete on the image
      * 5. For each complete reflection post a reflection integration job to the
      *    thread pool.
+     *
+     * If prefetch > 0, the images are read by a background thread up to
+     * prefetch images ahead, so decoding overlaps with the integration.
      */
     void process(
         const Lookup &lookup,
@@ -1260,10 +1732,13 @@ namespace dials { namespace algorithms {
         af::const_ref<std::size_t> flags,
         std::size_t nthreads,
         bool use_dynamic_mask,
-        const Logger &logger) const {
+        std::size_t prefetch,
+        const Logger &logger) {
 
       using dials::util::ThreadPool;
 
+      double start_time = wall_time();
+
       // Create the thread pool
       ThreadPool pool(nthreads);
 
@@ -1274,16 +1749,40 @@ namespace dials { namespace algorithms {
       // Create the buffer manager
       BufferManager bm(buffer, bbox, flags, zstart);
 
+      // Start reading the images in the background
+      boost::shared_ptr<ImagePrefetcher> prefetcher;
+      if (prefetch > 0) {
+        prefetcher.reset(new ImagePrefetcher(imageset, prefetch, use_dynamic_mask));
+      }
+
       // Loop through all the images
       for (std::size_t i = 0; i < zsize; ++i) {
 
         // Copy the image to the buffer. If the image number is greater than the
         // buffer size (i.e. we are now deleting old images) then wait for the
         // threads to finish so that we don't end up reading the wrong data
-        if (use_dynamic_mask) {
-          bm.copy_when_ready(imageset.get_corrected_data(i), imageset.get_dynamic_mask(i), i);
+        if (prefetcher) {
+          ScopedGILRelease release;
+          double st = wall_time();
+          boost::shared_ptr<ImagePrefetcher::Frame> frame = prefetcher->pop(i);
+          wait_time_ += wall_time() - st;
+          if (use_dynamic_mask) {
+            bm.copy_when_ready(frame->data, frame->mask, i);
+          } else {
+            bm.copy_when_ready(frame->data, i);
+          }
         } else {
-          bm.copy_when_ready(imageset.get_corrected_data(i), i);
+          double st = wall_time();
+          if (use_dynamic_mask) {
+            Image<double> data = imageset.get_corrected_data(i);
+            Image<bool> mask = imageset.get_dynamic_mask(i);
+            read_time_ += wall_time() - st;
+            bm.copy_when_ready(data, mask, i);
+          } else {
+            Image<double> data = imageset.get_corrected_data(i);
+            read_time_ += wall_time() - st;
+            bm.copy_when_ready(data, i);
+          }
         }
 
         // Get the reflections recorded at this point
@@ -1331,10 +1830,23 @@ namespace dials { namespace algorithms {
       }
 
       // Wait for all the integration jobs to complete
-      bm.wait(pool);
+      {
+        ScopedGILRelease release;
+        bm.wait(pool);
+      }
+
+      // Record the time spent reading and processing
+      if (prefetcher) {
+        read_time_ = prefetcher->read_time();
+      }
+      process_time_ = wall_time() - start_time;
     }
 
     af::reflection_table reflections_;
+    double read_time_;
+    double wait_time_;
+    double process_time_;
+    IntegrationProfiler profiler_;
   };
 
 
@@ -10,6 +10,8 @@
 
 from __future__ import absolute_import, division
 from dials_algorithms_integration_parallel_integrator_ext import *
+from dials.algorithms.integration.processor import TimingInfo
+from dials.algorithms.integration.processor import StageTimingInfo
 
 import logging
 logger = logging.getLogger(__name__)
@@ -367,13 +369,28 @@ def __call__(self):
       self.params.integration.block.max_memory_usage)
 
     # Integrate
-    self.integrate(imageset)
+    integrator = self.integrate(imageset)
 
     # Write some debug files
     self.write_debug_files()
 
     # Return the result
-    return Result(self.index, self.reflections)
+    result = Result(self.index, self.reflections)
+    result.read_time = integrator.read_time()
+    result.process_time = integrator.process_time()
+    result.total_time = time() - start_time
+    result.stage_timing = None
+    if self.params.integration.debug.stage_timing:
+      result.stage_timing = StageTimingInfo.from_profiler(integrator.profiler())
+      result.stage_timing.add_job(
+        self.index,
+        frames          = list(self.job),
+        num_reflections = len(self.reflections),
+        read_time       = integrator.read_time(),
+        wait_time       = integrator.wait_time(),
+        process_time    = integrator.process_time(),
+        total_time      = result.total_time)
+    return result
 
   def compute_required_memory(self, imageset):
     '''
@@ -455,11 +472,21 @@ def integrate(self, imageset):
       nthreads           = self.params.integration.mp.nproc,
       buffer_size        = self.params.integration.block.size,
       use_dynamic_mask   = self.params.integration.use_dynamic_mask,
-      debug              = self.params.integration.debug.output)
+      debug              = self.params.integration.debug.output,
+      prefetch           = self.params.integration.mp.prefetch,
+      profile            = self.params.integration.debug.stage_timing)
 
     # Assign the reflections
     self.reflections = integrator.reflections()
 
+    # Write the time spent reading the images
+    logger.info("")
+    logger.info(" Read time: %.2f seconds" % integrator.read_time())
+    logger.info(" Waiting for images: %.2f seconds" % integrator.wait_time())
+    logger.info(" Process time: %.2f seconds" % integrator.process_time())
+    logger.info("")
+    return integrator
+
   def write_debug_files(self):
     '''
     Write some debug output
@@ -514,7 +541,17 @@ def __init__(self, experiments, reflections, reference, params):
     self.finalized = False
 
     # Initialise the timing information
-    #self.time = TimingInfo()
+    self.time = TimingInfo()
+
+    # Initialise the per stage timing information
+    self.stage_timing = None
+    if params.integration.debug.stage_timing:
+      self.stage_timing = StageTimingInfo()
+      self.stage_timing.algorithms = {
+        'profile'    : params.profile.algorithm,
+        'background' : params.integration.background.algorithm,
+        'fitting'    : params.integration.profile.fitting,
+      }
 
     self.initialize()
 
@@ -547,7 +584,7 @@ def initialize(self):
     self.experiments.nullify_all_single_file_reader_format_instances()
 
     # Set the initialization time
-    #self.time.initialize = time() - start_time
+    self.time.initialize = time() - start_time
 
   def task(self, index):
     '''
@@ -584,10 +621,12 @@ def tasks(self):
   def accumulate(self, result):
     ''' Accumulate the results. '''
     self.manager.accumulate(result.index, result.reflections)
-    # self.time.read += result.read_time
-    # self.time.extract += result.extract_time
-    # self.time.process += result.process_time
-    # self.time.total += result.total_time
+    self.time.read += result.read_time
+    self.time.process += result.process_time
+    self.time.total += result.total_time
+    stage_timing = getattr(result, 'stage_timing', None)
+    if self.stage_timing is not None and stage_timing is not None:
+      self.stage_timing.update(stage_timing)
 
   def finalize(self):
     '''
@@ -603,7 +642,7 @@ def finalize(self):
     assert self.manager.finished(), "Manager is not finished"
 
     # Update the time and finalized flag
-    #self.time.finalize = time() - start_time
+    self.time.finalize = time() - start_time
     self.finalized = True
 
   def result(self):
@@ -661,16 +700,18 @@ def compute_blocks(self):
     '''
     import libtbx
     from math import ceil
+    from dials.algorithms.integration.processor import nframes_percentile
     block = self.params.integration.block
     max_block_size = self.compute_max_block_size()
     if block.size in [libtbx.Auto, "auto", "Auto"]:
       assert block.threshold > 0, "Threshold must be > 0"
       assert block.threshold <= 1.0, "Threshold must be < 1"
-      nframes = sorted([b[5] - b[4] for b in self.reflections['bbox']])
-      cutoff = int(block.threshold*len(nframes))
-      block_size = nframes[cutoff] * 2
+      block_size = nframes_percentile(
+        self.reflections['bbox'],
+        block.threshold) * 2
       if block_size > max_block_size:
-        logger.warn("Computed block size (%s) > maximum block size (%s).")
+        logger.warn("Computed block size (%s) > maximum block size (%s)." % (
+          block_size, max_block_size))
         logger.warn("Setting block size to maximum; some reflections may be partial")
         block_size = max_block_size
     else:
@@ -1172,16 +1213,18 @@ def compute_blocks(self):
     '''
     import libtbx
     from math import ceil
+    from dials.algorithms.integration.processor import nframes_percentile
     block = self.params.integration.block
     max_block_size = self.compute_max_block_size()
     if block.size in [libtbx.Auto, "auto", "Auto"]:
       assert block.threshold > 0, "Threshold must be > 0"
       assert block.threshold <= 1.0, "Threshold must be < 1"
-      nframes = sorted([b[5] - b[4] for b in self.reflections['bbox']])
-      cutoff = int(block.threshold*len(nframes))
-      block_size = nframes[cutoff] * 2
+      block_size = nframes_percentile(
+        self.reflections['bbox'],
+        block.threshold) * 2
       if block_size > max_block_size:
-        logger.warn("Computed block size (%s) > maximum block size (%s).")
+        logger.warn("Computed block size (%s) > maximum block size (%s)." % (
+          block_size, max_block_size))
         logger.warn("Setting block size to maximum; some reflections may be partial")
         block_size = max_block_size
     else:
@@ -1357,8 +1400,23 @@ def __init__(self,
     # Finalize the processing
     integration_manager.finalize()
 
+    # Print the time info
+    logger.info("Timing information for integration")
+    logger.info(str(integration_manager.time))
+    logger.info("")
+
+    # Print the per stage time info
+    if integration_manager.stage_timing is not None:
+      logger.info("Per stage timing information for integration")
+      logger.info(str(integration_manager.stage_timing))
+      logger.info("")
+
     # Set the reflections and profiles
     self._reflections = integration_manager.result()
+    self._stage_timing = integration_manager.stage_timing
 
   def reflections(self):
     return self._reflections
+
+  def stage_timing(self):
+    return self._stage_timing
@@ -30,6 +30,10 @@ def __init__(self):
 
 job = _Job()
 
+# The cost of the per reflection processing in a job, relative to the cost
+# of processing a single shoebox pixel, used to estimate the cost of each job
+REFLECTION_COST = 100
+
 
 
 class MultiProcessing(object):
@@ -42,12 +46,14 @@ def __init__(self):
     self.nproc = 1
     self.njobs = 1
     self.nthreads = 1
+    self.schedule = "dynamic"
 
   def update(self, other):
     self.method = other.method
     self.nproc = other.nproc
     self.njobs = other.njobs
     self.nthreads = other.nthreads
+    self.schedule = other.schedule
 
 class Lookup(object):
   '''
@@ -71,6 +77,7 @@ def __init__(self):
     self.threshold = 0.99
     self.force = False
     self.max_memory_usage = 0.75
+    self.share_frames = False
 
   def update(self, other):
     self.size = other.size
@@ -78,6 +85,7 @@ def update(self, other):
     self.threshold = other.threshold
     self.force = other.force
     self.max_memory_usage = other.max_memory_usage
+    self.share_frames = other.share_frames
 
 class Shoebox(object):
   '''
@@ -102,12 +110,14 @@ def __init__(self):
     self.select = None
     self.split_experiments = True
     self.separate_files = True
+    self.stage_timing = False
 
   def update(self, other):
     self.output = other.output
     self.select = other.select
     self.split_experiments = other.split_experiments
     self.separate_files = other.separate_files
+    self.stage_timing = other.stage_timing
 
 class Parameters(object):
   '''
@@ -124,6 +134,7 @@ def __init__(self):
     self.block = Block()
     self.shoebox = Shoebox()
     self.debug = Debug()
+    self.cache = None
 
   def update(self, other):
     '''
@@ -135,6 +146,87 @@ def update(self, other):
     self.block.update(other.block)
     self.shoebox.update(other.shoebox)
     self.debug.update(other.debug)
+    self.cache = other.cache
+
+
+def count_integers(data, min_value, max_value):
+  '''
+  Count the occurrences of each integer in a range
+
+  :param data: The flex.int array of values
+  :param min_value: The minimum value to count
+  :param max_value: The maximum value to count
+  :return: The counts of min_value to max_value
+
+  '''
+  from dials.array_family import flex
+  assert max_value >= min_value, "Invalid range"
+  return flex.histogram(
+    data.as_double(),
+    data_min = min_value - 0.5,
+    data_max = max_value + 0.5,
+    n_slots  = max_value - min_value + 1).slots()
+
+def count_reflections_per_frame(bbox):
+  '''
+  Count the reflections recorded on each frame
+
+  :param bbox: The bounding boxes
+  :return: The list of (frame, count) for each frame with reflections
+
+  '''
+  from dials.array_family import flex
+  assert len(bbox) > 0, "Need > 0 reflections"
+  x0, x1, y0, y1, z0, z1 = bbox.parts()
+  min_frame = flex.min(z0)
+  max_frame = flex.max(z1)
+  num_begin = count_integers(z0, min_frame, max_frame)
+  num_end = count_integers(z1, min_frame, max_frame)
+  result = []
+  count = 0
+  for i in range(len(num_begin)):
+    count += num_begin[i]
+    count -= num_end[i]
+    if count > 0:
+      result.append((min_frame + i, count))
+  return result
+
+def count_reflections_per_nframes(bbox):
+  '''
+  Count the reflections covering each number of frames
+
+  :param bbox: The bounding boxes
+  :return: The list of (number of frames, count) for each number of frames
+           covered by any reflections
+
+  '''
+  from dials.array_family import flex
+  assert len(bbox) > 0, "Need > 0 reflections"
+  x0, x1, y0, y1, z0, z1 = bbox.parts()
+  nframes = z1 - z0
+  min_nframes = flex.min(nframes)
+  counts = count_integers(nframes, min_nframes, flex.max(nframes))
+  return [(min_nframes + i, c) for i, c in enumerate(counts) if c > 0]
+
+def nframes_percentile(bbox, threshold):
+  '''
+  Compute the number of frames which a fraction of the reflections cover, i.e.
+  sorted(b[5] - b[4] for b in bbox)[int(threshold * len(bbox))]
+
+  :param bbox: The bounding boxes
+  :param threshold: The fraction of reflections
+  :return: The number of frames
+
+  '''
+  assert threshold > 0, "Threshold must be > 0"
+  assert threshold <= 1.0, "Threshold must be < 1"
+  cutoff = min(int(threshold * len(bbox)), len(bbox) - 1)
+  total = 0
+  for nframes, count in count_reflections_per_nframes(bbox):
+    total += count
+    if total > cutoff:
+      return nframes
+  raise RuntimeError('Programmer Error: cutoff out of range')
 
 
 class TimingInfo(object):
@@ -150,6 +242,10 @@ def __init__(self):
     self.finalize = 0
     self.total = 0
     self.user = 0
+    self.images_read = 0
+    self.images_cached = 0
+    self.images_needed = 0
+    self.stage_timing = None
 
   def __str__(self):
     ''' Convert to string. '''
@@ -163,9 +259,172 @@ def __str__(self):
       ["Total time"       , "%.2f seconds" % (self.total)      ],
       ["User time"        , "%.2f seconds" % (self.user)       ],
     ]
+    if self.images_needed > 0:
+      rows.extend([
+        ["Images read"       , "%d" % (self.images_read)   ],
+        ["Read amplification", "%.2f" % (
+          self.images_read / self.images_needed)        ],
+      ])
+    if self.images_cached > 0:
+      rows.extend([
+        ["Images from shoebox cache", "%d" % (self.images_cached) ],
+      ])
     return table(rows, justify='right', prefix=' ')
 
 
+class StageTimingInfo(object):
+  '''
+  A class to contain the per stage timing info from the integrator.
+
+  For each stage of the integration the time spent, the number of reflections
+  and the number of shoebox pixels processed are recorded for each thread.
+  Thread numbers are local to each job, so the totals for thread i are summed
+  over the i-th thread of every job. Jobs run by the Python executors have a
+  single thread.
+
+  '''
+
+  def __init__(self):
+    self.algorithms = {}
+    self.stages = []
+    self.threads = []
+    self.jobs = []
+
+  @classmethod
+  def from_profiler(Class, profiler):
+    '''
+    Create from the C++ integration profiler
+
+    :param profiler: The IntegrationProfiler object
+    :return: The timing info
+
+    '''
+    result = Class()
+    result.stages = [
+      profiler.stage_name(j) for j in range(profiler.num_stages())]
+    for i in range(profiler.num_threads()):
+      result.threads.append(dict(
+        (name, {
+          'time'        : profiler.time(i, j),
+          'reflections' : profiler.count(i, j),
+          'pixels'      : profiler.pixels(i, j),
+        }) for j, name in enumerate(result.stages)))
+    return result
+
+  def add_job(self, index, **kwargs):
+    '''
+    Record the job level timings
+
+    :param index: The job index
+    :param kwargs: The timings for the job
+
+    '''
+    job = {'index' : index}
+    job.update(kwargs)
+    self.jobs.append(job)
+
+  def add(self, name, time, reflections, pixels, thread=0):
+    '''
+    Add to the timings of a stage
+
+    :param name: The name of the stage
+    :param time: The time spent
+    :param reflections: The number of reflections processed
+    :param pixels: The number of shoebox pixels processed
+    :param thread: The thread number
+
+    '''
+    if name not in self.stages:
+      self.stages.append(name)
+    while len(self.threads) <= thread:
+      self.threads.append({})
+    total = self.threads[thread].setdefault(name, {
+      'time'        : 0.0,
+      'reflections' : 0,
+      'pixels'      : 0 })
+    total['time'] += time
+    total['reflections'] += reflections
+    total['pixels'] += pixels
+
+  def update(self, other):
+    '''
+    Add the timings from another job
+
+    :param other: The other timing info
+
+    '''
+    for name in other.stages:
+      if name not in self.stages:
+        self.stages.append(name)
+    for thread, other_thread in enumerate(other.threads):
+      for name, counters in other_thread.iteritems():
+        self.add(
+          name,
+          counters['time'],
+          counters['reflections'],
+          counters['pixels'],
+          thread)
+    self.algorithms.update(other.algorithms)
+    self.jobs.extend(other.jobs)
+
+  def totals(self):
+    '''
+    :return: The timings for each stage summed over all threads
+
+    '''
+    result = []
+    for name in self.stages:
+      total = {'time' : 0.0, 'reflections' : 0, 'pixels' : 0}
+      for thread in self.threads:
+        if name in thread:
+          for key in total:
+            total[key] += thread[name][key]
+      result.append((name, total))
+    return result
+
+  def as_dict(self):
+    '''
+    :return: The timing info as a dictionary
+
+    '''
+    return {
+      'algorithms' : self.algorithms,
+      'stages'     : [dict(name=name, **total) for name, total in self.totals()],
+      'threads'    : [
+        [dict(name=name, **thread[name]) for name in self.stages if name in thread]
+        for thread in self.threads],
+      'jobs'       : self.jobs,
+    }
+
+  def as_json(self, filename):
+    '''
+    Write the timing info to a JSON file
+
+    :param filename: The output filename
+
+    '''
+    import json
+    with open(filename, "w") as outfile:
+      json.dump(self.as_dict(), outfile, indent=2)
+
+  def __str__(self):
+    ''' Convert to string. '''
+    from libtbx.table_utils import format as table
+    rows = [["Stage", "Time", "Reflections", "Pixels", "us / pixel"]]
+    for name, total in self.totals():
+      if total['pixels'] > 0:
+        per_pixel = "%.3f" % (1e6 * total['time'] / total['pixels'])
+      else:
+        per_pixel = "-"
+      rows.append([
+        name,
+        "%.2f seconds" % total['time'],
+        "%d" % total['reflections'],
+        "%d" % total['pixels'],
+        per_pixel])
+    return table(rows, has_header=True, justify='right', prefix=' ')
+
+
 class ExecuteParallelTask(object):
   '''
   Helper class to run things on cluster
@@ -228,6 +487,7 @@ def process(self):
     '''
     from time import time
     from dials.util.mp import multi_node_parallel_map
+    from dials.util.mp import bounded_parallel_map
     import platform
     from math import ceil
     start_time = time()
@@ -253,22 +513,36 @@ def process(self):
       logger.info(' Using %s with %d parallel job(s) and %d processes per node\n' % (mp_method, mp_njobs, mp_nproc))
     else:
       logger.info(' Using multiprocessing with %d parallel job(s)\n' % (mp_nproc))
+    dynamic = self.manager.params.mp.schedule == "dynamic"
     if mp_njobs * mp_nproc > 1:
       def process_output(result):
         for message in result[1]:
           logger.log(message.levelno, message.msg)
         self.manager.accumulate(result[0])
-        result[0].reflections = None
-        result[0].data = None
-      multi_node_parallel_map(
-        func                       = ExecuteParallelTask(),
-        iterable                   = list(self.manager.tasks()),
-        njobs                      = mp_njobs,
-        nproc                      = mp_nproc,
-        callback                   = process_output,
-        cluster_method             = mp_method,
-        preserve_order             = True,
-        preserve_exception_message = True)
+        for r in (result[0] if isinstance(result[0], list) else [result[0]]):
+          r.reflections = None
+          r.data = None
+      if mp_njobs == 1:
+
+        # Create the tasks only as processes become free so that each task's
+        # split of the reflection table is not held in memory for long
+        bounded_parallel_map(
+          func           = ExecuteParallelTask(),
+          iterable       = self.manager.tasks(),
+          nproc          = mp_nproc,
+          callback       = process_output,
+          max_pending    = 2 * mp_nproc,
+          preserve_order = not dynamic)
+      else:
+        multi_node_parallel_map(
+          func                       = ExecuteParallelTask(),
+          iterable                   = list(self.manager.tasks()),
+          njobs                      = mp_njobs,
+          nproc                      = mp_nproc,
+          callback                   = process_output,
+          cluster_method             = mp_method,
+          preserve_order             = not dynamic,
+          preserve_exception_message = True)
     else:
       for task in self.manager.tasks():
         self.manager.accumulate(task())
@@ -328,9 +602,160 @@ def __call__(self):
     result.extract_time = 0
     result.process_time = 0
     result.total_time = 0
+    result.images_read = 0
+    result.images_cached = 0
     return result
 
 
+class ShoeboxCache(object):
+  '''
+  A cache of extracted shoeboxes on disk. Each job writes its shoeboxes as they
+  are extracted, in the order they are processed, so that later passes over
+  the same jobs can process the shoeboxes from the cache instead of reading
+  and extracting the images again. The reflections are matched by the
+  "cache_index" column and their bounding boxes, so reflections split over
+  job boundaries are matched as long as the jobs are the same.
+
+  '''
+
+  def __init__(self, directory=None):
+    '''
+    Initialise the cache directory
+
+    :param directory: The directory (or None to create a temporary directory)
+
+    '''
+    import os
+    import tempfile
+    if directory is None:
+      directory = tempfile.mkdtemp(prefix='shoebox_cache_', dir=os.getcwd())
+      self.temporary = True
+    else:
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+      self.temporary = False
+    self.directory = directory
+
+  def filename(self, index):
+    '''
+    :return: The cache filename for a job
+
+    '''
+    import os
+    return os.path.join(self.directory, 'shoeboxes_%d.pickle' % index)
+
+  def open(self, index, frame0, frame1, reflections):
+    '''
+    Open the cache file for a job and write the reflections it will contain
+
+    :param index: The job index
+    :param frame0: The first frame in the job
+    :param frame1: The last frame in the job
+    :param reflections: The reflections in the job
+    :return: The file to write the shoeboxes to
+
+    '''
+    import cPickle as pickle
+    stream = open(self.filename(index), 'wb')
+    pickle.dump(
+      (frame0, frame1, reflections['cache_index'], reflections['bbox']),
+      stream,
+      protocol=pickle.HIGHEST_PROTOCOL)
+    return stream
+
+  @staticmethod
+  def write(stream, frame, reflections):
+    '''
+    Write the shoeboxes of reflections completed on a frame
+
+    '''
+    import cPickle as pickle
+    pickle.dump(
+      (frame,
+       reflections['cache_index'],
+       reflections['bbox'],
+       reflections['shoebox']),
+      stream,
+      protocol=pickle.HIGHEST_PROTOCOL)
+
+  def reader(self, index, frame0, frame1, reflections):
+    '''
+    Get an iterator over the cached shoeboxes of the reflections in a job.
+
+    :param index: The job index
+    :param frame0: The first frame in the job
+    :param frame1: The last frame in the job
+    :param reflections: The reflections in the job
+    :return: An iterator of (frame, row indices, shoeboxes) or None if the
+             cache does not contain all the reflections
+
+    '''
+    import cPickle as pickle
+    import os
+    if 'cache_index' not in reflections:
+      return None
+    filename = self.filename(index)
+    if not os.path.exists(filename):
+      return None
+    stream = open(filename, 'rb')
+    f0, f1, cache_index, bbox = pickle.load(stream)
+    cached = set(self._keys(cache_index, bbox))
+    lookup = dict((k, i) for i, k in enumerate(
+      self._keys(reflections['cache_index'], reflections['bbox'])))
+    if ((f0, f1) != (frame0, frame1) or
+        len(lookup) != len(reflections) or
+        not all(k in cached for k in lookup)):
+      stream.close()
+      return None
+    return self._iterate(stream, lookup)
+
+  def remove(self):
+    '''
+    Delete the cache files
+
+    '''
+    import os
+    import shutil
+    if self.temporary:
+      shutil.rmtree(self.directory, ignore_errors=True)
+    else:
+      for filename in os.listdir(self.directory):
+        if filename.startswith('shoeboxes_') and filename.endswith('.pickle'):
+          os.remove(os.path.join(self.directory, filename))
+
+  @staticmethod
+  def _keys(cache_index, bbox):
+    '''
+    :return: The keys to match the reflections on
+
+    '''
+    x0, x1, y0, y1, z0, z1 = bbox.parts()
+    return zip(cache_index, z0, z1)
+
+  def _iterate(self, stream, lookup):
+    '''
+    Iterate through the shoeboxes in the cache file
+
+    '''
+    import cPickle as pickle
+    from dials.array_family import flex
+    with stream:
+      while True:
+        try:
+          frame, cache_index, bbox, shoeboxes = pickle.load(stream)
+        except EOFError:
+          break
+        selection = flex.size_t()
+        indices = flex.size_t()
+        for i, k in enumerate(self._keys(cache_index, bbox)):
+          j = lookup.get(k)
+          if j is not None:
+            selection.append(i)
+            indices.append(j)
+        if len(indices) > 0:
+          yield frame, indices, shoeboxes.select(selection)
+
+
 class Task(object):
   '''
   A class to perform a processing task.
@@ -374,14 +799,39 @@ def __call__(self):
 
     :return: The processed data
 
+    '''
+    from time import time
+
+    # Initialise the task
+    self.start()
+
+    # Loop through the imageset, extract pixels and process reflections
+    if self.processor is not None:
+      for i in range(len(self.imageset)):
+        st = time()
+        image, mask = self.read(i)
+        self.read_time += time() - st
+        self.images_read += 1
+        self.next(image, mask)
+        del image
+        del mask
+
+    # Finish the task
+    return self.finish()
+
+  def start(self):
+    '''
+    Initialise the executor and the shoebox processor before any images are
+    given to the task. If the shoeboxes are all in the cache then they are
+    processed here and the task needs no images.
+
     '''
     from dials.array_family import flex
     from time import time
-    from dials.model.data import make_image
     from libtbx.introspection import machine_memory_info
 
     # Get the start time
-    start_time = time()
+    self.start_time = time()
 
     # Set the global process ID
     job.index = self.index
@@ -415,6 +865,7 @@ def __call__(self):
       frame0, frame1 = imageset.get_array_range()
     except Exception:
       frame0, frame1 = (0, len(imageset))
+    self.imageset = imageset
 
     # Initlize the executor
     self.executor.initialize(frame0, frame1, self.reflections)
@@ -426,60 +877,121 @@ def __call__(self):
       allocate=False,
       flatten=self.params.shoebox.flatten)
 
-    # Create the processor
-    processor = ShoeboxProcessor(
-      self.reflections,
-      len(imageset.get_detector()),
-      frame0,
-      frame1,
-      self.params.debug.output)
+    # Get the shoeboxes from the cache if they are all there
+    cached = None
+    if self.params.cache is not None:
+      cached = self.params.cache.reader(
+        self.index,
+        frame0,
+        frame1,
+        self.reflections)
+
+    # The timing information
+    self.read_time = 0.0
+    self.extract_time = 0.0
+    self.process_time = 0.0
+    self.images_read = 0
+    self.images_cached = 0
+    self.processor = None
+
+    if cached is not None:
+
+      # Process the reflections in the order they were extracted
+      start_time_cached = time()
+      for frame, indices, shoeboxes in cached:
+        st = time()
+        subset = self.reflections.select(indices)
+        subset['shoebox'] = shoeboxes
+        self.executor.process(frame, subset)
+        if not self.params.debug.output:
+          del subset['shoebox']
+        self.reflections.set_selected(indices, subset)
+        self.process_time += time() - st
+      self.read_time = time() - start_time_cached - self.process_time
+      self.images_cached = len(imageset)
 
-    # Compute percentage of max available. The function is not portable to
-    # windows so need to add a check if the function fails. On windows no
-    # warning will be printed
-    memory_info = machine_memory_info()
-    total_memory = memory_info.memory_total()
-    sbox_memory = processor.compute_max_memory_usage()
-    if total_memory is not None:
-      assert total_memory > 0, "Your system appears to have no memory!"
-      assert self.params.block.max_memory_usage >  0.0, "maximum memory usage must be > 0"
-      assert self.params.block.max_memory_usage <= 1.0, "maximum memory usage must be <= 1"
-      limit_memory = total_memory * self.params.block.max_memory_usage
-      if sbox_memory > limit_memory:
-        raise RuntimeError('''
-        There was a problem allocating memory for shoeboxes. Possible solutions
-        include increasing the percentage of memory allowed for shoeboxes or
-        decreasing the block size. This could also be caused by a highly mosaic
-        crystal model - is your crystal really this mosaic?
-          Total system memory: %g GB
-          Limit shoebox memory: %g GB
-          Required shoebox memory: %g GB
-        ''' % (total_memory/1e9, limit_memory/1e9, sbox_memory/1e9))
-      else:
-        logger.info(' Memory usage:')
-        logger.info('  Total system memory: %g GB' % (total_memory/1e9))
-        logger.info('  Limit shoebox memory: %g GB' % (limit_memory/1e9))
-        logger.info('  Required shoebox memory: %g GB' % (sbox_memory/1e9))
-        logger.info('')
+    else:
 
-    # Loop through the imageset, extract pixels and process reflections
-    read_time = 0.0
-    for i in range(len(imageset)):
-      st = time()
-      image = imageset.get_corrected_data(i)
-      mask = imageset.get_mask(i)
-      if self.params.lookup.mask is not None:
-        assert len(mask) == len(self.params.lookup.mask), \
-          "Mask/Image are incorrect size %d %d" % (
-            len(mask),
-            len(self.params.lookup.mask))
-        mask = tuple(m1 & m2 for m1, m2 in zip(self.params.lookup.mask, mask))
-
-      read_time += time() - st
-      processor.next(make_image(image, mask), self.executor)
-      del image
-      del mask
-    assert processor.finished(), "Data processor is not finished"
+      # Create the processor
+      self.processor = ShoeboxProcessor(
+        self.reflections,
+        len(imageset.get_detector()),
+        frame0,
+        frame1,
+        self.params.debug.output)
+
+      # Compute percentage of max available. The function is not portable to
+      # windows so need to add a check if the function fails. On windows no
+      # warning will be printed
+      memory_info = machine_memory_info()
+      total_memory = memory_info.memory_total()
+      sbox_memory = self.processor.compute_max_memory_usage()
+      if total_memory is not None:
+        assert total_memory > 0, "Your system appears to have no memory!"
+        assert self.params.block.max_memory_usage >  0.0, "maximum memory usage must be > 0"
+        assert self.params.block.max_memory_usage <= 1.0, "maximum memory usage must be <= 1"
+        limit_memory = total_memory * self.params.block.max_memory_usage
+        if sbox_memory > limit_memory:
+          raise RuntimeError('''
+          There was a problem allocating memory for shoeboxes. Possible solutions
+          include increasing the percentage of memory allowed for shoeboxes or
+          decreasing the block size. This could also be caused by a highly mosaic
+          crystal model - is your crystal really this mosaic?
+            Total system memory: %g GB
+            Limit shoebox memory: %g GB
+            Required shoebox memory: %g GB
+          ''' % (total_memory/1e9, limit_memory/1e9, sbox_memory/1e9))
+        else:
+          logger.info(' Memory usage:')
+          logger.info('  Total system memory: %g GB' % (total_memory/1e9))
+          logger.info('  Limit shoebox memory: %g GB' % (limit_memory/1e9))
+          logger.info('  Required shoebox memory: %g GB' % (sbox_memory/1e9))
+          logger.info('')
+
+  def read(self, index):
+    '''
+    Read an image from the task's imageset
+
+    :param index: The index of the image in the task's imageset
+    :return: The image data and mask
+
+    '''
+    image = self.imageset.get_corrected_data(index)
+    mask = self.imageset.get_mask(index)
+    if self.params.lookup.mask is not None:
+      assert len(mask) == len(self.params.lookup.mask), \
+        "Mask/Image are incorrect size %d %d" % (
+          len(mask),
+          len(self.params.lookup.mask))
+      mask = tuple(m1 & m2 for m1, m2 in zip(self.params.lookup.mask, mask))
+    return image, mask
+
+  def next(self, image, mask):
+    '''
+    Extract the pixels from the next image and process the reflections
+
+    :param image: The image data
+    :param mask: The image mask
+
+    '''
+    from dials.model.data import make_image
+    self.processor.next(make_image(image, mask), self.executor)
+
+  def finish(self):
+    '''
+    Finish the processing once all the images have been given to the task.
+
+    :return: The processed data
+
+    '''
+    from time import time
+
+    # Get the processor timing
+    if self.processor is not None:
+      assert self.processor.finished(), "Data processor is not finished"
+      self.extract_time = self.processor.extract_time()
+      self.process_time = self.processor.process_time()
+      self.processor = None
 
     # Optionally save the shoeboxes
     if self.params.debug.output and self.params.debug.separate_files:
@@ -503,10 +1015,139 @@ def __call__(self):
 
     # Return the result
     result = Result(self.index, self.reflections, self.executor.data())
-    result.read_time = read_time
-    result.extract_time = processor.extract_time()
-    result.process_time = processor.process_time()
-    result.total_time = time() - start_time
+    result.read_time = self.read_time
+    result.extract_time = self.extract_time
+    result.process_time = self.process_time
+    result.total_time = time() - self.start_time
+    result.images_read = self.images_read
+    result.images_cached = self.images_cached
+
+    # Add the job to the per stage timings if the executor records them
+    result.stage_timing = getattr(self.executor, 'stage_timing', None)
+    if result.stage_timing is not None:
+      result.stage_timing.add_job(
+        self.index,
+        frames          = list(self.job),
+        num_reflections = len(self.reflections),
+        read_time       = result.read_time,
+        extract_time    = result.extract_time,
+        process_time    = result.process_time,
+        total_time      = result.total_time)
+    return result
+
+
+class TaskGroup(object):
+  '''
+  A group of tasks on consecutive blocks of images from the same imageset.
+
+  The blocks overlap so that reflections crossing a block boundary are fully
+  contained in a block. Rather than each task reading its own images, the
+  tasks in the group are run together: each image is read once, given to every
+  task whose block contains it and then released.
+
+  '''
+
+  def __init__(self, tasks):
+    '''
+    Initialise the group
+
+    :param tasks: The list of tasks
+
+    '''
+    self.tasks = tasks
+
+  def __call__(self):
+    '''
+    Do the processing.
+
+    :return: The list of processed data for each task
+
+    '''
+    from time import time
+
+    # Tasks with no reflections need no images
+    results = [t() for t in self.tasks if not isinstance(t, Task)]
+    pending = sorted(
+      [t for t in self.tasks if isinstance(t, Task)],
+      key=lambda t: t.job)
+
+    # The tasks are interleaved so each needs its own copy of the executor, as
+    # it would have if the tasks were run in separate processes
+    if len(pending) > 1:
+      import cPickle as pickle
+      for task in pending:
+        task.executor = pickle.loads(
+          pickle.dumps(task.executor, pickle.HIGHEST_PROTOCOL))
+    active = []
+    frame = None
+    while len(pending) > 0 or len(active) > 0:
+
+      # Start the tasks whose block begins on this frame
+      if len(active) == 0:
+        frame = pending[0].job[0]
+      while len(pending) > 0 and pending[0].job[0] <= frame:
+        task = pending.pop(0)
+        task.start()
+        if task.processor is None:
+          results.append(task.finish())
+        else:
+          active.append(task)
+      if len(active) == 0:
+        continue
+
+      # Read the image once and give it to all the tasks which need it
+      reader = active[0]
+      st = time()
+      image, mask = reader.read(frame - reader.job[0])
+      reader.read_time += time() - st
+      reader.images_read += 1
+      for task in active:
+        task.next(image, mask)
+      del image
+      del mask
+      frame += 1
+
+      # Finish the tasks whose block ends on this frame
+      for task in [t for t in active if t.job[1] <= frame]:
+        active.remove(task)
+        results.append(task.finish())
+    return sorted(results, key=lambda r: r.index)
+
+
+class SubTask(object):
+  '''
+  A task processing part of the reflections of a job.
+
+  The reflections in an expensive job are divided into parts by the frame on
+  which they are completed and each part is given to its own task which only
+  reads the frames its reflections need. The results of the parts are merged
+  back together by the manager once they have all finished.
+
+  '''
+
+  def __init__(self, task, selection, part):
+    '''
+    Initialise the sub task
+
+    :param task: The task processing the part of the job
+    :param selection: The indices of the reflections in the job
+    :param part: The (part, number of parts) of the job
+
+    '''
+    self.task = task
+    self.selection = selection
+    self.part = part
+
+  def __call__(self):
+    '''
+    Do the processing.
+
+    :return: The processed data for this part of the job
+
+    '''
+    result = self.task()
+    result.selection = self.selection
+    result.part = self.part
     return result
 
 
@@ -536,6 +1177,9 @@ def __init__(self, experiments, reflections, params):
     # Other data
     self.data = {}
 
+    # The results of jobs which have been split into parts
+    self.parts = {}
+
     # Save some parameters
     self.params = params
 
@@ -561,12 +1205,20 @@ def initialize(self):
     # Compute the block size and processors
     self.compute_blocks()
     self.compute_jobs()
-    self.split_reflections()
     self.compute_processors()
+    self.split_reflections()
 
     # Create the reflection manager
     self.manager = ReflectionManager(self.jobs, self.reflections)
 
+    # Estimate the cost of each job and the order to process them
+    self.compute_costs()
+    self.compute_schedule()
+
+    # The number of distinct images the jobs need, to compare with the number
+    # read (the blocks overlap so some images are read by more than one job)
+    self.time.images_needed = self.compute_frames()[0]
+
     # Parallel reading of HDF5 from the same handle is not allowed. Python
     # multiprocessing is a bit messed up and used fork on linux so need to
     # close and reopen file.
@@ -605,22 +1257,150 @@ def task(self, index):
         executor=self.executor)
     return task
 
+  def sub_tasks(self, index, num_parts):
+    '''
+    Get the tasks for the parts of a job.
+
+    The reflections are sorted by the frame on which they are completed and
+    divided into parts of roughly equal cost, so that each part needs a
+    shorter range of frames than the whole job.
+
+    '''
+    from dials.array_family import flex
+    frames = self.manager.job(index).frames()
+    reflections = self.manager.split(index)
+    x0, x1, y0, y1, z0, z1 = reflections['bbox'].parts()
+    cost = (x1 - x0) * (y1 - y0) * (z1 - z0) + REFLECTION_COST
+    order = flex.sort_permutation(z1, stable=True)
+    target = flex.sum(cost) / num_parts
+    selections = [flex.size_t()]
+    total = 0
+    for i in order:
+      if total >= target * len(selections) and len(selections) < num_parts:
+        selections.append(flex.size_t())
+      selections[-1].append(i)
+      total += cost[i]
+    tasks = []
+    for part, selection in enumerate(selections):
+      subset = reflections.select(selection)
+      bbox = subset['bbox'].parts()
+      task = Task(
+        index=index,
+        job=(max(frames[0], flex.min(bbox[4])),
+             min(frames[1], flex.max(bbox[5]))),
+        experiments=self.experiments,
+        reflections=subset,
+        params=self.params,
+        executor=self.executor)
+      tasks.append(SubTask(task, selection, (part, len(selections))))
+    return tasks
+
   def tasks(self):
     '''
     Iterate through the tasks.
 
     '''
+    if self.params.block.share_frames:
+      groups = self.task_groups()
+      if self.params.mp.schedule == "dynamic":
+        groups = sorted(
+          groups,
+          key=lambda indices: -sum(self.costs[i] for i in indices))
+      for indices in groups:
+        yield TaskGroup([self.task(i) for i in indices])
+    else:
+      for i, num_parts in self.schedule:
+        if num_parts > 1:
+          for task in self.sub_tasks(i, num_parts):
+            yield task
+        else:
+          yield self.task(i)
+
+  def task_groups(self):
+    '''
+    Divide the jobs into one group of consecutive jobs on the same imageset for
+    each process, so that the images in the overlap between the jobs in a
+    group are only read once.
+
+    :return: The list of job indices in each group
+
+    '''
+    from math import ceil
+    nprocs = self.params.mp.nproc * self.params.mp.njobs
+    max_size = int(ceil(len(self) / nprocs))
+    groups = []
     for i in range(len(self)):
-      yield self.task(i)
+      job = self.manager.job(i)
+      if (len(groups) > 0 and
+          len(groups[-1][1]) < max_size and
+          groups[-1][0] == job.index()):
+        groups[-1][1].append(i)
+      else:
+        groups.append((job.index(), [i]))
+    return [indices for key, indices in groups]
 
   def accumulate(self, result):
     ''' Accumulate the results. '''
+    if isinstance(result, list):
+      for r in result:
+        self.accumulate(r)
+      return
+    if getattr(result, 'selection', None) is not None:
+      self.accumulate_part(result)
+      return
     self.data[result.index] = result.data
     self.manager.accumulate(result.index, result.reflections)
     self.time.read += result.read_time
     self.time.extract += result.extract_time
     self.time.process += result.process_time
     self.time.total += result.total_time
+    self.time.images_read += result.images_read
+    self.time.images_cached += result.images_cached
+    stage_timing = getattr(result, 'stage_timing', None)
+    if stage_timing is not None:
+      if self.time.stage_timing is None:
+        self.time.stage_timing = stage_timing
+      else:
+        self.time.stage_timing.update(stage_timing)
+
+  def accumulate_part(self, result):
+    '''
+    Accumulate the result of part of a job. Once all the parts of the job
+    have finished, the reflections are put back in their original order and
+    the merged result is accumulated as if the job had not been split.
+
+    '''
+    from dials.array_family import flex
+    parts = self.parts.setdefault(result.index, [])
+    parts.append(result)
+    if len(parts) < result.part[1]:
+      return
+    del self.parts[result.index]
+    selection = flex.size_t()
+    reflections = flex.reflection_table()
+    for part in sorted(parts, key=lambda p: p.part[0]):
+      assert part.data is None, "Cannot merge the data of split jobs"
+      selection.extend(part.selection)
+      reflections.extend(part.reflections)
+    merged = Result(
+      result.index,
+      reflections.select(flex.sort_permutation(selection)))
+    merged.read_time = sum(p.read_time for p in parts)
+    merged.extract_time = sum(p.extract_time for p in parts)
+    merged.process_time = sum(p.process_time for p in parts)
+    merged.total_time = sum(p.total_time for p in parts)
+    merged.images_read = sum(p.images_read for p in parts)
+    merged.images_cached = sum(p.images_cached for p in parts)
+    merged.stage_timing = None
+    for part in parts:
+      stage_timing = getattr(part, 'stage_timing', None)
+      if stage_timing is None:
+        continue
+      if merged.stage_timing is None:
+        merged.stage_timing = stage_timing
+      else:
+        merged.stage_timing.update(stage_timing)
+    self.accumulate(merged)
 
   def finalize(self):
     '''
@@ -681,9 +1461,9 @@ def compute_blocks(self):
       else:
         assert self.params.block.threshold > 0, "Threshold must be > 0"
         assert self.params.block.threshold <= 1.0, "Threshold must be < 1"
-        nframes = sorted([b[5] - b[4] for b in self.reflections['bbox']])
-        cutoff = int(self.params.block.threshold*len(nframes))
-        block_size = nframes[cutoff] * 2
+        block_size = nframes_percentile(
+          self.reflections['bbox'],
+          self.params.block.threshold) * 2
         self.params.block.size = block_size
         self.params.block.units = 'frames'
 
@@ -756,41 +1536,174 @@ def split_reflections(self):
 
   def compute_processors(self):
     '''
-    Compute the number of processors
+    Compute the block size and number of processors from the memory budget.
+
+    The jobs are split into smaller blocks until the shoeboxes of a single job
+    fit in the memory allowed for shoeboxes, and the number of processes is
+    then limited so that the jobs running at once also fit. Blocks are not
+    split below twice the number of frames covered by block.threshold of the
+    reflections (the automatic block size), so that the same fraction of the
+    reflections are still recorded whole within a job.
 
     '''
     from libtbx.introspection import machine_memory_info
     from math import floor
-    from dials.array_family import flex
+
+    # Compute percentage of max available. The function is not portable to
+    # windows so need to add a check if the function fails. On windows no
+    # warning will be printed
+    memory_info = machine_memory_info()
+    total_memory = memory_info.memory_total()
+    if total_memory is None:
+      return
+    assert total_memory > 0, "Your system appears to have no memory!"
+    limit_memory = total_memory * self.params.block.max_memory_usage
+
+    # The smallest block the jobs can be split into
+    if len(self.reflections) > 0:
+      min_block_size = 2 * nframes_percentile(
+        self.reflections['bbox'],
+        self.params.block.threshold)
+    else:
+      min_block_size = 1
+
+    # Split the blocks until the largest job fits in memory
+    while True:
+      max_memory = self.compute_max_memory_usage()
+      if max_memory <= limit_memory:
+        break
+      block_size = max(
+        j.frames()[1] - j.frames()[0] for j in
+        [self.jobs[i] for i in range(len(self.jobs))])
+      if block_size <= max(min_block_size, 1):
+        raise RuntimeError('''
+          No enough memory to run integration jobs. Possible solutions
+          include increasing the percentage of memory allowed for shoeboxes.
+            Total system memory: %g GB
+            Limit shoebox memory: %g GB
+            Max shoebox memory: %g GB
+            Block size: %d frames (minimum %d frames)
+        ''' % (total_memory/1e9, limit_memory/1e9, max_memory/1e9,
+                block_size, min_block_size))
+      logger.info(
+        ' Max shoebox memory (%g GB) > limit (%g GB); splitting blocks of %d frames'
+        % (max_memory/1e9, limit_memory/1e9, block_size))
+      self.params.block.size = max(block_size // 2, min_block_size)
+      self.params.block.units = 'frames'
+      self.compute_jobs()
 
     # Set the memory usage per processor
     if self.params.mp.method == 'multiprocessing' and self.params.mp.nproc > 1:
+      njobs = int(floor(limit_memory / max_memory))
+      self.params.mp.nproc = min(self.params.mp.nproc, njobs)
+      self.params.block.max_memory_usage /= self.params.mp.nproc
+
+    # Log the plan
+    logger.info(' Memory plan:')
+    logger.info('  Total system memory: %g GB' % (total_memory/1e9))
+    logger.info('  Limit shoebox memory: %g GB' % (limit_memory/1e9))
+    logger.info('  Max shoebox memory per process: %g GB' % (max_memory/1e9))
+    logger.info('  Number of jobs: %d' % len(self.jobs))
+    logger.info('  Number of processes: %d' % self.params.mp.nproc)
+    logger.info('')
+
+  def compute_costs(self):
+    '''
+    Estimate the relative cost of each job from the number of reflections and
+    the total shoebox volume.
 
-      # Get the maximum shoebox memory
-      max_memory = flex.max(self.jobs.shoebox_memory(
-        self.reflections, self.params.shoebox.flatten))
+    '''
+    self.costs = [
+      self.manager.num_reflections(i) * REFLECTION_COST +
+      self.manager.shoebox_volume(i)
+      for i in range(len(self))]
 
-      # Compute percentage of max available. The function is not portable to
-      # windows so need to add a check if the function fails. On windows no
-      # warning will be printed
-      memory_info = machine_memory_info()
-      total_memory = memory_info.memory_total()
-      if total_memory is not None:
-        assert total_memory > 0, "Your system appears to have no memory!"
-        limit_memory = total_memory * self.params.block.max_memory_usage
-        njobs = int(floor(limit_memory / max_memory))
-        if njobs < 1:
-          raise RuntimeError('''
-            No enough memory to run integration jobs. Possible solutions
-            include increasing the percentage of memory allowed for shoeboxes or
-            decreasing the block size.
-              Total system memory: %g GB
-              Limit shoebox memory: %g GB
-              Max shoebox memory: %g GB
-          ''' % (total_memory/1e9, limit_memory/1e9, max_memory/1e9))
-        else:
-          self.params.mp.nproc = min(self.params.mp.nproc, njobs)
-          self.params.block.max_memory_usage /= self.params.mp.nproc
+  def compute_schedule(self):
+    '''
+    Compute the order in which the jobs are processed and the number of parts
+    to split each job into.
+
+    For the dynamic schedule the jobs are processed most expensive first. If
+    the executor processes each reflection independently, a job costing more
+    than twice the mean is split into parts so that processes which would
+    otherwise be idle at the end can pick up the parts of the job.
+
+    '''
+    from math import ceil
+    self.schedule = [(i, 1) for i in range(len(self))]
+    if self.params.mp.schedule != "dynamic":
+      return
+    self.schedule.sort(key=lambda s: -self.costs[s[0]])
+    nprocs = self.params.mp.nproc * self.params.mp.njobs
+    if (nprocs == 1 or
+        self.params.cache is not None or
+        self.params.debug.output or
+        not getattr(self.executor, 'split_jobs', False)):
+      return
+    mean_cost = sum(self.costs) / len(self.costs)
+    for k, (i, num_parts) in enumerate(self.schedule):
+      if self.costs[i] > 2 * mean_cost:
+        num_parts = min(
+          int(ceil(self.costs[i] / mean_cost)),
+          nprocs,
+          self.manager.num_reflections(i))
+        self.schedule[k] = (i, num_parts)
+        logger.info(' Splitting job %d (cost %.1f x mean) into %d parts' % (
+          i, self.costs[i] / mean_cost, num_parts))
+
+  def compute_max_memory_usage(self):
+    '''
+    Compute the maximum shoebox memory used by a process. The shoebox memory
+    of each job is computed from a copy of the bounding boxes split over the
+    job boundaries as the reflections will be.
+
+    :return: The number of bytes
+
+    '''
+    from dials.array_family import flex
+    reflections = flex.reflection_table()
+    for key in ['id', 'flags', 'panel', 'bbox']:
+      reflections[key] = self.reflections[key].deep_copy()
+    if self.params.shoebox.partials:
+      reflections.split_partials()
+    else:
+      self.jobs.split(reflections)
+    max_memory = flex.max(self.jobs.shoebox_memory(
+      reflections, self.params.shoebox.flatten))
+
+    # When sharing images, a process holds the shoeboxes of all the
+    # overlapping jobs at once
+    if self.params.block.share_frames:
+      max_memory *= self.compute_frames()[1]
+    return max_memory
+
+  def compute_frames(self):
+    '''
+    Compute the number of distinct frames needed by the jobs and the maximum
+    number of jobs which need the same frame
+
+    :return: (number of frames, maximum overlap)
+
+    '''
+    edges = {}
+    for i in range(len(self.jobs)):
+      job = self.jobs[i]
+      f0, f1 = job.frames()
+      group = edges.setdefault(job.index(), {})
+      group[f0] = group.get(f0, 0) + 1
+      group[f1] = group.get(f1, 0) - 1
+    num_frames = 0
+    max_overlap = 0
+    for group in edges.values():
+      count = 0
+      last = None
+      for frame in sorted(group.keys()):
+        if count > 0:
+          num_frames += frame - last
+        count += group[frame]
+        max_overlap = max(max_overlap, count)
+        last = frame
+    return num_frames, max_overlap
 
   def summary(self):
     '''
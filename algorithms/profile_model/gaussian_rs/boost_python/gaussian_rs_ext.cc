@@ -77,7 +77,8 @@ namespace boost_python {
           obj.num_scan_points(),
           obj.threshold(),
           obj.grid_method(),
-          obj.fit_method());
+          obj.fit_method(),
+          obj.pixel_lookup());
     }
 
     static
@@ -155,8 +156,10 @@ namespace boost_python {
           std::size_t,
           double,
           int,
-          int>())
+          int,
+          optional<bool> >())
       .def("coord", &GaussianRSProfileModeller::coord)
+      .def("pixel_lookup", &GaussianRSProfileModeller::pixel_lookup)
       .def_pickle(GaussianRSProfileModellerPickleSuite())
       ;
 
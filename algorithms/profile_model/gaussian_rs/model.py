@@ -78,6 +78,14 @@
         .type = choice
         .help = "The fitting method"
 
+      pixel_lookup = True
+        .type = bool
+        .help = "Interpolate the pixel coordinates used to transform the"
+                "shoeboxes from a coarse lookup table, falling back to the"
+                "exact calculation where the error would be more than 1e-3"
+                "of a grid step. Set to False to compute them for every"
+                "pixel."
+
       detector_space {
 
         deconvolution = False
@@ -638,7 +646,8 @@ def wrapper(experiment):
         num_scan_points,
         self.params.gaussian_rs.fitting.threshold,
         grid_method,
-        fit_method)
+        fit_method,
+        self.params.gaussian_rs.fitting.pixel_lookup)
 
     # Return the wrapper function
     return wrapper
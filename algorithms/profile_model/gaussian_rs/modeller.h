@@ -188,6 +188,8 @@ namespace dials { namespace algorithms {
      * @param num_scan_points The number of phi scan points
      * @param threshold The modelling threshold value
      * @param grid_method The gridding method
+     * @param fit_method The fitting method
+     * @param pixel_lookup Interpolate the pixel coordinates from a lookup
      */
     GaussianRSProfileModeller(
             boost::shared_ptr<BeamBase> beam,
@@ -201,7 +203,8 @@ namespace dials { namespace algorithms {
             std::size_t num_scan_points,
             double threshold,
             int grid_method,
-            int fit_method)
+            int fit_method,
+            bool pixel_lookup = true)
       : GaussianRSProfileModellerBase(
           beam,
           detector,
@@ -231,6 +234,12 @@ namespace dials { namespace algorithms {
           n_sigma,
           grid_size) {
       DIALS_ASSERT(sampler_ != 0);
+
+      // Interpolate the pixel coordinates in both the modelling and fitting
+      // transforms, keeping the error well below a grid step
+      if (pixel_lookup) {
+        spec_.enable_pixel_lookup(16, 1e-3);
+      }
     }
 
     boost::shared_ptr<BeamBase> beam() const {
@@ -281,6 +290,10 @@ namespace dials { namespace algorithms {
       return fit_method_;
     }
 
+    bool pixel_lookup() const {
+      return spec_.use_pixel_lookup();
+    }
+
     vec3<double> coord(std::size_t index) const {
       return sampler_->coord(index);
     }
@@ -427,8 +440,13 @@ namespace dials { namespace algorithms {
       af::ref<double> reference_cor = reflections["profile.correlation"];
       //af::ref<double> reference_rmsd = reflections["profile.rmsd"];
 
-      // Loop through all the reflections and process them
+      // The number of reflections to fit at once
+      const std::size_t batch_size = 256;
+
+      // Loop through all the reflections and group the ones to fit by their
+      // reference profile
       af::shared<bool> success(reflections.size(), false);
+      std::vector< std::vector<std::size_t> > groups(sampler_->size());
       for (std::size_t i = 0; i < reflections.size(); ++i) {
         DIALS_ASSERT(sbox[i].is_consistent());
 
@@ -441,85 +459,146 @@ namespace dials { namespace algorithms {
 
         // Check if we want to use this reflection
         if (check2(flags[i], sbox[i])) {
-
           try {
-
-            // Get the reference profiles
             std::size_t index = sampler_->nearest(sbox[i].panel, xyzpx[i]);
-            data_const_reference p = data(index).const_ref();
-            mask_const_reference mask1 = mask(index).const_ref();
-
-            // Create the coordinate system
-            vec3<double> m2 = spec_.goniometer().get_rotation_axis();
-            vec3<double> s0 = spec_.beam()->get_s0();
-            CoordinateSystem cs(m2, s0, s1[i], xyzmm[i][2]);
-
-            // Create the data array
-            af::versa< double, af::c_grid<3> > data(sbox[i].data.accessor());
-            std::copy(
-                sbox[i].data.begin(),
-                sbox[i].data.end(),
-                data.begin());
-
-            // Create the background array
-            af::versa< double, af::c_grid<3> > background(sbox[i].background.accessor());
-            std::copy(
-                sbox[i].background.begin(),
-                sbox[i].background.end(),
-                background.begin());
-
-            // Create the mask array
-            af::versa< bool, af::c_grid<3> > mask(sbox[i].mask.accessor());
-            std::transform(
-                sbox[i].mask.begin(),
-                sbox[i].mask.end(),
-                mask.begin(),
-                detail::check_mask_code(Valid | Foreground));
+            DIALS_ASSERT(index < groups.size());
+            groups[index].push_back(i);
+          } catch (dials::error e) {
+            continue;
+          }
+        }
+      }
 
-            // Compute the transform
-            TransformForward<double> transform(
-                spec_,
-                cs,
-                sbox[i].bbox,
-                sbox[i].panel,
-                data.const_ref(),
-                background.const_ref(),
-                mask.const_ref());
+      // Fit the reflections for each reference profile in batches
+      for (std::size_t index = 0; index < groups.size(); ++index) {
+        const std::vector<std::size_t> &group = groups[index];
+        if (group.size() == 0) {
+          continue;
+        }
 
-            // Get the transformed shoebox
-            data_const_reference c = transform.profile().const_ref();
-            data_const_reference b = transform.background().const_ref();
-            mask_const_reference mask2 = transform.mask().const_ref();
-            af::versa< bool, af::c_grid<3> > m(mask2.accessor());
-            DIALS_ASSERT(mask1.size() == mask2.size());
-            for (std::size_t j = 0; j < m.size(); ++j) {
-              m[j] = mask1[j] && mask2[j];
+        // Get the reference profiles
+        data_type reference_data;
+        mask_type reference_mask;
+        try {
+          reference_data = data(index);
+          reference_mask = mask(index);
+        } catch (dials::error e) {
+          continue;
+        }
+        data_const_reference p = reference_data.const_ref();
+        mask_const_reference mask1 = reference_mask.const_ref();
+
+        // Allocate the arrays for the transformed shoeboxes
+        af::c_grid<3> grid = p.accessor();
+        af::c_grid<4> batch_grid(af::tiny<std::size_t,4>(
+              std::min(batch_size, group.size()),
+              grid[0],
+              grid[1],
+              grid[2]));
+        af::versa< double, af::c_grid<4> > c(batch_grid);
+        af::versa< double, af::c_grid<4> > b(batch_grid);
+        af::versa< bool, af::c_grid<4> > m(batch_grid);
+        std::vector<std::size_t> rows;
+        for (std::size_t first = 0; first < group.size(); first += batch_size) {
+          std::size_t last = std::min(first + batch_size, group.size());
+
+          // Transform the shoeboxes to the reference grid
+          rows.clear();
+          for (std::size_t j = first; j < last; ++j) {
+            std::size_t i = group[j];
+            try {
+
+              // Create the coordinate system
+              vec3<double> m2 = spec_.goniometer().get_rotation_axis();
+              vec3<double> s0 = spec_.beam()->get_s0();
+              CoordinateSystem cs(m2, s0, s1[i], xyzmm[i][2]);
+
+              // Create the data array
+              af::versa< double, af::c_grid<3> > data(sbox[i].data.accessor());
+              std::copy(
+                  sbox[i].data.begin(),
+                  sbox[i].data.end(),
+                  data.begin());
+
+              // Create the background array
+              af::versa< double, af::c_grid<3> > background(sbox[i].background.accessor());
+              std::copy(
+                  sbox[i].background.begin(),
+                  sbox[i].background.end(),
+                  background.begin());
+
+              // Create the mask array
+              af::versa< bool, af::c_grid<3> > mask(sbox[i].mask.accessor());
+              std::transform(
+                  sbox[i].mask.begin(),
+                  sbox[i].mask.end(),
+                  mask.begin(),
+                  detail::check_mask_code(Valid | Foreground));
+
+              // Compute the transform
+              TransformForward<double> transform(
+                  spec_,
+                  cs,
+                  sbox[i].bbox,
+                  sbox[i].panel,
+                  data.const_ref(),
+                  background.const_ref(),
+                  mask.const_ref());
+
+              // Copy the transformed shoebox into the next row of the batch
+              data_const_reference cr = transform.profile().const_ref();
+              data_const_reference br = transform.background().const_ref();
+              mask_const_reference mask2 = transform.mask().const_ref();
+              DIALS_ASSERT(mask1.size() == mask2.size());
+              DIALS_ASSERT(cr.size() == p.size());
+              std::size_t offset = rows.size() * p.size();
+              for (std::size_t k = 0; k < p.size(); ++k) {
+                c[offset + k] = cr[k];
+                b[offset + k] = br[k];
+                m[offset + k] = mask1[k] && mask2[k];
+              }
+              rows.push_back(i);
+
+            } catch (dials::error e) {
+              continue;
             }
-
-            // Do the profile fitting
-            ProfileFitter<double> fit(
-                c,
-                b,
-                m.const_ref(),
-                p,
-                1e-3,
-                100);
-            DIALS_ASSERT(fit.niter() < 100);
-
-            // Set the data in the reflection
-            intensity_val[i] = fit.intensity()[0];
-            intensity_var[i] = fit.variance()[0];
-            reference_cor[i] = fit.correlation();
-            //reference_rmsd[i] = fit.rmsd();
-
-            // Set the integrated flag
-            flags[i] |= af::IntegratedPrf;
-            success[i] = true;
-
-          } catch (dials::error e) {
-            /* std::cout << e.what() << std::endl; */
+          }
+          if (rows.size() == 0) {
             continue;
           }
+
+          // Do the profile fitting
+          af::c_grid<4> fit_grid(af::tiny<std::size_t,4>(
+                rows.size(),
+                grid[0],
+                grid[1],
+                grid[2]));
+          BatchProfileFitter<double> fit(
+              af::const_ref< double, af::c_grid<4> >(c.begin(), fit_grid),
+              af::const_ref< double, af::c_grid<4> >(b.begin(), fit_grid),
+              af::const_ref< bool, af::c_grid<4> >(m.begin(), fit_grid),
+              p,
+              1e-3,
+              100);
+
+          // Set the data in the reflections
+          af::shared<bool> fit_success = fit.success();
+          af::shared<std::size_t> fit_niter = fit.niter();
+          af::shared<double> fit_intensity = fit.intensity();
+          af::shared<double> fit_variance = fit.variance();
+          af::shared<double> fit_correlation = fit.correlation();
+          for (std::size_t j = 0; j < rows.size(); ++j) {
+            std::size_t i = rows[j];
+            if (fit_success[j] && fit_niter[j] < 100) {
+              intensity_val[i] = fit_intensity[j];
+              intensity_var[i] = fit_variance[j];
+              reference_cor[i] = fit_correlation[j];
+
+              // Set the integrated flag
+              flags[i] |= af::IntegratedPrf;
+              success[i] = true;
+            }
+          }
         }
       }
       return success;
@@ -652,7 +731,8 @@ namespace dials { namespace algorithms {
           num_scan_points_,
           threshold_,
           grid_method_,
-          fit_method_);
+          fit_method_,
+          spec_.use_pixel_lookup());
       result.finalized_ = finalized_;
       result.n_reflections_.assign(
           n_reflections_.begin(),
@@ -76,6 +76,24 @@ namespace boost_python {
           obj.n_sigma(),
           obj.half_grid_size());
     }
+
+    static
+    boost::python::tuple getstate(const TransformSpec &obj) {
+      return boost::python::make_tuple(
+          obj.use_pixel_lookup(),
+          obj.pixel_lookup_region_size(),
+          obj.pixel_lookup_tolerance());
+    }
+
+    static
+    void setstate(TransformSpec &obj, boost::python::tuple state) {
+      DIALS_ASSERT(boost::python::len(state) == 3);
+      if (extract<bool>(state[0])()) {
+        obj.enable_pixel_lookup(
+            extract<std::size_t>(state[1])(),
+            extract<double>(state[2])());
+      }
+    }
   };
 
   /* template <typename FloatType> */
@@ -241,6 +259,13 @@ namespace boost_python {
       .def("grid_size", &TransformSpec::grid_size)
       .def("step_size", &TransformSpec::step_size)
       .def("grid_centre", &TransformSpec::grid_centre)
+      .def("enable_pixel_lookup",
+          &TransformSpec::enable_pixel_lookup, (
+            arg("region_size"),
+            arg("tolerance")))
+      .def("use_pixel_lookup", &TransformSpec::use_pixel_lookup)
+      .def("pixel_lookup_region_size", &TransformSpec::pixel_lookup_region_size)
+      .def("pixel_lookup_tolerance", &TransformSpec::pixel_lookup_tolerance)
       .def_pickle(TransformSpecPickleSuite())
       ;
 
@@ -0,0 +1,195 @@
+/*
+ * pixel_coord_lookup.h
+ *
+ *  Copyright (C) 2013 Diamond Light Source
+ *
+ *  Author: James Parkhurst
+ *
+ *  This code is distributed under the BSD license, a copy of which is
+ *  included in the root directory of this package.
+ */
+#ifndef DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_PIXEL_COORD_LOOKUP_H
+#define DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_PIXEL_COORD_LOOKUP_H
+
+#include <algorithm>
+#include <scitbx/vec2.h>
+#include <scitbx/vec3.h>
+#include <dxtbx/model/detector.h>
+#include <dials/array_family/scitbx_shared_and_versa.h>
+#include <dials/error.h>
+
+namespace dials {
+namespace algorithms {
+namespace profile_model {
+namespace gaussian_rs {
+namespace transform {
+
+  using scitbx::vec2;
+  using scitbx::vec3;
+  using dxtbx::model::Detector;
+  using dxtbx::model::Panel;
+
+  /**
+   * A lookup table of the lab coordinates of the pixel corners on each panel.
+   * The lab coordinates are sampled on a coarse grid of nodes every
+   * region_size pixels and bilinearly interpolated in between. On a flat
+   * panel with a linear pixel to millimetre mapping the interpolation is
+   * exact; for other mappings (e.g. parallax correction) the angular error of
+   * the interpolated coordinate is checked for each region when the table is
+   * built and any region where it exceeds the tolerance falls back to the
+   * exact calculation. The table is built up front so it can be shared
+   * between threads.
+   */
+  class PixelCoordLookup {
+  public:
+
+    /**
+     * Build the lookup table
+     * @param detector The detector model
+     * @param region_size The spacing of the nodes in pixels
+     * @param tolerance The maximum angular error (radians)
+     */
+    PixelCoordLookup(
+          const Detector &detector,
+          std::size_t region_size,
+          double tolerance)
+      : detector_(detector),
+        region_size_(region_size),
+        tolerance_(tolerance) {
+      DIALS_ASSERT(region_size > 0);
+      DIALS_ASSERT(tolerance > 0);
+      for (std::size_t p = 0; p < detector.size(); ++p) {
+        init_panel(detector[p]);
+      }
+    }
+
+    /** @returns The spacing of the nodes in pixels */
+    std::size_t region_size() const {
+      return region_size_;
+    }
+
+    /** @returns The maximum angular error */
+    double tolerance() const {
+      return tolerance_;
+    }
+
+    /** @returns The number of regions that use the exact calculation */
+    std::size_t num_exact(std::size_t panel) const {
+      DIALS_ASSERT(panel < exact_.size());
+      return std::count(exact_[panel].begin(), exact_[panel].end(), true);
+    }
+
+    /** @returns The total number of regions */
+    std::size_t num_regions(std::size_t panel) const {
+      DIALS_ASSERT(panel < exact_.size());
+      return exact_[panel].size();
+    }
+
+    /**
+     * Get the lab coordinate of a pixel corner
+     * @param panel The panel number
+     * @param x The x pixel corner
+     * @param y The y pixel corner
+     * @returns The lab coordinate
+     */
+    vec3<double> operator()(std::size_t panel, int x, int y) const {
+      DIALS_ASSERT(panel < coord_.size());
+      const af::versa< vec3<double>, af::c_grid<2> > &coord = coord_[panel];
+      std::size_t nx = coord.accessor()[1] - 1;
+      std::size_t ny = coord.accessor()[0] - 1;
+      std::size_t i = std::min((std::size_t)std::max(x, 0) / region_size_, nx-1);
+      std::size_t j = std::min((std::size_t)std::max(y, 0) / region_size_, ny-1);
+      if (exact_[panel](j, i)) {
+        return detector_[panel].get_pixel_lab_coord(vec2<double>(x, y));
+      }
+      return interpolate(coord.const_ref(), xnode_[panel].const_ref(),
+                         ynode_[panel].const_ref(), i, j, x, y);
+    }
+
+  private:
+
+    /**
+     * Sample the nodes on the panel and flag the regions where the
+     * interpolated coordinates are not accurate enough.
+     */
+    void init_panel(const Panel &panel) {
+      vec2<std::size_t> image_size = panel.get_image_size();
+      DIALS_ASSERT(image_size[0] > 0 && image_size[1] > 0);
+
+      // The node positions, always including the far edge of the panel
+      af::shared<int> xnode = make_nodes(image_size[0]);
+      af::shared<int> ynode = make_nodes(image_size[1]);
+
+      // The lab coordinate at each node
+      af::versa< vec3<double>, af::c_grid<2> > coord(
+          af::c_grid<2>(ynode.size(), xnode.size()));
+      for (std::size_t j = 0; j < ynode.size(); ++j) {
+        for (std::size_t i = 0; i < xnode.size(); ++i) {
+          coord(j, i) = panel.get_pixel_lab_coord(
+              vec2<double>(xnode[i], ynode[j]));
+        }
+      }
+
+      // Check the error at the centre and edge midpoints of each region
+      af::versa< bool, af::c_grid<2> > exact(
+          af::c_grid<2>(ynode.size()-1, xnode.size()-1), false);
+      for (std::size_t j = 0; j < exact.accessor()[0]; ++j) {
+        for (std::size_t i = 0; i < exact.accessor()[1]; ++i) {
+          int xm = (xnode[i] + xnode[i+1]) / 2;
+          int ym = (ynode[j] + ynode[j+1]) / 2;
+          int xt[] = { xm, xm, xm, xnode[i], xnode[i+1] };
+          int yt[] = { ym, ynode[j], ynode[j+1], ym, ym };
+          for (std::size_t k = 0; k < 5; ++k) {
+            vec3<double> a = panel.get_pixel_lab_coord(
+                vec2<double>(xt[k], yt[k]));
+            vec3<double> b = interpolate(coord.const_ref(),
+                xnode.const_ref(), ynode.const_ref(), i, j, xt[k], yt[k]);
+            if ((a.normalize() - b.normalize()).length() > tolerance_) {
+              exact(j, i) = true;
+              break;
+            }
+          }
+        }
+      }
+
+      xnode_.push_back(xnode);
+      ynode_.push_back(ynode);
+      coord_.push_back(coord);
+      exact_.push_back(exact);
+    }
+
+    af::shared<int> make_nodes(std::size_t size) const {
+      af::shared<int> node;
+      for (std::size_t i = 0; i < size; i += region_size_) {
+        node.push_back(i);
+      }
+      node.push_back(size);
+      return node;
+    }
+
+    static vec3<double> interpolate(
+        const af::const_ref< vec3<double>, af::c_grid<2> > &coord,
+        const af::const_ref<int> &xnode,
+        const af::const_ref<int> &ynode,
+        std::size_t i,
+        std::size_t j,
+        int x,
+        int y) {
+      double tx = (double)(x - xnode[i]) / (double)(xnode[i+1] - xnode[i]);
+      double ty = (double)(y - ynode[j]) / (double)(ynode[j+1] - ynode[j]);
+      return (coord(j,   i) * (1.0 - tx) + coord(j,   i+1) * tx) * (1.0 - ty) +
+             (coord(j+1, i) * (1.0 - tx) + coord(j+1, i+1) * tx) * ty;
+    }
+
+    Detector detector_;
+    std::size_t region_size_;
+    double tolerance_;
+    af::shared< af::shared<int> > xnode_;
+    af::shared< af::shared<int> > ynode_;
+    af::shared< af::versa< vec3<double>, af::c_grid<2> > > coord_;
+    af::shared< af::versa< bool, af::c_grid<2> > > exact_;
+  };
+
+}}}}} // namespace dials::algorithms::profile_model::gaussian_rs::transform
+
+#endif // DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_PIXEL_COORD_LOOKUP_H
@@ -11,6 +11,9 @@
 #ifndef DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_TRANSFORM_H
 #define DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_TRANSFORM_H
 
+#include <algorithm>
+#include <boost/shared_ptr.hpp>
+#include <boost/make_shared.hpp>
 #include <scitbx/vec2.h>
 #include <scitbx/vec3.h>
 #include <scitbx/array_family/tiny_types.h>
@@ -22,6 +25,7 @@
 #include <dials/algorithms/profile_model/gaussian_rs/coordinate_system.h>
 #include <dials/algorithms/profile_model/gaussian_rs/transform/map_frames.h>
 #include <dials/algorithms/profile_model/gaussian_rs/transform/beam_vector_map.h>
+#include <dials/algorithms/profile_model/gaussian_rs/transform/pixel_coord_lookup.h>
 #include <dials/model/data/shoebox.h>
 
 namespace dials {
@@ -99,7 +103,9 @@ namespace transform {
         step_size_(sigma_m_ * n_sigma_ / (grid_size + 0.5),
                    sigma_b_ * n_sigma_ / (grid_size + 0.5),
                    sigma_b_ * n_sigma_ / (grid_size + 0.5)),
-        grid_centre_(grid_size + 0.5, grid_size + 0.5, grid_size + 0.5) {
+        grid_centre_(grid_size + 0.5, grid_size + 0.5, grid_size + 0.5),
+        lookup_region_size_(0),
+        lookup_tolerance_(0) {
       DIALS_ASSERT(sigma_m_ > 0);
       DIALS_ASSERT(sigma_b_ > 0);
       DIALS_ASSERT(n_sigma_ > 0);
@@ -163,6 +169,53 @@ namespace transform {
       return grid_centre_;
     }
 
+    /**
+     * Use an interpolated lookup table for the pixel lab coordinates instead
+     * of computing them for every pixel of every reflection. Regions of the
+     * detector where the interpolated coordinates would move a pixel corner
+     * by more than the tolerance on the profile grid use the exact
+     * calculation instead.
+     * @param region_size The spacing of the lookup nodes in pixels
+     * @param tolerance The maximum error in units of the grid step
+     */
+    void enable_pixel_lookup(std::size_t region_size, double tolerance) {
+      DIALS_ASSERT(tolerance > 0);
+      double step = std::min(step_size_[1], step_size_[2]);
+      lookup_ = boost::make_shared<PixelCoordLookup>(
+          detector_, region_size, tolerance * step);
+      lookup_region_size_ = region_size;
+      lookup_tolerance_ = tolerance;
+    }
+
+    /** @returns Is the pixel lookup enabled */
+    bool use_pixel_lookup() const {
+      return lookup_ != NULL;
+    }
+
+    /** @returns The pixel lookup region size */
+    std::size_t pixel_lookup_region_size() const {
+      return lookup_region_size_;
+    }
+
+    /** @returns The pixel lookup tolerance in units of the grid step */
+    double pixel_lookup_tolerance() const {
+      return lookup_tolerance_;
+    }
+
+    /**
+     * Get the lab coordinate of a pixel corner, using the lookup if enabled
+     * @param panel The panel number
+     * @param x The x pixel corner
+     * @param y The y pixel corner
+     * @returns The lab coordinate
+     */
+    vec3<double> pixel_lab_coord(std::size_t panel, int x, int y) const {
+      if (lookup_ != NULL) {
+        return (*lookup_)(panel, x, y);
+      }
+      return detector_[panel].get_pixel_lab_coord(vec2<double>(x, y));
+    }
+
   private:
     boost::shared_ptr<BeamBase> beam_;
     Detector detector_;
@@ -175,6 +228,9 @@ namespace transform {
     int3 grid_size_;
     double3 step_size_;
     double3 grid_centre_;
+    boost::shared_ptr<const PixelCoordLookup> lookup_;
+    std::size_t lookup_region_size_;
+    double lookup_tolerance_;
   };
 
 
@@ -207,7 +263,7 @@ namespace transform {
         const af::const_ref< FloatType, af::c_grid<3> > &image,
         const af::const_ref< bool, af::c_grid<3> > &mask) {
       init(spec, cs, bbox, panel);
-      call(spec.detector()[panel], image, mask);
+      call(image, mask);
     }
 
     TransformForward(
@@ -219,7 +275,7 @@ namespace transform {
         const af::const_ref< FloatType, af::c_grid<3> > &bkgrd,
         const af::const_ref< bool, af::c_grid<3> > &mask) {
       init(spec, cs, bbox, panel);
-      call(spec.detector()[panel], image, bkgrd, mask);
+      call(image, bkgrd, mask);
     }
 
     /** @returns The transformed profile */
@@ -282,6 +338,16 @@ namespace transform {
           spec.n_sigma(),
           spec.grid_size()[2] / 2);
       efraction_arr_ = map_frames_backward(zrange, cs.phi(), cs.zeta());
+
+      // Compute the grid coordinates of each pixel corner once, since each
+      // corner is shared by up to four pixels
+      gc_arr_ = af::versa< vec2<double>, af::c_grid<2> >(
+          af::c_grid<2>(shoebox_size_[1]+1, shoebox_size_[2]+1));
+      for (std::size_t j = 0; j <= shoebox_size_[1]; ++j) {
+        for (std::size_t i = 0; i <= shoebox_size_[2]; ++i) {
+          gc_arr_(j, i) = gc(spec.pixel_lab_coord(panel, x0_+i, y0_+j));
+        }
+      }
     }
 
     /**
@@ -289,8 +355,7 @@ namespace transform {
      * @param image The image to transform
      * @param mask The mask accompanying the image
      */
-    void call(const Panel &panel,
-              const af::const_ref< FloatType, af::c_grid<3> > &image,
+    void call(const af::const_ref< FloatType, af::c_grid<3> > &image,
               const af::const_ref< bool, af::c_grid<3> > &mask) {
 
       // Check the input
@@ -327,12 +392,13 @@ namespace transform {
       // through the frames, mapping the fraction of the pixel value in each
       // frame to the grid point.
       af::c_grid<2> grid_size2(grid_size_[1], grid_size_[2]);
+      af::const_ref< vec2<double>, af::c_grid<2> > gc = gc_arr_.const_ref();
       for (std::size_t j = 0; j < shoebox_size_[1]; ++j) {
         for (std::size_t i = 0; i < shoebox_size_[2]; ++i) {
-          vert4 input(gc(panel, j, i),
-                      gc(panel, j, i+1),
-                      gc(panel, j+1, i+1),
-                      gc(panel, j+1, i));
+          vert4 input(gc(j, i),
+                      gc(j, i+1),
+                      gc(j+1, i+1),
+                      gc(j+1, i));
           af::shared<Match> matches = quad_to_grid(input, grid_size2, 0);
           for (int m = 0; m < matches.size(); ++m) {
             FloatType fraction = matches[m].fraction;
@@ -358,8 +424,7 @@ namespace transform {
      * @param bkgrd The background image to transform
      * @param mask The mask accompanying the image
      */
-    void call(const Panel &panel,
-              const af::const_ref< FloatType, af::c_grid<3> > &image,
+    void call(const af::const_ref< FloatType, af::c_grid<3> > &image,
               const af::const_ref< FloatType, af::c_grid<3> > &bkgrd,
               const af::const_ref< bool, af::c_grid<3> > &mask) {
 
@@ -399,12 +464,13 @@ namespace transform {
       // through the frames, mapping the fraction of the pixel value in each
       // frame to the grid point.
       af::c_grid<2> grid_size2(grid_size_[1], grid_size_[2]);
+      af::const_ref< vec2<double>, af::c_grid<2> > gc = gc_arr_.const_ref();
       for (std::size_t j = 0; j < shoebox_size_[1]; ++j) {
         for (std::size_t i = 0; i < shoebox_size_[2]; ++i) {
-          vert4 input(gc(panel, j, i),
-                      gc(panel, j, i+1),
-                      gc(panel, j+1, i+1),
-                      gc(panel, j+1, i));
+          vert4 input(gc(j, i),
+                      gc(j, i+1),
+                      gc(j+1, i+1),
+                      gc(j+1, i));
           af::shared<Match> matches = quad_to_grid(input, grid_size2, 0);
           for (int m = 0; m < matches.size(); ++m) {
             FloatType fraction = matches[m].fraction;
@@ -428,15 +494,11 @@ namespace transform {
     }
 
     /**
-     * Get a grid coordinate from an image coordinate
-     * @param j The y index
-     * @param i The x index
+     * Get a grid coordinate from a pixel lab coordinate
+     * @param sp The lab coordinate of the pixel corner
      * @returns The grid (c1, c2) index
      */
-    vec2<double> gc(const Panel &panel,
-                    std::size_t j,
-                    std::size_t i) const {
-      vec3<double> sp = panel.get_pixel_lab_coord(vec2<double>(x0_+i,y0_+j));
+    vec2<double> gc(const vec3<double> &sp) const {
       vec3<double> ds = sp.normalize() * s1_.length() - s1_;
       return vec2<double>(grid_cent_[2] + (e1_ * ds) / step_size_[2],
                           grid_cent_[1] + (e2_ * ds) / step_size_[1]);
@@ -453,6 +515,7 @@ namespace transform {
     af::versa< FloatType, af::c_grid<3> > background_;
     af::versa< FloatType, af::c_grid<2> > zfraction_arr_;
     af::versa< FloatType, af::c_grid<2> > efraction_arr_;
+    af::versa< vec2<double>, af::c_grid<2> > gc_arr_;
   };
 
 
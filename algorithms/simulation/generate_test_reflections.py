@@ -89,14 +89,22 @@ def random_background_plane2(sbox, a, b, c, d):
 
   from scitbx.random import variate, poisson_distribution
 
+  from dials.array_family import flex
+
   dz, dy, dx = sbox.focus()
 
   if b == c == d == 0.0:
     g = variate(poisson_distribution(mean = a))
-    for k in range(dz):
-      for j in range(dy):
-        for i in range(dx):
-          sbox[k, j, i] += next(g)
+    if isinstance(sbox, flex.double):
+      # Draw all the values in one call, in the same order as the loop
+      values = g(sbox.size()).as_double()
+      values.reshape(sbox.accessor())
+      sbox += values
+    else:
+      for k in range(dz):
+        for j in range(dy):
+          for i in range(dx):
+            sbox[k, j, i] += next(g)
   else:
     for k in range(dz):
       for j in range(dy):
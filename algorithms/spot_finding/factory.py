@@ -60,6 +60,14 @@ def generate_phil_scope():
       .type = bool
       .help = "Compute the mean background for each image"
 
+    threshold_spans = True
+      .type = bool
+      .help = "Only threshold the parts of each panel containing pixels which"
+              "are not masked (e.g. by the resolution limits, ice rings or"
+              "region of interest). The result is the same as thresholding"
+              "the whole image."
+      .expert_level = 2
+
     filter
       .help = "Parameters used in the spot finding filter strategy."
 
@@ -126,6 +134,29 @@ def generate_phil_scope():
       min_chunksize = 20
         .type = int(value_min=1)
         .help = "When chunksize is auto, this is the minimum chunksize"
+
+      transport = *pickle shared_memory
+        .type = choice
+        .help = "How the strong pixels are returned from the processes."
+                "With shared_memory, the pixel lists are written to a ring of"
+                "shared memory slots instead of being pickled. Only used"
+                "with njobs=1. The images are sent to the processes one at"
+                "a time, so chunksize is ignored."
+        .expert_level = 2
+
+      slot_size = 64
+        .type = int(value_min=1)
+        .help = "The size (in MB) of each shared memory slot. Two slots are"
+                "allocated for each process."
+        .expert_level = 2
+
+      chunked_labelling = False
+        .type = bool
+        .help = "Extract and label the strong pixels on a contiguous block of"
+                "images in each process, and only merge the spots touching"
+                "the block boundaries in the main process. This avoids"
+                "labelling all the images serially at the end."
+        .expert_level = 2
     }
   }
 
@@ -534,7 +565,11 @@ def from_parameters(params=None, datablock=None):
       min_spot_size             = params.spotfinder.filter.min_spot_size,
       max_spot_size             = params.spotfinder.filter.max_spot_size,
       no_shoeboxes_2d           = no_shoeboxes_2d,
-      min_chunksize             = params.spotfinder.mp.min_chunksize)
+      min_chunksize             = params.spotfinder.mp.min_chunksize,
+      mp_transport              = params.spotfinder.mp.transport,
+      mp_slot_size              = params.spotfinder.mp.slot_size,
+      mp_chunked_labelling      = params.spotfinder.mp.chunked_labelling,
+      threshold_spans           = params.spotfinder.threshold_spans)
 
   @staticmethod
   def configure_threshold(params, datablock):
@@ -32,6 +32,213 @@ def __init__(self, pixel_list):
     self.pixel_list = pixel_list
 
 
+class ThresholdSpans(object):
+  '''
+  The parts of a panel which need to be thresholded.
+
+  The panel is split into bands of rows and, for each band, the range of
+  columns containing pixels which are not masked (e.g. by the resolution
+  limits, ice rings or the region of interest) is found. Only these spans are
+  thresholded. Each span is extended by the kernel size of the threshold
+  algorithm in the slow direction so that every pixel in the band sees the
+  same local area as when thresholding the whole panel. Pixels outside the
+  column range are all masked so do not contribute to the local area.
+
+  Each span is a single range of columns, so masked pixels in the middle of
+  a band, such as the hole inside the d_max limit around the beam centre or
+  an ice ring, are still thresholded. Only the masked pixels at either end
+  of a band and the bands which are masked entirely are skipped.
+
+  '''
+
+  def __init__(self, mask, margin, region_of_interest=None, band_size=64):
+    '''
+    Find the spans from the static mask
+
+    :param mask: The static mask for the panel
+    :param margin: The kernel size of the threshold algorithm (slow, fast)
+    :param region_of_interest: A region of interest to process
+    :param band_size: The number of rows in each band
+
+    '''
+    from dials.array_family import flex
+    height, width = mask.all()
+
+    # Mask the pixels outside the region of interest
+    if region_of_interest is not None:
+      x0, x1, y0, y1 = region_of_interest
+      assert x0 < x1, "x0 < x1"
+      assert y0 < y1, "y0 < y1"
+      assert x0 >= 0, "x0 >= 0"
+      assert y0 >= 0, "y0 >= 0"
+      assert x1 <= width, "x1 <= width"
+      assert y1 <= height, "y1 <= height"
+      self.roi_mask = flex.bool(mask.accessor(), False)
+      self.roi_mask[y0:y1,x0:x1] = flex.bool(flex.grid(y1-y0, x1-x0), True)
+      mask = mask & self.roi_mask
+    else:
+      self.roi_mask = None
+
+    # Find the range of valid columns on each row
+    rows = []
+    for j in range(height):
+      selection = mask[j:j+1,0:width].as_1d().iselection()
+      if len(selection) > 0:
+        rows.append((selection[0], selection[-1] + 1))
+      else:
+        rows.append(None)
+
+    # Find the span to threshold for each band of rows
+    self.spans = []
+    num_pixels = 0
+    for b0 in range(0, height, band_size):
+      b1 = min(b0 + band_size, height)
+      if all(r is None for r in rows[b0:b1]):
+        continue
+      c0 = max(b0 - margin[0], 0)
+      c1 = min(b1 + margin[0], height)
+      columns = [r for r in rows[c0:c1] if r is not None]
+      x0 = min(r[0] for r in columns)
+      x1 = max(r[1] for r in columns)
+      self.spans.append((b0, b1, c0, c1, x0, x1))
+      num_pixels += (c1 - c0) * (x1 - x0)
+    self.fraction = num_pixels / (height * width)
+
+  def __call__(self, threshold_function, image, mask, panel=0):
+    '''
+    Threshold the spans of the panel
+
+    :param threshold_function: The function to threshold with
+    :param image: The panel image
+    :param mask: The panel mask
+    :param panel: The panel number
+    :return: The thresholded panel
+
+    '''
+    from dials.array_family import flex
+    if self.roi_mask is not None:
+      mask = mask & self.roi_mask
+    result = flex.bool(image.accessor(), False)
+    for b0, b1, c0, c1, x0, x1 in self.spans:
+      threshold_mask = threshold_function.compute_threshold(
+        image[c0:c1,x0:x1],
+        mask[c0:c1,x0:x1],
+        region=(panel, b0))
+      result[b0:b1,x0:x1] = threshold_mask[b0-c0:b1-c0,0:x1-x0]
+    return result
+
+
+def compute_threshold_spans(mask, threshold_function, region_of_interest=None):
+  '''
+  Find the spans to threshold for each panel from the static mask
+
+  :param mask: The static mask for each panel
+  :param threshold_function: The function to threshold with
+  :param region_of_interest: A region of interest to process
+  :return: The spans for each panel (or None to threshold the whole panel)
+
+  '''
+  if mask is None:
+    return None
+  margin = threshold_function.kernel_margin()
+  if margin is None:
+    return None
+  spans = []
+  for m in mask:
+    panel_spans = ThresholdSpans(m, margin, region_of_interest)
+    if panel_spans.fraction > 0.9:
+      panel_spans = None
+    spans.append(panel_spans)
+  if all(s is None for s in spans):
+    return None
+  return spans
+
+
+def extract_pixels(frame,
+                   image,
+                   mask,
+                   threshold_function,
+                   region_of_interest=None,
+                   max_strong_pixel_fraction=1.0,
+                   compute_mean_background=False,
+                   threshold_spans=None):
+  '''
+  Threshold each panel of an image and extract the strong pixels
+
+  :param frame: The frame number of the image
+  :param image: The tuple of panel images
+  :param mask: The tuple of panel masks
+  :param threshold_function: The function to threshold with
+  :param region_of_interest: A region of interest to process
+  :param max_strong_pixel_fraction: The maximum fraction of pixels allowed
+  :param compute_mean_background: Compute the mean background
+  :param threshold_spans: The spans to threshold on each panel
+  :return: The list of pixel lists, number of strong pixels and mean background
+
+  '''
+  from dials.model.data import PixelList
+  from dials.array_family import flex
+  from math import ceil
+
+  # Add the images to the pixel lists
+  pixel_list = []
+  num_strong = 0
+  average_background = 0
+  for panel, (im, mk) in enumerate(zip(image, mask)):
+    if threshold_spans is not None and threshold_spans[panel] is not None:
+      threshold_mask = threshold_spans[panel](
+        threshold_function, im, mk, panel)
+    elif region_of_interest is not None:
+      x0, x1, y0, y1 = region_of_interest
+      height, width = im.all()
+      assert x0 < x1, "x0 < x1"
+      assert y0 < y1, "y0 < y1"
+      assert x0 >= 0, "x0 >= 0"
+      assert y0 >= 0, "y0 >= 0"
+      assert x1 <= width, "x1 <= width"
+      assert y1 <= height, "y1 <= height"
+      im_roi = im[y0:y1,x0:x1]
+      mk_roi = mk[y0:y1,x0:x1]
+      tm_roi = threshold_function.compute_threshold(
+        im_roi, mk_roi, region=(panel, region_of_interest))
+      threshold_mask = flex.bool(im.accessor(),False)
+      threshold_mask[y0:y1,x0:x1] = tm_roi
+    else:
+      threshold_mask = threshold_function.compute_threshold(
+        im, mk, region=(panel, None))
+
+    # Add the pixel list
+    plist = PixelList(frame, im, threshold_mask)
+    pixel_list.append(plist)
+
+    # Get average background
+    if compute_mean_background:
+      background = im.as_1d().select((mk & ~threshold_mask).as_1d())
+      average_background += flex.mean(background)
+
+    # Add to the spot count
+    num_strong += len(plist)
+
+  # Make average background
+  average_background /= len(image)
+
+  # Check total number of strong pixels
+  if max_strong_pixel_fraction < 1:
+    num_image = 0
+    for im in image:
+      num_image += len(im)
+    max_strong = int(ceil(max_strong_pixel_fraction * num_image))
+    if num_strong > max_strong:
+      raise RuntimeError(
+        '''
+        The number of strong pixels found (%d) is greater than the
+        maximum allowed (%d). Try changing spot finding parameters
+      ''' % (num_strong, max_strong))
+
+  # Return the pixel lists
+  return pixel_list, num_strong, average_background
+
+
 class ExtractPixelsFromImage(object):
   '''
   A class to extract pixels from a single image
@@ -44,7 +251,8 @@ def __init__(self,
                mask,
                region_of_interest,
                max_strong_pixel_fraction,
-               compute_mean_background):
+               compute_mean_background,
+               threshold_spans=False):
     '''
     Initialise the class
 
@@ -53,6 +261,7 @@ def __init__(self,
     :param mask: The image mask
     :param region_of_interest: A region of interest to process
     :param max_strong_pixel_fraction: The maximum fraction of pixels allowed
+    :param threshold_spans: Only threshold the unmasked spans of each panel
 
     '''
     self.threshold_function = threshold_function
@@ -64,6 +273,18 @@ def __init__(self,
     if self.mask is not None:
       detector = self.imageset.get_detector()
       assert(len(self.mask) == len(detector))
+    self.threshold_spans = None
+    if threshold_spans:
+      self.threshold_spans = compute_threshold_spans(
+        self.mask,
+        self.threshold_function,
+        self.region_of_interest)
+      if self.threshold_spans is not None:
+        logger.info('Thresholding %.1f%% of the pixels on each image' % (
+          100.0 * sum(
+            (s.fraction if s is not None else 1) * m.size()
+            for s, m in zip(self.threshold_spans, self.mask)) /
+          sum(m.size() for m in self.mask)))
     self.first = True
 
   def __call__(self, index):
@@ -73,10 +294,7 @@ def __call__(self, index):
     :param index: The index of the image
 
     '''
-    from dials.model.data import PixelList
     from dxtbx.imageset import ImageSweep
-    from dials.array_family import flex
-    from math import ceil
 
     # Parallel reading of HDF5 from the same handle is not allowed. Python
     # multiprocessing is a bit messed up and used fork on linux so need to
@@ -95,9 +313,6 @@ def __call__(self, index):
         assert(all(i1+1 == i2 for i1, i2 in zip(ind[0:-1], ind[1:-1])))
       frame = ind[index]
 
-    # Create the list of pixel lists
-    pixel_list = []
-
     # Get the image and mask
     image = self.imageset.get_corrected_data(index)
     mask = self.imageset.get_mask(index)
@@ -110,54 +325,16 @@ def __call__(self, index):
     logger.debug("Number of masked pixels for image %i: %i" %
                  (index, sum(m.count(False) for m in mask)))
 
-    # Add the images to the pixel lists
-    num_strong = 0
-    average_background = 0
-    for im, mk in zip(image, mask):
-      if self.region_of_interest is not None:
-        x0, x1, y0, y1 = self.region_of_interest
-        height, width = im.all()
-        assert x0 < x1, "x0 < x1"
-        assert y0 < y1, "y0 < y1"
-        assert x0 >= 0, "x0 >= 0"
-        assert y0 >= 0, "y0 >= 0"
-        assert x1 <= width, "x1 <= width"
-        assert y1 <= height, "y1 <= height"
-        im_roi = im[y0:y1,x0:x1]
-        mk_roi = mk[y0:y1,x0:x1]
-        tm_roi = self.threshold_function.compute_threshold(im_roi, mk_roi)
-        threshold_mask = flex.bool(im.accessor(),False)
-        threshold_mask[y0:y1,x0:x1] = tm_roi
-      else:
-        threshold_mask = self.threshold_function.compute_threshold(im, mk)
-
-      # Add the pixel list
-      plist = PixelList(frame, im, threshold_mask)
-      pixel_list.append(plist)
-
-      # Get average background
-      if self.compute_mean_background:
-        background = im.as_1d().select((mk & ~threshold_mask).as_1d())
-        average_background += flex.mean(background)
-
-      # Add to the spot count
-      num_strong += len(plist)
-
-    # Make average background
-    average_background /= len(image)
-
-    # Check total number of strong pixels
-    if self.max_strong_pixel_fraction < 1:
-      num_image = 0
-      for im in image:
-        num_image += len(im)
-      max_strong = int(ceil(self.max_strong_pixel_fraction * num_image))
-      if num_strong > max_strong:
-        raise RuntimeError(
-          '''
-          The number of strong pixels found (%d) is greater than the
-          maximum allowed (%d). Try changing spot finding parameters
-        ''' % (num_strong, max_strong))
+    # Extract the strong pixels
+    pixel_list, num_strong, average_background = extract_pixels(
+      frame,
+      image,
+      mask,
+      self.threshold_function,
+      region_of_interest        = self.region_of_interest,
+      max_strong_pixel_fraction = self.max_strong_pixel_fraction,
+      compute_mean_background   = self.compute_mean_background,
+      threshold_spans           = self.threshold_spans)
 
     # Print some info
     if self.compute_mean_background:
@@ -187,7 +364,8 @@ def __init__(self,
                compute_mean_background,
                min_spot_size,
                max_spot_size,
-               filter_spots):
+               filter_spots,
+               threshold_spans=False):
     '''
     Initialise the class
 
@@ -204,7 +382,8 @@ def __init__(self,
       mask,
       region_of_interest,
       max_strong_pixel_fraction,
-      compute_mean_background)
+      compute_mean_background,
+      threshold_spans)
 
     # Save some stuff
     self.min_spot_size = min_spot_size
@@ -247,6 +426,87 @@ def __call__(self, index):
     return [reflections]
 
 
+class ExtractPixelsFromStreamImage(object):
+  '''
+  A class to extract pixels from an image received from a stream, where the
+  image has already been decoded and there is no imageset to read from
+
+  '''
+
+  def __init__(self,
+               threshold_function,
+               mask,
+               trusted_range,
+               region_of_interest,
+               max_strong_pixel_fraction,
+               min_spot_size,
+               max_spot_size):
+    '''
+    Initialise the class
+
+    :param threshold_function: The function to threshold with
+    :param mask: The static image mask
+    :param trusted_range: The trusted range of each panel
+    :param region_of_interest: A region of interest to process
+    :param max_strong_pixel_fraction: The maximum fraction of pixels allowed
+    :param min_spot_size: The minimum spot size for the spot count
+    :param max_spot_size: The maximum spot size for the spot count
+
+    '''
+    assert len(mask) == len(trusted_range)
+    self.threshold_function = threshold_function
+    self.mask = mask
+    self.trusted_range = trusted_range
+    self.region_of_interest = region_of_interest
+    self.max_strong_pixel_fraction = max_strong_pixel_fraction
+    self.min_spot_size = min_spot_size
+    self.max_spot_size = max_spot_size
+
+  def __call__(self, frame, image):
+    '''
+    Extract strong pixels from an image
+
+    :param frame: The frame number
+    :param image: The tuple of panel images
+    :return: The result and the number of spots found on the image in 2D
+
+    '''
+    from dials.model.data import PixelListLabeller
+    from collections import Counter
+    assert len(image) == len(self.mask)
+
+    # Mask the pixels outside the trusted range
+    mask = []
+    for im, mk, (low, high) in zip(image, self.mask, self.trusted_range):
+      imd = im.as_double()
+      mask.append(mk & (imd > low) & (imd < high))
+
+    # Extract the strong pixels
+    pixel_list, num_strong, _ = extract_pixels(
+      frame,
+      image,
+      mask,
+      self.threshold_function,
+      region_of_interest        = self.region_of_interest,
+      max_strong_pixel_fraction = self.max_strong_pixel_fraction)
+
+    # Count the spots on this image
+    num_spots = 0
+    for plist in pixel_list:
+      if len(plist) == 0:
+        continue
+      labeller = PixelListLabeller()
+      labeller.add(plist)
+      for size in Counter(labeller.labels_2d()).itervalues():
+        if self.min_spot_size <= size <= self.max_spot_size:
+          num_spots += 1
+    logger.info("Found %d strong pixels and %d spots on image %d" % (
+      num_strong, num_spots, frame+1))
+
+    # Return the result
+    return Result(pixel_list), num_spots
+
+
 class ExtractSpotsParallelTask(object):
   '''
   Execute the spot finder task in parallel
@@ -275,6 +535,235 @@ def __call__(self, task):
     return result, handlers[0].messages()
 
 
+class HotPixelAccumulator(object):
+  '''
+  Count the number of images on which each pixel is strong as the pixel lists
+  are extracted. A pixel which is strong on every image is flagged as a
+  possible hot pixel, without needing to label the pixels or keep the spots.
+
+  '''
+
+  def __init__(self):
+    '''
+    Initialise the counts
+
+    '''
+    self.counts = None
+    self.sizes = None
+    self.num_images = 0
+
+  def add(self, pixel_list):
+    '''
+    Add the pixel lists from an image
+
+    :param pixel_list: The list of pixel lists for each panel
+
+    '''
+    from dials.array_family import flex
+    if self.counts is None:
+      self.sizes = [p.size() for p in pixel_list]
+      self.counts = [flex.int(s[0] * s[1], 0) for s in self.sizes]
+    assert len(self.counts) == len(pixel_list), "Inconsistent size"
+    for counts, plist in zip(self.counts, pixel_list):
+      index = plist.index()
+      counts.set_selected(index, counts.select(index) + 1)
+    self.num_images += 1
+
+  def hot_pixels(self):
+    '''
+    :return: The indices of the hot pixels on each panel
+
+    '''
+    if self.counts is None:
+      return None
+    return tuple((c == self.num_images).iselection() for c in self.counts)
+
+  def hot_mask(self):
+    '''
+    :return: The hot pixel mask for each panel (False for hot pixels)
+
+    '''
+    from dials.array_family import flex
+    if self.counts is None:
+      return None
+    mask = []
+    for counts, size in zip(self.counts, self.sizes):
+      m = counts != self.num_images
+      m.reshape(flex.grid(size))
+      mask.append(m)
+    return tuple(mask)
+
+
+class ExtractAndLabelPixelsFromBlock(object):
+  '''
+  Extract the strong pixels from a contiguous block of images and label them
+  in 3D (or 2D) so that the connected components do not need to be found
+  serially in the parent process.
+
+  '''
+
+  def __init__(self, function, twod):
+    '''
+    Initialise with the function to extract pixels from each image
+
+    :param function: The function to extract pixels from an image
+    :param twod: Label in 2D rather than 3D
+
+    '''
+    self.function = function
+    self.twod = twod
+
+  def __call__(self, block):
+    '''
+    Extract and label the pixels
+
+    :param block: The range of image indices
+    :return: The pixel lists for each image and the labels for each panel
+
+    '''
+    from dials.model.data import PixelListLabeller
+    pixel_labeller = None
+    pixel_lists = []
+    for index in range(*block):
+      result = self.function(index)
+      if pixel_labeller is None:
+        pixel_labeller = [PixelListLabeller() for p in result.pixel_list]
+      assert len(pixel_labeller) == len(result.pixel_list), "Inconsistent size"
+      for plabeller, plist in zip(pixel_labeller, result.pixel_list):
+        plabeller.add(plist)
+      pixel_lists.append(result.pixel_list)
+    if self.twod:
+      labels = [p.labels_2d() for p in pixel_labeller]
+    else:
+      labels = [p.labels_3d() for p in pixel_labeller]
+    return Result(pixel_lists), labels
+
+
+class SharedMemoryPixelListTransport(object):
+  '''
+  Return pixel lists from the worker processes through a ring of slots in a
+  shared memory buffer, rather than pickling them through the result pipe.
+
+  The buffer and the queue of free slots are created before the worker
+  processes are forked. A worker takes a free slot, writes the pixel values
+  and indices into it and returns a small description of the pixel lists.
+  The parent copies the pixel lists out of the slot and puts the slot back
+  on the queue. Pixel lists too large for a slot are pickled as usual.
+
+  '''
+
+  def __init__(self, num_slots, slot_size):
+    '''
+    Create the shared memory buffer
+
+    :param num_slots: The number of slots
+    :param slot_size: The size of each slot in bytes
+
+    '''
+    from multiprocessing import Queue
+    import mmap
+    self.num_slots = num_slots
+    self.slot_size = slot_size
+    self.buffer = mmap.mmap(-1, num_slots * slot_size)
+    self.free = Queue()
+    for slot in range(num_slots):
+      self.free.put(slot)
+    self.num_bytes = 0
+    self.num_pickled = 0
+    self.read_time = 0
+
+  def write(self, pixel_list):
+    '''
+    Write the pixel lists to a free slot (in the worker process)
+
+    :param pixel_list: The list of pixel lists for each panel
+    :return: A description of the pixel lists to read them back
+
+    '''
+    data = []
+    for plist in pixel_list:
+      data.append(plist.value().copy_to_byte_str())
+      data.append(plist.index().copy_to_byte_str())
+    if sum(len(d) for d in data) > self.slot_size:
+      return None, pixel_list
+    slot = self.free.get()
+    offset = slot * self.slot_size
+    for d in data:
+      self.buffer[offset:offset+len(d)] = d
+      offset += len(d)
+    info = [(plist.frame(), plist.size(), len(plist)) for plist in pixel_list]
+    return slot, info
+
+  def read(self, result):
+    '''
+    Read the pixel lists back from the slot and free it (in the parent)
+
+    :param result: The description returned by write
+    :return: The list of pixel lists for each panel
+
+    '''
+    from dials.model.data import PixelList
+    from dials.array_family import flex
+    from time import time
+    slot, info = result
+    if slot is None:
+      self.num_pickled += 1
+      return info
+    st = time()
+    start = offset = slot * self.slot_size
+    pixel_list = []
+    for frame, size, n in info:
+      value = flex.double_from_byte_str(self.buffer[offset:offset+8*n])
+      offset += 8*n
+      index = flex.size_t_from_byte_str(self.buffer[offset:offset+8*n])
+      offset += 8*n
+      pixel_list.append(PixelList(frame, size, value, index))
+    self.free.put(slot)
+    self.num_bytes += offset - start
+    self.read_time += time() - st
+    return pixel_list
+
+  def report(self):
+    '''
+    Log the memory used and the time taken to read the pixel lists
+
+    '''
+    mb = 1024.0 * 1024.0
+    logger.info('')
+    logger.info('Shared memory transport:')
+    logger.info(' Used %d slots of %.1f MB (%.1f MB in total)' % (
+      self.num_slots, self.slot_size / mb, self.num_slots * self.slot_size / mb))
+    logger.info(' Transferred %.1f MB of pixel lists' % (self.num_bytes / mb))
+    logger.info(' Read pixel lists from shared memory in %.2f seconds' %
+                self.read_time)
+    if self.num_pickled > 0:
+      logger.info(' Pickled %d images too large for a slot' % self.num_pickled)
+
+
+# The spot finding function and transport used by each worker process with the
+# shared memory transport. These are inherited by the worker processes when
+# they are created and kept for their lifetime, so the format instance opened
+# by the function is kept open between images.
+_shared_memory_worker = None
+
+def _init_shared_memory_worker(function, transport):
+  '''
+  Initialise the worker process
+
+  '''
+  global _shared_memory_worker
+  _shared_memory_worker = (ExtractSpotsParallelTask(function), transport)
+
+def _extract_pixels_with_shared_memory(index):
+  '''
+  Extract the pixels in the worker process and write them to shared memory
+
+  '''
+  task, transport = _shared_memory_worker
+  result, messages = task(index)
+  return index, transport.write(result.pixel_list), messages
+
+
 class PixelListToShoeboxes(object):
   '''
   A helper class to convert pixel list to shoeboxes
@@ -289,10 +778,14 @@ def __init__(self, min_spot_size, max_spot_size, write_hot_pixel_mask):
     self.max_spot_size = max_spot_size
     self.write_hot_pixel_mask = write_hot_pixel_mask
 
-  def __call__(self, imageset, pixel_labeller):
+  def __call__(self, imageset, pixel_labeller, labels=None):
     '''
     Convert the pixel list to shoeboxes
 
+    :param imageset: The imageset
+    :param pixel_labeller: The pixel labeller for each panel
+    :param labels: Optional precomputed labels for each panel
+
     '''
     from dxtbx.imageset import ImageSweep
     from dials.array_family import flex
@@ -307,14 +800,24 @@ def __call__(self, imageset, pixel_labeller):
       twod = True
     for i, (p, hp) in enumerate(zip(pixel_labeller, hotpixels)):
       if p.num_pixels() > 0:
-        creator = flex.PixelListShoeboxCreator(
-            p,
-            i,                   # panel
-            0,                   # zrange
-            twod,                # twod
-            self.min_spot_size,  # min_pixels
-            self.max_spot_size,  # max_pixels
-            self.write_hot_pixel_mask)
+        if labels is not None:
+          creator = flex.PixelListShoeboxCreator(
+              p,
+              labels[i],           # labels
+              i,                   # panel
+              0,                   # zrange
+              self.min_spot_size,  # min_pixels
+              self.max_spot_size,  # max_pixels
+              self.write_hot_pixel_mask)
+        else:
+          creator = flex.PixelListShoeboxCreator(
+              p,
+              i,                   # panel
+              0,                   # zrange
+              twod,                # twod
+              self.min_spot_size,  # min_pixels
+              self.max_spot_size,  # max_pixels
+              self.write_hot_pixel_mask)
         shoeboxes.extend(creator.result())
         spotsizes.extend(creator.spot_size())
         hp.extend(creator.hot_pixels())
@@ -403,13 +906,13 @@ def __init__(self, min_spot_size, max_spot_size, filter_spots, write_hot_pixel_m
     self.shoeboxes_to_reflection_table = ShoeboxesToReflectionTable(
       filter_spots)
 
-  def __call__(self, imageset, pixel_labeller):
+  def __call__(self, imageset, pixel_labeller, labels=None):
     '''
     Convert to reflection table
 
     '''
     shoeboxes, hot_pixels = self.pixel_list_to_shoeboxes(
-      imageset, pixel_labeller)
+      imageset, pixel_labeller, labels)
 
     return self.shoeboxes_to_reflection_table(imageset, shoeboxes), hot_pixels
 
@@ -435,7 +938,11 @@ def __init__(self,
                filter_spots=None,
                no_shoeboxes_2d=False,
                min_chunksize=50,
-               write_hot_pixel_mask=False):
+               write_hot_pixel_mask=False,
+               mp_transport='pickle',
+               mp_slot_size=64,
+               mp_chunked_labelling=False,
+               threshold_spans=False):
     '''
     Initialise the class with the strategy
 
@@ -444,6 +951,10 @@ def __init__(self,
     :param mp_method: The multi processing method
     :param nproc: The number of processors
     :param max_strong_pixel_fraction: The maximum number of strong pixels
+    :param mp_transport: How to return pixel lists (pickle or shared_memory)
+    :param mp_slot_size: The shared memory slot size in MB
+    :param mp_chunked_labelling: Label blocks of images in each process
+    :param threshold_spans: Only threshold the unmasked spans of each panel
 
     '''
     # Set the required strategies
@@ -462,6 +973,10 @@ def __init__(self,
     self.no_shoeboxes_2d = no_shoeboxes_2d
     self.min_chunksize = min_chunksize
     self.write_hot_pixel_mask = write_hot_pixel_mask
+    self.mp_transport = mp_transport
+    self.mp_slot_size = mp_slot_size
+    self.mp_chunked_labelling = mp_chunked_labelling
+    self.threshold_spans = threshold_spans
 
   def __call__(self, imageset):
     '''
@@ -551,14 +1066,25 @@ def _find_spots(self, imageset):
         mask                      = self.mask,
         max_strong_pixel_fraction = self.max_strong_pixel_fraction,
         compute_mean_background   = self.compute_mean_background,
-        region_of_interest        = self.region_of_interest)
+        region_of_interest        = self.region_of_interest,
+        threshold_spans           = self.threshold_spans)
 
     # The indices to iterate over
     indices = list(range(len(imageset)))
 
-    # Initialise the pixel labeller
+    # Initialise the pixel labeller and the hot pixel counts
     num_panels = len(imageset.get_detector())
     pixel_labeller = [PixelListLabeller() for p in range(num_panels)]
+    if self.write_hot_pixel_mask:
+      hot_pixels = HotPixelAccumulator()
+    else:
+      hot_pixels = None
+    def add_pixel_list(pixel_list):
+      assert len(pixel_labeller) == len(pixel_list), "Inconsistent size"
+      for plabeller, plist in zip(pixel_labeller, pixel_list):
+        plabeller.add(plist)
+      if hot_pixels is not None:
+        hot_pixels.add(pixel_list)
 
     # Do the processing
     logger.info('Extracting strong pixels from images')
@@ -566,13 +1092,21 @@ def _find_spots(self, imageset):
       logger.info(' Using %s with %d parallel job(s) and %d processes per node\n' % (mp_method, mp_njobs, mp_nproc))
     else:
       logger.info(' Using multiprocessing with %d parallel job(s)\n' % (mp_nproc))
-    if mp_nproc > 1 or mp_njobs > 1:
+    labels = None
+    if (mp_nproc > 1 or mp_njobs > 1) and self.mp_chunked_labelling:
+      labels = self._extract_and_label_chunked(
+        imageset, function, indices, mp_nproc, mp_njobs, mp_method,
+        pixel_labeller, add_pixel_list)
+    elif mp_nproc > 1 and mp_njobs == 1 and self.mp_transport == 'shared_memory':
+      self._extract_pixels_with_shared_memory(
+        function, indices, mp_nproc, add_pixel_list)
+    elif mp_nproc > 1 or mp_njobs > 1:
+      if self.mp_transport == 'shared_memory':
+        logger.warn("Shared memory transport is not available with njobs > 1")
       def process_output(result):
         for message in result[1]:
           logger.log(message.levelno, message.msg)
-        assert len(pixel_labeller) == len(result[0].pixel_list), "Inconsistent size"
-        for plabeller, plist in zip(pixel_labeller, result[0].pixel_list):
-          plabeller.add(plist)
+        add_pixel_list(result[0].pixel_list)
         result[0].pixel_list = None
       batch_multi_node_parallel_map(
         func           = ExtractSpotsParallelTask(function),
@@ -585,18 +1119,140 @@ def process_output(result):
     else:
       for task in indices:
         result = function(task)
-        assert len(pixel_labeller) == len(result.pixel_list), "Inconsistent size"
-        for plabeller, plist in zip(pixel_labeller, result.pixel_list):
-          plabeller.add(plist)
-          result.pixel_list = None
+        add_pixel_list(result.pixel_list)
+        result.pixel_list = None
 
-    # Create shoeboxes from pixel list
+    # Create shoeboxes from pixel list. The hot pixels have already been
+    # counted so don't need to be found from the labelled pixels
     converter = PixelListToReflectionTable(
       self.min_spot_size,
       self.max_spot_size,
       self.filter_spots,
-      self.write_hot_pixel_mask)
-    return converter(imageset, pixel_labeller)
+      False)
+    reflections, _ = converter(imageset, pixel_labeller, labels)
+    if hot_pixels is not None:
+      return reflections, hot_pixels.hot_pixels()
+    return reflections, None
+
+  def _extract_and_label_chunked(self,
+                                 imageset,
+                                 function,
+                                 indices,
+                                 nproc,
+                                 njobs,
+                                 method,
+                                 pixel_labeller,
+                                 add_pixel_list):
+    '''
+    Extract the pixels, with each process extracting and labelling the pixels
+    on a contiguous block of images. The parent process only merges the
+    components that touch at the block boundaries.
+
+    :return: The labels for each panel
+
+    '''
+    from dials.array_family import flex
+    from dials.model.data import merge_labels_3d
+    from dials.util.mp import batch_multi_node_parallel_map
+    from dxtbx.imageset import ImageSweep
+    from time import time
+
+    # Split the images into one contiguous block per process
+    num_blocks = min(nproc * njobs, len(indices))
+    boundaries = [int(round(i * len(indices) / num_blocks))
+                  for i in range(num_blocks + 1)]
+    blocks = list(zip(boundaries[:-1], boundaries[1:]))
+    logger.info(' Labelling %d blocks of images in parallel\n' % len(blocks))
+
+    # Collect the pixel lists and block labels in order
+    twod = not isinstance(imageset, ImageSweep)
+    block_labels = [[] for p in pixel_labeller]
+    def process_output(result):
+      for message in result[1]:
+        logger.log(message.levelno, message.msg)
+      pixel_lists, labels = result[0]
+      for pixel_list in pixel_lists.pixel_list:
+        add_pixel_list(pixel_list)
+      for blabels, l in zip(block_labels, labels):
+        blabels.append(l)
+      pixel_lists.pixel_list = None
+    batch_multi_node_parallel_map(
+      func           = ExtractSpotsParallelTask(
+        ExtractAndLabelPixelsFromBlock(function, twod)),
+      iterable       = blocks,
+      nproc          = nproc,
+      njobs          = njobs,
+      cluster_method = method,
+      chunksize      = 1,
+      callback       = process_output)
+
+    # Merge the labels at the block boundaries. In 2D the labels of each
+    # block only need to be made unique
+    st = time()
+    block_start = flex.int()
+    if not twod:
+      first_frame = pixel_labeller[0].first_frame()
+      block_start = flex.int(first_frame + b for b, e in blocks[1:])
+    labels = []
+    for plabeller, blabels in zip(pixel_labeller, block_labels):
+      concatenated = flex.int()
+      offset = 0
+      for l in blabels:
+        if twod and len(l) > 0:
+          concatenated.extend(l + offset)
+          offset += flex.max(l) + 1
+        else:
+          concatenated.extend(l)
+      if not twod:
+        concatenated = merge_labels_3d(plabeller, concatenated, block_start)
+      labels.append(concatenated)
+    logger.info('')
+    logger.info('Merged block labels in %.2f seconds' % (time() - st))
+    return labels
+
+  def _extract_pixels_with_shared_memory(self,
+                                         function,
+                                         indices,
+                                         nproc,
+                                         add_pixel_list):
+    '''
+    Extract the pixels in a pool of worker processes, returning the pixel lists
+    through shared memory. The results are received in the order they
+    complete and added to the pixel labellers in frame order.
+
+    The images are sent to the workers one at a time rather than in chunks. A
+    worker holds a slot until the parent has read its result, and the pool
+    only returns results once a whole chunk is done, so with chunks the
+    workers would fill all the slots part way through a chunk and wait for
+    each other forever.
+
+    '''
+    from multiprocessing import Pool
+    transport = SharedMemoryPixelListTransport(
+      num_slots = 2 * nproc,
+      slot_size = self.mp_slot_size * 1024 * 1024)
+    pool = Pool(
+      processes   = nproc,
+      initializer = _init_shared_memory_worker,
+      initargs    = (function, transport))
+    pending = {}
+    next_index = 0
+    try:
+      for index, result, messages in pool.imap_unordered(
+          _extract_pixels_with_shared_memory, indices, 1):
+        for message in messages:
+          logger.log(message.levelno, message.msg)
+        pending[index] = transport.read(result)
+        while indices[next_index] in pending:
+          add_pixel_list(pending.pop(indices[next_index]))
+          next_index += 1
+          if next_index == len(indices):
+            break
+    finally:
+      pool.close()
+      pool.join()
+    assert len(pending) == 0
+    transport.report()
 
   def _find_spots_2d_no_shoeboxes(self, imageset):
     '''
@@ -657,7 +1313,8 @@ def _find_spots_2d_no_shoeboxes(self, imageset):
         region_of_interest        = self.region_of_interest,
         min_spot_size             = self.min_spot_size,
         max_spot_size             = self.max_spot_size,
-        filter_spots              = self.filter_spots)
+        filter_spots              = self.filter_spots,
+        threshold_spans           = self.threshold_spans)
 
     # The indices to iterate over
     indices = list(range(len(imageset)))
@@ -717,7 +1374,11 @@ def __init__(self,
                min_spot_size=1,
                max_spot_size=20,
                no_shoeboxes_2d=False,
-               min_chunksize=50):
+               min_chunksize=50,
+               mp_transport='pickle',
+               mp_slot_size=64,
+               mp_chunked_labelling=False,
+               threshold_spans=False):
     '''
     Initialise the class.
 
@@ -746,6 +1407,10 @@ def __init__(self,
     self.mp_njobs = mp_njobs
     self.no_shoeboxes_2d = no_shoeboxes_2d
     self.min_chunksize = min_chunksize
+    self.mp_transport = mp_transport
+    self.mp_slot_size = mp_slot_size
+    self.mp_chunked_labelling = mp_chunked_labelling
+    self.threshold_spans = threshold_spans
 
   def __call__(self, datablock):
     '''
@@ -830,7 +1495,11 @@ def _find_spots_in_imageset(self, imageset):
       filter_spots              = self.filter_spots,
       no_shoeboxes_2d           = self.no_shoeboxes_2d,
       min_chunksize             = self.min_chunksize,
-      write_hot_pixel_mask      = self.write_hot_mask)
+      write_hot_pixel_mask      = self.write_hot_mask,
+      mp_transport              = self.mp_transport,
+      mp_slot_size              = self.mp_slot_size,
+      mp_chunked_labelling      = self.mp_chunked_labelling,
+      threshold_spans           = self.threshold_spans)
 
     # Get the max scan range
     if isinstance(imageset, ImageSweep):
@@ -881,11 +1550,9 @@ def _create_hot_mask(self, imageset, hot_pixels):
       hot_mask = tuple(flex.bool(flex.grid(p.get_image_size()[::-1]), True)
                        for p in imageset.get_detector())
       num_hot = 0
-      if hot_pixels > 0:
-        for hp, hm in zip(hot_pixels, hot_mask):
-          for i in range(len(hp)):
-            hm[hp[i]] = False
-          num_hot += len(hp)
+      for hp, hm in zip(hot_pixels, hot_mask):
+        hm.set_selected(hp, False)
+        num_hot += len(hp)
       logger.info('Found %d possible hot pixel(s)' % num_hot)
 
     else:
@@ -702,7 +702,35 @@ def stats_single_image(imageset, reflections, i=None, resolution_analysis=True,
                     d_min_distl_method_2=d_min_distl_method_2,
                     noisiness_method_2=noisiness_method_2)
 
-def stats_imageset(imageset, reflections, resolution_analysis=True, plot=False):
+class StatsSingleImage(object):
+  '''
+  Compute the statistics for a single image of an imageset, given the
+  reflections grouped by image. This is a class so that the imageset and
+  reflections are shared with the processes of the pool rather than pickled
+  for each image.
+
+  '''
+
+  def __init__(self, imageset, reflections, offsets, start,
+               resolution_analysis=True, plot=False):
+    self.imageset = imageset
+    self.reflections = reflections
+    self.offsets = offsets
+    self.start = start
+    self.resolution_analysis = resolution_analysis
+    self.plot = plot
+
+  def __call__(self, i):
+    first, last = self.offsets[i], self.offsets[i+1]
+    return stats_single_image(
+      self.imageset[i:i+1],
+      self.reflections[first:last], i=i+self.start,
+      resolution_analysis=self.resolution_analysis, plot=self.plot)
+
+
+def stats_imageset(imageset, reflections, resolution_analysis=True, plot=False,
+                   nproc=1):
+  from bisect import bisect_left
   n_spots_total = []
   n_spots_no_ice = []
   n_spots_4A = []
@@ -713,18 +741,38 @@ def stats_imageset(imageset, reflections, resolution_analysis=True, plot=False):
   noisiness_method_1 = []
   noisiness_method_2 = []
 
-  image_number = reflections['xyzobs.px.value'].parts()[2]
-  image_number = flex.floor(image_number)
-
   try:
     start, end = imageset.get_array_range()
   except AttributeError:
     start = 0
-  for i in range(len(imageset)):
-    stats = stats_single_image(
-      imageset[i:i+1],
-      reflections.select(image_number==i+start), i=i+start,
-      resolution_analysis=resolution_analysis, plot=plot)
+
+  # Sort the reflections by image number and find the range of reflections
+  # on each image, so each image is selected in a single pass
+  image_number = reflections['xyzobs.px.value'].parts()[2]
+  image_number = flex.floor(image_number)
+  perm = flex.sort_permutation(image_number)
+  reflections = reflections.select(perm)
+  image_number = image_number.select(perm)
+  offsets = [bisect_left(image_number, i+start)
+             for i in range(len(imageset)+1)]
+
+  compute_stats = StatsSingleImage(
+    imageset, reflections, offsets, start,
+    resolution_analysis=resolution_analysis, plot=plot)
+  if nproc > 1 and resolution_analysis and not plot:
+    from libtbx import easy_mp
+    results = easy_mp.parallel_map(
+      func=compute_stats,
+      iterable=list(range(len(imageset))),
+      processes=nproc,
+      method="multiprocessing",
+      preserve_order=True,
+      asynchronous=True,
+      preserve_exception_message=True)
+  else:
+    results = (compute_stats(i) for i in range(len(imageset)))
+
+  for stats in results:
     n_spots_total.append(stats.n_spots_total)
     n_spots_no_ice.append(stats.n_spots_no_ice)
     n_spots_4A.append(stats.n_spots_4A)
@@ -96,19 +96,31 @@ def __init__(self, **kwargs):
     self._n_sigma_s   = kwargs.get('n_sigma_s', 3)
     self._min_count   = kwargs.get('min_count', 2)
     self._threshold   = kwargs.get('global_threshold', 0)
+    self._static_mask = kwargs.get('static_mask', False)
+    self._use_float   = kwargs.get('use_float', False)
 
-    # Save the constant gain
-    self._gain_map = None
+    # Save the constant gain maps for each image size
+    self._gain_map = {}
 
-    # Create a buffer
+    # The algorithms for each region and image size
     self.algorithm = {}
 
-  def __call__(self, image, mask):
+    # The output buffers for each image size
+    self._result = {}
+
+  def __call__(self, image, mask, region=None):
     '''
     Call the thresholding function
 
+    With the static mask algorithm, the output buffer is reused so the
+    result is only valid until the next call with an image of the same size.
+    The static mask terms are kept for each region, so parts of the images
+    with the same size but different masks (e.g. the panels of a detector or
+    the spans of a panel) each keep their own.
+
     :param image: The image to process
     :param mask: The mask to use
+    :param region: A key identifying the part of the image
     :return: The thresholded image
 
     '''
@@ -116,28 +128,50 @@ def __call__(self, image, mask):
     from dials.array_family import flex
 
     # Initialise the algorithm
+    key = (region, image.all())
     try:
-      algorithm = self.algorithm[image.all()]
+      algorithm = self.algorithm[key]
     except Exception:
-      algorithm = threshold.DispersionThreshold(
-        image.all(),
-        self._kernel_size,
-        self._n_sigma_b,
-        self._n_sigma_s,
-        self._threshold,
-        self._min_count)
-      self.algorithm[image.all()] = algorithm
+      if self._static_mask or self._use_float:
+        algorithm = threshold.DispersionThresholdStaticMask(
+          image.all(),
+          self._kernel_size,
+          self._n_sigma_b,
+          self._n_sigma_s,
+          self._threshold,
+          self._min_count,
+          self._use_float)
+      else:
+        algorithm = threshold.DispersionThreshold(
+          image.all(),
+          self._kernel_size,
+          self._n_sigma_b,
+          self._n_sigma_s,
+          self._threshold,
+          self._min_count)
+      self.algorithm[key] = algorithm
 
     # Set the gain
+    gain_map = None
     if self._gain is not None:
       assert(self._gain > 0)
-      self._gain_map = flex.double(image.accessor(), self._gain)
-      self._gain = None
+      try:
+        gain_map = self._gain_map[image.all()]
+      except KeyError:
+        gain_map = flex.double(image.accessor(), self._gain)
+        self._gain_map[image.all()] = gain_map
 
     # Compute the threshold
-    result = flex.bool(flex.grid(image.all()))
-    if self._gain_map:
-      algorithm(image, mask, self._gain_map, result)
+    if self._static_mask or self._use_float:
+      try:
+        result = self._result[image.all()]
+      except KeyError:
+        result = flex.bool(flex.grid(image.all()))
+        self._result[image.all()] = result
+    else:
+      result = flex.bool(flex.grid(image.all()))
+    if gain_map is not None:
+      algorithm(image, mask, gain_map, result)
     else:
       algorithm(image, mask, result)
 
@@ -86,20 +86,64 @@ namespace dials { namespace af { namespace boost_python {
         std::size_t min_pixels,
         std::size_t max_pixels,
         bool find_hot_pixels) {
+      af::shared<int> labels = twod ? pixel.labels_2d() : pixel.labels_3d();
+      construct(pixel, labels.const_ref(), panel, zstart,
+                min_pixels, max_pixels, find_hot_pixels);
+    }
+
+    /**
+     * Construct the shoeboxes using labels computed elsewhere (e.g. by
+     * merging the labels computed on blocks of frames)
+     */
+    PixelListShoeboxCreator(
+        const PixelListLabeller &pixel,
+        const af::const_ref<int> &labels,
+        std::size_t panel,
+        std::size_t zstart,
+        std::size_t min_pixels,
+        std::size_t max_pixels,
+        bool find_hot_pixels) {
+      construct(pixel, labels, panel, zstart,
+                min_pixels, max_pixels, find_hot_pixels);
+    }
+
+    af::shared< Shoebox<FloatType> > result() const {
+      DIALS_ASSERT(result_.size() == spot_size_.size());
+      return result_;
+    }
+
+    af::shared<std::size_t> spot_size() const {
+      DIALS_ASSERT(result_.size() == spot_size_.size());
+      return spot_size_;
+    }
+
+    af::shared<std::size_t> hot_pixels() const {
+      return hot_pixels_;
+    }
+
+  private:
+
+    void construct(
+        const PixelListLabeller &pixel,
+        const af::const_ref<int> &labels,
+        std::size_t panel,
+        std::size_t zstart,
+        std::size_t min_pixels,
+        std::size_t max_pixels,
+        bool find_hot_pixels) {
 
       // Check the input
       DIALS_ASSERT(min_pixels > 0);
       DIALS_ASSERT(max_pixels > min_pixels);
 
       // Get the stuff from the label struct
-      af::shared<int> labels = twod ? pixel.labels_2d() : pixel.labels_3d();
       af::shared<double> values = pixel.values();
       af::shared< vec3<int> > coords = pixel.coords();
       DIALS_ASSERT(labels.size() == values.size());
       DIALS_ASSERT(labels.size() == coords.size());
 
       // Get the number of labels and allocate the array
-      std::size_t num = af::max(labels.const_ref()) + 1;
+      std::size_t num = af::max(labels) + 1;
       result_ = af::shared< Shoebox<FloatType> >(num, Shoebox<FloatType>());
       spot_size_ = af::shared<std::size_t>(num, 0);
 
@@ -191,22 +235,6 @@ namespace dials { namespace af { namespace boost_python {
       }
     }
 
-    af::shared< Shoebox<FloatType> > result() const {
-      DIALS_ASSERT(result_.size() == spot_size_.size());
-      return result_;
-    }
-
-    af::shared<std::size_t> spot_size() const {
-      DIALS_ASSERT(result_.size() == spot_size_.size());
-      return spot_size_;
-    }
-
-    af::shared<std::size_t> hot_pixels() const {
-      return hot_pixels_;
-    }
-
-  private:
-
     af::shared< Shoebox<FloatType> > result_;
     af::shared< std::size_t > spot_size_;
     af::shared< std::size_t > hot_pixels_;
@@ -1121,6 +1149,20 @@ namespace dials { namespace af { namespace boost_python {
             boost::python::arg("min_pixels") = 1,
             boost::python::arg("max_pixels") = 20,
             boost::python::arg("find_hot_pixels") = false)))
+      .def(init<const PixelListLabeller&,
+                const af::const_ref<int>&,
+                std::size_t,
+                std::size_t,
+                std::size_t,
+                std::size_t,
+                bool>((
+            boost::python::arg("pixel"),
+            boost::python::arg("labels"),
+            boost::python::arg("panel") = 0,
+            boost::python::arg("zstart") = 0,
+            boost::python::arg("min_pixels") = 1,
+            boost::python::arg("max_pixels") = 20,
+            boost::python::arg("find_hot_pixels") = false)))
       .def("result", &PixelListShoeboxCreator<ProfileFloatType>::result)
       .def("spot_size", &PixelListShoeboxCreator<ProfileFloatType>::spot_size)
       .def("hot_pixels", &PixelListShoeboxCreator<ProfileFloatType>::hot_pixels)
@@ -103,25 +103,18 @@ def hot_pixel_mask(imageset, reflections):
 
   from dials.array_family import flex
 
-  mask = flex.bool(flex.grid(reversed(imageset.get_detector()[0].get_image_size())), True)
-
-  for x, y in xylist:
-    mask[y, x] = False
+  width, height = imageset.get_detector()[0].get_image_size()
+  mask = flex.bool(flex.grid(height, width), True)
+  mask.set_selected(flex.size_t([y * width + x for x, y in xylist]), False)
 
   print 'Found %d hot pixels' % len(xylist)
 
   return (mask,)
 
 def filter_reflections(reflections, depth):
-  xylist = []
-
-  for i in range(len(reflections)):
-    refl = reflections[i]
-    s = refl['shoebox']
-    if s.zsize() == depth:
-      xylist.append((s.xoffset(), s.yoffset()))
-
-  return xylist
+  x0, x1, y0, y1, z0, z1 = reflections['bbox'].parts()
+  selection = (z1 - z0) == depth
+  return list(zip(x0.select(selection), y0.select(selection)))
 
 if __name__ == '__main__':
   import sys
@@ -10,11 +10,6 @@ def work(host, port, filename, params):
   conn.request('GET', path)
   return conn.getresponse().read()
 
-def _nproc():
-  from libtbx.introspection import number_of_processors
-  return number_of_processors(return_value_if_unknown=-1)
-
-
 def response_to_xml(d):
 
   if 'n_spots_total' in d:
@@ -50,22 +45,33 @@ def response_to_xml(d):
 
   return '<response>\n%s\n</response>' %response
 
+def work_batch(host, port, filenames, params):
+  '''
+  Send the images in a single request to the batch endpoint of the server
+  and yield the results as each image completes
+
+  '''
+  import json
+  import urllib2
+  request = urllib2.Request(
+    'http://%s:%s/batch' % (host, port),
+    data=json.dumps({'filenames': filenames, 'params': params}),
+    headers={'Content-type': 'application/json'})
+  response = urllib2.urlopen(request)
+  while True:
+    line = response.readline()
+    if not line:
+      break
+    yield json.loads(line)
+
 def work_all(host, port, filenames, params, plot=False, table=False,
-             json_file=None, grid=None, nproc=None):
+             json_file=None, grid=None):
   import json
-  from multiprocessing.pool import ThreadPool as thread_pool
-  if nproc is None:
-    nproc=_nproc()
-  pool = thread_pool(processes=nproc)
-  threads = { }
-  for filename in filenames:
-    threads[filename] = pool.apply_async(work, (host, port, filename, params))
-  results = []
-  for filename in filenames:
-    response = threads[filename].get()
-    d = json.loads(response)
-    results.append(d)
+  results = {}
+  for d in work_batch(host, port, filenames, params):
+    results[d['image']] = d
     print response_to_xml(d)
+  results = [results[filename] for filename in filenames]
 
   if json_file is not None:
     'Writing results to %s' %json_file
@@ -184,10 +190,7 @@ def stop(host, port, nproc):
   params = params.extract()
 
   if params.nproc is libtbx.Auto:
-    nproc = None
     params.nproc = 1024
-  else:
-    nproc = params.nproc
 
   if len(unhandled) and unhandled[0] == 'stop':
     stopped = stop(params.host, params.port, params.nproc)
@@ -210,4 +213,4 @@ def stop(host, port, nproc):
     else:
       work_all(params.host, params.port, filenames, unhandled, plot=params.plot,
                table=params.table, json_file=params.json,
-               grid=params.grid, nproc=nproc)
+               grid=params.grid)
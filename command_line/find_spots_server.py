@@ -1,8 +1,8 @@
 from __future__ import absolute_import, division
 import time
 import BaseHTTPServer as server_base
-from multiprocessing import Process
-from multiprocessing import current_process
+import SocketServer
+from multiprocessing import Pool
 import os
 import sys
 
@@ -53,6 +53,19 @@
 
   dials.find_spots_client /path/to/image.cbf min_spot_size=2 d_min=2
 
+Each server process keeps the parameters, image format classes, masks and
+threshold algorithms from previous requests, so that for a series of images
+from the same detector each request only pays for reading and processing the
+image. Set cache.enable=False on the server to disable this.
+
+Multiple images may be sent in a single request to the batch endpoint by
+POSTing a JSON object to http://hostname:port/batch, containing either a list
+of "filenames" or a "template" (e.g. /path/to/image_#####.cbf) and inclusive
+"image_range", and optionally a list of "params". The results are streamed
+back as newline-delimited JSON, one line per image as each image completes,
+including the time taken by each stage of the processing. This is used by
+``dials.find_spots_client`` when given more than one image.
+
 To stop the server::
 
   dials.find_spots_client stop [host=hostname] [port=1234]
@@ -60,12 +73,11 @@
 '''
 
 stop = False
+worker_pool = None
+worker_cache = None
 
-def work(filename, cl=None):
-  if cl is None:
-    cl = []
-  import libtbx.phil
-  phil_scope = libtbx.phil.parse('''\
+import libtbx.phil
+work_phil_scope = libtbx.phil.parse('''\
 filter_ice = True
   .type = bool
 index = False
@@ -75,31 +87,242 @@ def work(filename, cl=None):
 indexing_min_spots = 10
   .type = int(value_min=1)
 ''')
+
+
+def model_key(*models):
+  '''
+  Generate a hashable key from a set of dxtbx models
+
+  '''
+  import json
+  return tuple(
+    None if model is None else json.dumps(model.to_dict(), sort_keys=True)
+    for model in models)
+
+
+class CachedMaskGenerator(object):
+  '''
+  Wrap a MaskGenerator so that the geometry dependent part of the mask is only
+  computed once per detector and beam model. The trusted range mask depends on
+  the image data so is still computed for every imageset.
+
+  '''
+
+  def __init__(self, params, max_size=16):
+    '''
+    Initialise with the mask generator parameters
+
+    '''
+    from dials.util.masking import MaskGenerator
+    from libtbx.containers import OrderedDict
+    import copy
+    self.use_trusted_range = params.use_trusted_range
+    static_params = copy.deepcopy(params)
+    static_params.use_trusted_range = False
+    self.mask_generator = MaskGenerator(static_params)
+    self.max_size = max_size
+    self._masks = OrderedDict()
+
+  def generate(self, imageset):
+    '''
+    Generate the mask
+
+    '''
+    detector = imageset.get_detector()
+    key = model_key(detector, imageset.get_beam())
+    try:
+      static_mask = self._masks.pop(key)
+    except KeyError:
+      static_mask = self.mask_generator.generate(imageset)
+    self._masks[key] = static_mask
+    while len(self._masks) > self.max_size:
+      self._masks.popitem(last=False)
+    if not self.use_trusted_range:
+      return static_mask
+    masks = []
+    for im, panel, mask in zip(imageset.get_raw_data(0), detector, static_mask):
+      low, high = panel.get_trusted_range()
+      imd = im.as_double()
+      masks.append(mask & (imd > low) & (imd < high))
+    return tuple(masks)
+
+
+class WorkerCache(object):
+  '''
+  State kept by a server process between requests.
+
+  Each request to the server usually differs only in the image filename, so
+  the extracted phil parameters (keyed on the command line arguments), the
+  format classes (keyed on the image template) and the configured spot finders (with their masks and
+  threshold algorithms) are kept and reused. A new cache is used for every
+  request when caching is disabled.
+
+  '''
+
+  def __init__(self, max_size=16):
+    '''
+    Initialise the cache
+
+    :param max_size: The maximum number of entries of each type to keep
+
+    '''
+    from libtbx.containers import OrderedDict
+    self.max_size = max_size
+    self._params = OrderedDict()
+    self._spot_finders = OrderedDict()
+    self._format_classes = OrderedDict()
+
+  def _lookup(self, cache, key, create):
+    '''
+    Get an item from the cache or create it, discarding the least recently
+    used items if the cache is full
+
+    '''
+    try:
+      value = cache.pop(key)
+    except KeyError:
+      value = create()
+    cache[key] = value
+    while len(cache) > self.max_size:
+      cache.popitem(last=False)
+    return value
+
+  def extract_params(self, phil_scope, args):
+    '''
+    Interpret the command line arguments against the phil scope
+
+    :param phil_scope: The master phil scope
+    :param args: The command line arguments
+    :return: (params, unhandled arguments, modified parameters as string)
+
+    '''
+    import copy
+    def create():
+      interp = phil_scope.command_line_argument_interpreter()
+      working_phil, unhandled = interp.process_and_fetch(
+        args, custom_processor='collect_remaining')
+      diff = phil_scope.fetch_diff(source=working_phil).as_str()
+      return working_phil.extract(), unhandled, diff
+    params, unhandled, diff = self._lookup(
+      self._params, (id(phil_scope), tuple(args)), create)
+    return copy.deepcopy(params), list(unhandled), diff
+
+  def format_class(self, filename):
+    '''
+    Get the format class for an image. The class chosen by the format registry
+    is cached by the image template, so it is only reused for images with the
+    same template. A more general class found for one template is therefore
+    never used for an image which the registry gives to a more specific
+    class. Images without a template are always looked up in the registry.
+
+    '''
+    from dxtbx.format.Registry import Registry
+    from dxtbx.sweep_filenames import template_regex
+    template, index = template_regex(filename)
+    if template is None:
+      return Registry.find(filename)
+    format_class = self._format_classes.get(template)
+    if format_class is None or not format_class.understand(filename):
+      self._format_classes.pop(template, None)
+      format_class = Registry.find(filename)
+      if format_class is None:
+        return None
+    return self._lookup(
+      self._format_classes, template, lambda: format_class)
+
+  def load_datablock(self, filename):
+    '''
+    Load the datablock for a single image using the cached format class for
+    its template
+
+    '''
+    from dxtbx.datablock import DataBlockFactory
+    from dxtbx.format.FormatMultiImage import FormatMultiImage
+    format_class = self.format_class(filename)
+    if format_class is None or issubclass(format_class, FormatMultiImage):
+      return DataBlockFactory.from_filenames([filename])[0]
+    imageset = self._make_imageset(filename, format_class)
+    return DataBlockFactory.from_imageset(imageset)[0]
+
+  def _make_imageset(self, filename, format_class):
+    '''
+    Create the imageset in the same way as the datablock importer would
+
+    '''
+    from dxtbx.imageset import ImageSetFactory
+    from dxtbx.sweep_filenames import template_regex
+    fmt = format_class(filename)
+    scan = fmt.get_scan()
+    template, index = template_regex(filename)
+    if scan is None or template is None:
+      return ImageSetFactory.make_imageset([filename], format_class)
+    return ImageSetFactory.make_sweep(
+      template, [index], format_class,
+      fmt.get_beam(), fmt.get_detector(), fmt.get_goniometer(), scan)
+
+  def find_spots(self, datablock, params, args):
+    '''
+    Find spots using a spot finder configured by a previous request with the
+    same arguments, detector type and imageset type if available
+
+    '''
+    from dials.algorithms.spot_finding.factory import SpotFinderFactory
+    from dxtbx.imageset import ImageSweep
+    from libtbx import Auto
+    imageset = datablock.extract_imagesets()[0]
+    detector_type = imageset.get_detector()[0].get_type()
+    def create():
+      if params.spotfinder.filter.min_spot_size is Auto:
+        # smaller default value for pixel array detectors
+        if detector_type == 'SENSOR_PAD':
+          params.spotfinder.filter.min_spot_size = 3
+        else:
+          params.spotfinder.filter.min_spot_size = 6
+        logger.info('Setting spotfinder.filter.min_spot_size=%i' %(
+          params.spotfinder.filter.min_spot_size))
+      find_spots = SpotFinderFactory.from_parameters(
+        datablock=datablock, params=params)
+      find_spots.mask_generator = CachedMaskGenerator(
+        params.spotfinder.filter, max_size=self.max_size)
+      return find_spots
+    find_spots = self._lookup(
+      self._spot_finders,
+      (tuple(args), detector_type, isinstance(imageset, ImageSweep)),
+      create)
+    return find_spots(datablock)
+
+
+def work(filename, cl=None, cache=None):
+  if cl is None:
+    cl = []
+  if cache is None:
+    cache = WorkerCache()
   if not os.access(filename, os.R_OK):
     raise RuntimeError("Server does not have read access to file %s" %filename)
-  interp = phil_scope.command_line_argument_interpreter()
-  params, unhandled = interp.process_and_fetch(
-    cl, custom_processor='collect_remaining')
-  filter_ice = params.extract().filter_ice
-  index = params.extract().index
-  integrate = params.extract().integrate
-  indexing_min_spots = params.extract().indexing_min_spots
+  params, unhandled, _ = cache.extract_params(work_phil_scope, cl)
+  filter_ice = params.filter_ice
+  index = params.index
+  integrate = params.integrate
+  indexing_min_spots = params.indexing_min_spots
 
   from dials.command_line.find_spots import phil_scope as find_spots_phil_scope
-  from dxtbx.datablock import DataBlockFactory
   from dials.array_family import flex
-  interp = find_spots_phil_scope.command_line_argument_interpreter()
-  phil_scope, unhandled = interp.process_and_fetch(
-    unhandled, custom_processor='collect_remaining')
+  find_spots_args = unhandled
+  params, unhandled, diff = cache.extract_params(
+    find_spots_phil_scope, find_spots_args)
   logger.info('The following spotfinding parameters have been modified:')
-  logger.info(find_spots_phil_scope.fetch_diff(source=phil_scope).as_str())
-  params = phil_scope.extract()
+  logger.info(diff)
   # no need to write the hot mask in the server/client
   params.spotfinder.write_hot_mask = False
-  datablock = DataBlockFactory.from_filenames([filename])[0]
+  timings = {}
+  t0 = time.time()
+  datablock = cache.load_datablock(filename)
+  timings['read'] = time.time() - t0
+  logger.info('Loading the image took %.2f seconds' %timings['read'])
   t0 = time.time()
-  reflections = flex.reflection_table.from_observations(datablock, params)
+  reflections = cache.find_spots(datablock, params, find_spots_args)
   t1 = time.time()
+  timings['spotfinding'] = t1 - t0
   logger.info('Spotfinding took %.2f seconds' %(t1-t0))
   from dials.algorithms.spot_finding import per_image_analysis
   imageset = datablock.extract_imagesets()[0]
@@ -111,20 +334,20 @@ def work(filename, cl=None):
   stats = per_image_analysis.stats_single_image(
     imageset, reflections, i=i, plot=False, filter_ice=filter_ice)
   stats = stats.__dict__
+  stats['timings'] = timings
   t2 = time.time()
+  timings['resolution'] = t2 - t1
   logger.info('Resolution analysis took %.2f seconds' %(t2-t1))
 
   if index and stats['n_spots_no_ice'] > indexing_min_spots:
     import logging
     logging.basicConfig(stream=sys.stdout, level=logging.INFO)
     from dials.algorithms.indexing import indexer
-    interp = indexer.master_phil_scope.command_line_argument_interpreter()
-    phil_scope, unhandled = interp.process_and_fetch(
-      unhandled, custom_processor='collect_remaining')
+    params, unhandled, diff = cache.extract_params(
+      indexer.master_phil_scope, unhandled)
     imagesets = [imageset]
     logger.info('The following indexing parameters have been modified:')
-    indexer.master_phil_scope.fetch_diff(source=phil_scope).show()
-    params = phil_scope.extract()
+    logger.info(diff)
     params.indexing.scan_range=[]
 
     if (imageset.get_goniometer() is not None and
@@ -160,6 +383,7 @@ def work(filename, cl=None):
       #stats.fraction_indexed = None
     finally:
       t3 = time.time()
+      timings['indexing'] = t3 - t2
       logger.info('Indexing took %.2f seconds' %(t3-t2))
 
     if integrate and 'lattices' in stats:
@@ -167,13 +391,11 @@ def work(filename, cl=None):
       from dials.algorithms.profile_model.factory import ProfileModelFactory
       from dials.algorithms.integration.integrator import IntegratorFactory
       from dials.command_line.integrate import phil_scope as integrate_phil_scope
-      interp = integrate_phil_scope.command_line_argument_interpreter()
-      phil_scope, unhandled = interp.process_and_fetch(
-        unhandled, custom_processor='collect_remaining')
+      params, unhandled, diff = cache.extract_params(
+        integrate_phil_scope, unhandled)
       imagesets = [imageset]
-      logger.error('The following integration parameters have been modified:')
-      integrate_phil_scope.fetch_diff(source=phil_scope).show()
-      params = phil_scope.extract()
+      logger.info('The following integration parameters have been modified:')
+      logger.info(diff)
 
       try:
         params.profile.gaussian_rs.min_spots = 0
@@ -225,10 +447,55 @@ def work(filename, cl=None):
         stats['error'] = str(e)
       finally:
         t4 = time.time()
+        timings['integration'] = t4 - t3
         logger.info('Integration took %.2f seconds' %(t4-t3))
 
   return stats
 
+def work_task(args):
+  '''
+  Process a single image in a worker process of the pool, returning the
+  results (or the error) as a dictionary
+
+  '''
+  filename, params = args
+  d = {'image': filename}
+  t0 = time.time()
+  try:
+    stats = work(filename, params, cache=worker_cache)
+    d.update(stats)
+  except Exception as e:
+    d['error'] = str(e)
+  d.setdefault('timings', {})['total'] = time.time() - t0
+  return d
+
+
+def init_worker(cache, cache_size):
+  '''
+  Initialise the state of a worker process of the pool
+
+  '''
+  if cache:
+    global worker_cache
+    worker_cache = WorkerCache(max_size=cache_size)
+
+
+def expand_template(template, image_range):
+  '''
+  Expand a template (e.g. image_#####.cbf) over an inclusive image range
+
+  '''
+  import re
+  match = re.search('#+', template)
+  if match is None:
+    raise RuntimeError('Invalid template %s' % template)
+  first, last = image_range
+  width = match.end() - match.start()
+  return ['%s%s%s' % (
+    template[:match.start()], str(i).zfill(width), template[match.end():])
+    for i in range(first, last+1)]
+
+
 class handler(server_base.BaseHTTPRequestHandler):
   def do_GET(s):
     '''Respond to a GET request.'''
@@ -241,16 +508,8 @@ def do_GET(s):
       return
     filename = s.path.split(';')[0]
     params = s.path.split(';')[1:]
-    proc = current_process().name
-
-    d = {'image': filename}
 
-    try:
-      stats = work(filename, params)
-      d.update(stats)
-
-    except Exception as e:
-      d['error'] = str(e)
+    d = worker_pool.apply(work_task, ((filename, params),))
 
     import json
     response = json.dumps(d)
@@ -258,6 +517,50 @@ def do_GET(s):
 
     return
 
+  def do_POST(s):
+    '''
+    Respond to a POST request to the batch endpoint.
+
+    The request body is a JSON object with either a list of "filenames" or a
+    "template" and inclusive "image_range", and optionally a list of "params".
+    The images are queued on the worker pool and the results are written as
+    newline-delimited JSON in the order in which the images complete.
+
+    '''
+    import json
+    if s.path != '/batch':
+      s.send_error(404, 'Unknown endpoint %s' % s.path)
+      return
+    try:
+      length = int(s.headers.getheader('content-length'))
+      request = json.loads(s.rfile.read(length))
+      params = request.get('params', [])
+      if 'template' in request:
+        filenames = expand_template(
+          request['template'], request['image_range'])
+      else:
+        filenames = request['filenames']
+    except Exception as e:
+      s.send_error(400, 'Invalid batch request: %s' % e)
+      return
+    s.send_response(200)
+    s.send_header('Content-type', 'application/x-ndjson')
+    s.end_headers()
+    tasks = [(filename, params) for filename in filenames]
+    for d in worker_pool.imap_unordered(work_task, tasks):
+      s.wfile.write(json.dumps(d) + '\n')
+      s.wfile.flush()
+
+    return
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, server_base.HTTPServer):
+  '''
+  A HTTP server handling each request in a thread so that batch requests
+  can be streamed while other requests are served.
+
+  '''
+  daemon_threads = True
+
 def serve(httpd):
   try:
     while not stop:
@@ -267,26 +570,40 @@ def serve(httpd):
   return
 
 
-import libtbx.phil
 phil_scope = libtbx.phil.parse('''\
 nproc = Auto
   .type = int(value_min=1)
 port = 1701
   .type = int(value_min=1)
+cache {
+  enable = True
+    .type = bool
+    .help = "Keep the parameters, format classes, masks and threshold"
+            "algorithms in each server process between requests"
+  max_size = 16
+    .type = int(value_min=1)
+    .help = "The maximum number of cached entries of each type"
+}
 ''')
 
 
-def main(nproc, port):
-  server_class = server_base.HTTPServer
-  httpd = server_class(('', port), handler)
+def main(nproc, port, cache=True, cache_size=16):
+  # The worker processes live for the lifetime of the server, each with its
+  # own cache, and the requests are handled by threads in this process
+  global worker_pool
+  worker_pool = Pool(
+    processes=nproc, initializer=init_worker, initargs=(cache, cache_size))
+  httpd = ThreadingHTTPServer(('', port), handler)
+  # Time out regularly to check whether the server has been stopped
+  httpd.timeout = 1
   print time.asctime(), 'Serving %d processes on port %d' % (nproc, port)
 
-  for j in range(nproc - 1):
-    proc = Process(target=serve, args=(httpd,))
-    proc.daemon = True
-    proc.start()
-  serve(httpd)
-  httpd.server_close()
+  try:
+    serve(httpd)
+  finally:
+    httpd.server_close()
+    worker_pool.terminate()
+    worker_pool.join()
   print time.asctime(), 'done'
 
 if __name__ == '__main__':
@@ -299,4 +616,5 @@ def main(nproc, port):
   if params.nproc is libtbx.Auto:
     from libtbx.introspection import number_of_processors
     params.nproc = number_of_processors(return_value_if_unknown=-1)
-  main(params.nproc, params.port)
+  main(params.nproc, params.port,
+       cache=params.cache.enable, cache_size=params.cache.max_size)
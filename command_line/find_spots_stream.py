@@ -0,0 +1,484 @@
+from __future__ import absolute_import, division
+from libtbx.utils import Sorry
+
+import libtbx.load_env
+import logging
+logger = logging.getLogger(libtbx.env.dispatcher_name)
+
+help_message = '''
+
+This program finds strong spots on images as they are received from an EIGER
+ZMQ stream, rather than writing the images to disk and finding spots after
+the series has ended. Strong pixels are found on each image in a pool of
+worker processes as soon as the image arrives, and are labelled into spots as
+the images complete. The number of spots on each image is reported as it is
+found (and optionally written as newline-delimited JSON to
+output.spot_counts). The strong spots are saved as soon as the end of series
+message is received.
+
+The received image data are also written to output.directory (as for
+dials.import_stream) so that the datablock can be used for further
+processing, unless output.write_images=False.
+
+Examples::
+
+  dials.find_spots_stream input.host=eiger-dcu input.port=9999 nproc=16
+
+  dials.find_spots_stream input.host=eiger-dcu output.spot_counts=counts.json
+
+'''
+
+# Create the phil parameters
+from libtbx.phil import parse
+phil_scope = parse('''
+
+  output {
+
+    reflections = 'strong.pickle'
+      .type = str
+      .help = "The output filename"
+
+    datablock = datablock.json
+      .type = str
+      .help = "The output JSON or pickle file"
+
+    spot_counts = None
+      .type = str
+      .help = "Write the spot count for each image as newline-delimited JSON"
+              "as each image is processed"
+
+    log = 'dials.find_spots_stream.log'
+      .type = str
+      .help = "The log filename"
+
+    debug_log = 'dials.find_spots_stream.debug.log'
+      .type = str
+      .help = "The debug log filename"
+
+    directory = auto
+      .type = str
+      .help = "The output directory for streaming data"
+
+    image_template = "%05d.image"
+      .type = str
+      .help = "The image template"
+
+    write_images = True
+      .type = bool
+      .help = "Write the received image data to the output directory"
+
+    hot_mask = None
+      .type = str
+      .help = "Write a mask of the pixels which are strong on every image"
+
+  }
+
+  verbosity = 1
+    .type = int(value_min=0)
+    .help = "The verbosity level"
+
+  nproc = Auto
+    .type = int(value_min=1)
+    .help = "The number of processes to use to find spots on the images"
+
+  input {
+
+    host = localhost
+      .type = str
+      .help = "The input host"
+
+    port = 9999
+      .type = int
+      .help = "The input port"
+
+  }
+
+  include scope dials.algorithms.spot_finding.factory.phil_scope
+
+''', process_includes=True)
+
+
+# The task run by the worker processes, set when each worker is initialised
+# so that the mask and threshold function are not pickled for each image
+_worker_task = None
+
+def init_worker(task):
+  '''
+  Initialise the worker process
+
+  '''
+  global _worker_task
+  _worker_task = task
+
+def process_image(args):
+  '''
+  Process an image in the worker process
+
+  '''
+  return _worker_task(args)
+
+
+class DecodeAndExtractPixels(object):
+  '''
+  Decode an image received from the stream and extract the strong pixels
+
+  '''
+
+  def __init__(self, extract_pixels):
+    '''
+    Initialise with the pixel extraction function
+
+    '''
+    self.extract_pixels = extract_pixels
+
+  def __call__(self, args):
+    '''
+    Decode the image and extract the strong pixels
+
+    '''
+    from dials.util.stream import decode_image_data
+    frame, data, info = args
+    result, num_spots = self.extract_pixels(frame, decode_image_data(data, info))
+    return frame, result, num_spots
+
+
+class StreamSpotFinder(object):
+  '''
+  A class to find spots on images as they are received from the stream.
+
+  The images are thresholded in a pool of worker processes. The pixel lists
+  are added to the labellers in frame order as they complete, so that the
+  final reflection table can be created as soon as the series has ended.
+
+  '''
+
+  def __init__(self, params, imageset, nproc=1, spot_counts=None):
+    '''
+    Initialise the spot finder
+
+    :param params: The spot finding parameters
+    :param imageset: The imageset created from the stream header
+    :param nproc: The number of processes
+    :param spot_counts: A file to write the spot counts to
+
+    '''
+    from dials.algorithms.spot_finding.factory import SpotFinderFactory
+    from dials.algorithms.spot_finding.finder import HotPixelAccumulator
+    from dials.model.data import PixelListLabeller
+    from libtbx import Auto
+
+    # Set the minimum spot size as for dials.find_spots
+    detector = imageset.get_detector()
+    if params.spotfinder.filter.min_spot_size is Auto:
+      if detector[0].get_type() == 'SENSOR_PAD':
+        params.spotfinder.filter.min_spot_size = 3
+      else:
+        params.spotfinder.filter.min_spot_size = 6
+      logger.info('Setting spotfinder.filter.min_spot_size=%i' %(
+        params.spotfinder.filter.min_spot_size))
+
+    # Configure the spot finding algorithms
+    params.spotfinder.lookup.mask = SpotFinderFactory.load_image(
+      params.spotfinder.lookup.mask)
+    self.params = params
+    self.imageset = imageset
+    self.nproc = nproc
+    self.spot_counts = spot_counts
+    self.threshold_function = SpotFinderFactory.configure_threshold(
+      params, None)
+    self.filter_spots = SpotFinderFactory.configure_filter(params)
+
+    # The pixel labellers for each panel
+    self.pixel_labeller = [PixelListLabeller() for p in detector]
+
+    # The number of images each pixel is strong on
+    self.hot_pixels = HotPixelAccumulator()
+
+    # The function and pool are created on the first image
+    self.extract_pixels = None
+    self.pool = None
+    self.async_results = []
+
+    # The results received out of order
+    self.pending = {}
+    self.next_frame = None
+
+  def _initialise(self, image):
+    '''
+    Create the static mask from the first image and start the worker pool
+
+    '''
+    from dials.algorithms.spot_finding.finder import ExtractPixelsFromStreamImage
+    from dials.util.masking import MaskGenerator
+    from multiprocessing import Pool
+    import copy
+
+    # The trusted range is applied to each image as it is received
+    mask_params = copy.deepcopy(self.params.spotfinder.filter)
+    mask_params.use_trusted_range = False
+    mask = MaskGenerator(mask_params).generate(self.imageset, image=image)
+    if self.params.spotfinder.lookup.mask is not None:
+      mask = tuple(
+        m1 & m2 for m1, m2 in zip(mask, self.params.spotfinder.lookup.mask))
+
+    self.extract_pixels = ExtractPixelsFromStreamImage(
+      threshold_function        = self.threshold_function,
+      mask                      = mask,
+      trusted_range             = [
+        p.get_trusted_range() for p in self.imageset.get_detector()],
+      region_of_interest        = self.params.spotfinder.region_of_interest,
+      max_strong_pixel_fraction = self.params.spotfinder.filter.max_strong_pixel_fraction,
+      min_spot_size             = self.params.spotfinder.filter.min_spot_size,
+      max_spot_size             = self.params.spotfinder.filter.max_spot_size)
+
+    if self.nproc > 1:
+      from dials.algorithms.spot_finding.finder import ExtractSpotsParallelTask
+      logger.info('Finding spots using %d processes' % self.nproc)
+      self.pool = Pool(
+        processes=self.nproc,
+        initializer=init_worker,
+        initargs=(ExtractSpotsParallelTask(
+          DecodeAndExtractPixels(self.extract_pixels)),))
+
+  def add(self, image):
+    '''
+    Find the strong pixels on an image received from the stream
+
+    :param image: The image object from the decoder
+
+    '''
+    if self.next_frame is None:
+      self.next_frame = image.count
+    if self.extract_pixels is None:
+      self._initialise(image.decode())
+    if self.pool is None:
+      # Decode directly from the zmq buffer without copying
+      result, num_spots = self.extract_pixels(image.count, image.decode())
+      self._add_result(image.count, result, num_spots)
+    else:
+      self.async_results.append(self.pool.apply_async(
+        process_image,
+        ((image.count, image.data, image.info),),
+        callback=self._add_parallel_result))
+
+  def _add_parallel_result(self, result):
+    '''
+    Handle the result from a worker process
+
+    '''
+    (frame, result, num_spots), messages = result
+    self._add_result(frame, result, num_spots, messages)
+
+  def _add_result(self, frame, result, num_spots, messages=()):
+    '''
+    Add the result for an image, adding all the consecutive results that are
+    available to the pixel labellers
+
+    '''
+    import json
+    for message in messages:
+      logger.log(message.levelno, message.msg)
+    self.pending[frame] = result
+    if self.spot_counts is not None:
+      self.spot_counts.write(
+        json.dumps({'image': frame+1, 'n_spots': num_spots}) + '\n')
+      self.spot_counts.flush()
+    while self.next_frame in self.pending:
+      result = self.pending.pop(self.next_frame)
+      assert len(self.pixel_labeller) == len(result.pixel_list), "Inconsistent size"
+      for plabeller, plist in zip(self.pixel_labeller, result.pixel_list):
+        plabeller.add(plist)
+      self.hot_pixels.add(result.pixel_list)
+      result.pixel_list = None
+      self.next_frame += 1
+
+  def finish(self):
+    '''
+    Wait for the images to be processed and create the reflection table
+
+    :return: The strong spots
+
+    '''
+    from dials.algorithms.spot_finding.finder import PixelListToReflectionTable
+    from dials.array_family import flex
+
+    # Wait for the workers, raising any errors
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      for result in self.async_results:
+        result.get()
+    if len(self.pending) > 0:
+      raise RuntimeError('Images missing from stream before frame %d' % (
+        min(self.pending.keys()) + 1))
+
+    # Create the reflections from the pixel lists
+    converter = PixelListToReflectionTable(
+      self.params.spotfinder.filter.min_spot_size,
+      self.params.spotfinder.filter.max_spot_size,
+      self.filter_spots,
+      False)
+    reflections, _ = converter(self.imageset, self.pixel_labeller)
+    reflections['id'] = flex.int(reflections.nrows(), 0)
+    reflections.set_flags(
+      flex.size_t_range(len(reflections)),
+      reflections.flags.strong)
+    return reflections
+
+
+class Script(object):
+  ''' Class to parse the command line options. '''
+
+  def __init__(self):
+    ''' Set the expected options. '''
+    from dials.util.options import OptionParser
+    import libtbx.load_env
+
+    # Create the option parser
+    usage = "usage: %s [options]" % libtbx.env.dispatcher_name
+    self.parser = OptionParser(
+      usage=usage,
+      sort_options=True,
+      phil=phil_scope,
+      epilog=help_message)
+
+  def run(self):
+    ''' Parse the options. '''
+    from dials.util import log
+    import libtbx
+    from uuid import uuid4
+    from dials.util.stream import ZMQStream, Decoder
+    from os.path import join, exists
+    import os
+    import json
+    from time import time
+    from dxtbx.datablock import DataBlock, DataBlockDumper
+
+    # Parse the command line arguments in two passes to set up logging early
+    params, options = self.parser.parse_args(show_diff_phil=False, quick_parse=True)
+
+    # Configure logging
+    log.config(
+      params.verbosity,
+      info=params.output.log,
+      debug=params.output.debug_log)
+    from dials.util.version import dials_version
+    logger.info(dials_version())
+
+    # Parse the command line arguments completely
+    params, options = self.parser.parse_args(show_diff_phil=False)
+
+    # Log the diff phil
+    diff_phil = self.parser.diff_phil.as_str()
+    if diff_phil is not '':
+      logger.info('The following parameters have been modified:\n')
+      logger.info(diff_phil)
+
+    # Check a stream is given
+    if params.input.host is None:
+      raise Sorry("An input host needs to be given")
+
+    # Check the directory
+    if params.output.directory is None:
+      raise Sorry("An output directory needs to be given")
+    elif params.output.directory is libtbx.Auto:
+      params.output.directory = "/dev/shm/dials-%s" % uuid4()
+
+    # Make the output directory
+    if exists(params.output.directory):
+      raise Sorry('Directory "%s" already exists' % (params.output.directory))
+    os.mkdir(params.output.directory)
+
+    # Set the number of processes
+    if params.nproc is libtbx.Auto:
+      from libtbx.introspection import number_of_processors
+      params.nproc = number_of_processors(return_value_if_unknown=-1)
+
+    # The file for the spot counts
+    if params.output.spot_counts is not None:
+      spot_counts = open(params.output.spot_counts, 'w')
+    else:
+      spot_counts = None
+
+    # Initialise the stream
+    stream = ZMQStream(params.input.host, params.input.port)
+    decoder = Decoder(
+      params.output.directory,
+      params.output.image_template)
+    imageset = None
+    find_spots = None
+    while True:
+
+      # Get the frames from zmq
+      frames = stream.receive()
+
+      # Decode the frames
+      obj = decoder.decode(frames)
+
+      # Process the object
+      if obj.is_header():
+        filename = join(params.output.directory, "metadata.json")
+        with open(filename, "w") as outfile:
+          json.dump(obj.header, outfile)
+        imageset = obj.as_imageset(filename)
+        datablock = DataBlock([imageset])
+        if params.output.datablock:
+          logger.info('Writing datablocks to %s' % params.output.datablock)
+          DataBlockDumper([datablock]).as_file(params.output.datablock)
+        find_spots = StreamSpotFinder(
+          params, imageset, nproc=params.nproc, spot_counts=spot_counts)
+      elif obj.is_image():
+        assert find_spots is not None
+        if params.output.write_images:
+          filename = join(
+            params.output.directory,
+            params.output.image_template % obj.count)
+          with open(filename, "wb") as outfile:
+            outfile.write(obj.buffer)
+          filename = join(
+            params.output.directory,
+            "%s.info" % (params.output.image_template % obj.count))
+          with open(filename, "w") as outfile:
+            json.dump(obj.info, outfile)
+        find_spots.add(obj)
+      elif obj.is_endofseries():
+        assert find_spots is not None
+        break
+      else:
+        raise RuntimeError("Unknown object")
+
+    # Close the stream
+    stream.close()
+
+    # Create the strong spots
+    st = time()
+    reflections = find_spots.finish()
+    reflections.is_overloaded(datablock)
+    logger.info('Created %d strong spots in %.2f seconds after end of series' % (
+      len(reflections), time() - st))
+    if spot_counts is not None:
+      spot_counts.close()
+
+    # Save the reflections to file
+    logger.info('Saving {0} reflections to {1}'.format(
+      len(reflections), params.output.reflections))
+    reflections.as_pickle(params.output.reflections)
+
+    # Save the hot pixel mask
+    if params.output.hot_mask is not None:
+      import cPickle as pickle
+      hot_mask = find_spots.hot_pixels.hot_mask()
+      logger.info('Found %d possible hot pixel(s)' % sum(
+        m.count(False) for m in hot_mask))
+      logger.info('Saving hot pixel mask to %s' % params.output.hot_mask)
+      with open(params.output.hot_mask, "wb") as outfile:
+        pickle.dump(hot_mask, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == '__main__':
+  from dials.util import halraiser
+  try:
+    script = Script()
+    script.run()
+  except Exception as e:
+    halraiser(e)
@@ -67,6 +67,11 @@
       .type = str
       .help = "The integration report filename (*.xml or *.json)"
 
+    timing = None
+      .type = str
+      .help = "The filename for the per stage timings and counters (*.json)."
+              "Only available with the 3d_threaded integrator."
+
     include_bad_reference = False
       .type = bool
       .help = "Include bad reference data including unindexed spots,"
@@ -325,6 +330,10 @@ def refl_extend(src, dest, eid):
     # Compute the bounding box
     predicted.compute_bbox(experiments)
 
+    # Record the per stage timings if requested
+    if params.output.timing is not None:
+      params.integration.debug.stage_timing = True
+
     # Create the integrator
     logger.info("")
     integrator = IntegratorFactory.create(params, experiments, predicted)
@@ -366,6 +375,15 @@ def refl_extend(src, dest, eid):
     if params.output.report is not None:
       integrator.report().as_file(params.output.report)
 
+    # Write the per stage timings if requested
+    if params.output.timing is not None:
+      stage_timing = getattr(integrator, 'stage_timing', lambda: None)()
+      if stage_timing is not None:
+        logger.info('Saving per stage timings to %s' % params.output.timing)
+        stage_timing.as_json(params.output.timing)
+      else:
+        logger.warn('Per stage timings are not available with this integrator')
+
     # Print the total time taken
     logger.info("\nTotal time taken: %f" % (time() - start_time))
 
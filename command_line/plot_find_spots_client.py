@@ -18,14 +18,49 @@
   .type = str
 invalid = white
   .type = str
+host = localhost
+  .type = str
+  .help = "The find_spots_server host, if images are given instead of a json"
+          "file of results"
+port = 1701
+  .type = int(value_min=1)
 """, process_includes=True)
 
 
+def load_results(json_file):
+  '''
+  Load the results from the json file written by dials.find_spots_client,
+  either as a single list or as newline-delimited JSON from the batch
+  endpoint of dials.find_spots_server
+
+  '''
+  import json
+  with open(json_file, 'rb') as f:
+    text = f.read()
+  try:
+    return json.loads(text)
+  except ValueError:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def fetch_results(host, port, filenames, params):
+  '''
+  Find spots on the images with a single request to the batch endpoint of
+  dials.find_spots_server, returning the results in the order of the images
+
+  '''
+  from dials.command_line.find_spots_client import work_batch
+  results = {}
+  for d in work_batch(host, port, filenames, params):
+    results[d['image']] = d
+  return [results[filename] for filename in filenames]
+
+
 def run(args):
   from dials.util.options import OptionParser
   import libtbx.load_env
 
-  usage = "%s [options] find_spots.json" %(
+  usage = "%s [options] (find_spots.json | image_*.cbf)" %(
     libtbx.env.dispatcher_name)
 
   parser = OptionParser(
@@ -46,12 +81,14 @@ def run(args):
         i, x, y = [float(l) for l in line]
         positions.append((x, y))
 
-  assert len(args) == 1
-  json_file = args[0]
-  import json
-
-  with open(json_file, 'rb') as f:
-    results = json.load(f)
+  import os
+  filenames = [arg for arg in args if os.path.isfile(arg)]
+  if len(filenames) == 1 and filenames[0].endswith('.json'):
+    results = load_results(filenames[0])
+  else:
+    assert len(filenames) > 0
+    cl = [arg for arg in args if arg not in filenames]
+    results = fetch_results(params.host, params.port, filenames, cl)
 
   n_indexed = flex.double()
   fraction_indexed = flex.double()
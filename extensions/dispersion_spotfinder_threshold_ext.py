@@ -72,6 +72,21 @@ def phil(cls):
         .type = float
         .help = "The global threshold value. Consider all pixels less than this"
                 "value to be part of the background."
+
+      static_mask = False
+        .type = bool
+        .help = "Compute the terms of the threshold which only depend on the"
+                "mask once and reuse them while the mask is unchanged. The"
+                "result is the same but each image is thresholded faster."
+        .expert_level = 2
+
+      use_float = False
+        .type = bool
+        .help = "Use the static mask algorithm and compute the local sums and"
+                "threshold in single precision. This is faster for detectors"
+                "with integer counts but pixels very close to the threshold"
+                "may be classified differently."
+        .expert_level = 2
     ''')
     return phil
 
@@ -83,13 +98,29 @@ def __init__(self, params):
 
     '''
     self.params = params
+    self._algorithm = None
+
+  def kernel_margin(self):
+    '''
+    The dispersion threshold only depends on the local area. If the global
+    threshold is to be estimated, the whole image is needed.
+
+    :returns: The kernel size
+
+    '''
+    import libtbx
+    dispersion = self.params.spotfinder.threshold.dispersion
+    if dispersion.global_threshold is libtbx.Auto:
+      return None
+    return tuple(dispersion.kernel_size)
 
-  def compute_threshold(self, image, mask):
+  def compute_threshold(self, image, mask, region=None):
     '''
     Compute the threshold.
 
     :param image: The image to process
     :param mask: The pixel mask on the image
+    :param region: A key identifying the part of the image
     :returns: A boolean mask showing foreground/background pixels
 
     '''
@@ -102,17 +133,22 @@ def compute_threshold(self, image, mask):
       logger.info("Setting global_threshold: %i" %(
         params.spotfinder.threshold.dispersion.global_threshold))
 
-    from dials.algorithms.spot_finding.threshold import DispersionThresholdStrategy
-    self._algorithm = DispersionThresholdStrategy(
-      kernel_size=params.spotfinder.threshold.dispersion.kernel_size,
-      gain=params.spotfinder.threshold.dispersion.gain,
-      mask=params.spotfinder.lookup.mask,
-      n_sigma_b=params.spotfinder.threshold.dispersion.sigma_background,
-      n_sigma_s=params.spotfinder.threshold.dispersion.sigma_strong,
-      min_count=params.spotfinder.threshold.dispersion.min_local,
-      global_threshold=params.spotfinder.threshold.dispersion.global_threshold)
-
-    return self._algorithm(image, mask)
+    # Create the algorithm once so that the threshold algorithms for each
+    # image size are reused between images
+    if self._algorithm is None:
+      from dials.algorithms.spot_finding.threshold import DispersionThresholdStrategy
+      self._algorithm = DispersionThresholdStrategy(
+        kernel_size=params.spotfinder.threshold.dispersion.kernel_size,
+        gain=params.spotfinder.threshold.dispersion.gain,
+        mask=params.spotfinder.lookup.mask,
+        n_sigma_b=params.spotfinder.threshold.dispersion.sigma_background,
+        n_sigma_s=params.spotfinder.threshold.dispersion.sigma_strong,
+        min_count=params.spotfinder.threshold.dispersion.min_local,
+        global_threshold=params.spotfinder.threshold.dispersion.global_threshold,
+        static_mask=params.spotfinder.threshold.dispersion.static_mask,
+        use_float=params.spotfinder.threshold.dispersion.use_float)
+
+    return self._algorithm(image, mask, region)
 
 def estimate_global_threshold(image, mask=None, plot=False):
 
@@ -59,12 +59,13 @@ def __init__(self, params):
     '''
     self.params = params
 
-  def compute_threshold(self, image, mask):
+  def compute_threshold(self, image, mask, region=None):
     '''
     Compute the threshold.
 
     :param image: The image to process
     :param mask: The pixel mask on the image
+    :param region: A key identifying the part of the image (unused)
     :returns: A boolean mask showing foreground/background pixels
 
     '''
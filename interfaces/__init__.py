@@ -29,19 +29,34 @@ def __init__(self, params, imageset):
     pass
 
   @interface.abstractmethod
-  def compute_threshold(self, image, mask):
+  def compute_threshold(self, image, mask, region=None):
     ''' Threshold the image. The image may be either a flex.int or flex.double
     type. The thresholded image should be returned as a flex.bool where pixels
     labelled True are spot pixels and False are background.
 
     :param image: The image to threshold
     :param mask: The corresponding mask
+    :param region: A key identifying the panel and the part of the panel
+                   being thresholded, so any state kept between images can be
+                   kept for each part
 
     :returns: The thresholded image
 
     '''
     pass
 
+  def kernel_margin(self):
+    ''' The number of pixels (slow, fast) either side of a pixel which are
+    used to threshold it. If the threshold of a pixel only depends on the
+    unmasked pixels in this local area then parts of an image can be
+    thresholded separately. The default of None means the whole image is
+    always thresholded.
+
+    :returns: The kernel size or None
+
+    '''
+    return None
+
 class ProfileModelInterfaceMeta(interface.InterfaceMeta):
   ''' The interface meta class.
 
@@ -72,6 +72,11 @@ namespace dials { namespace model { namespace boost_python {
       .def("labels_3d", &PixelListLabeller::labels_3d)
       .def("labels_2d", &PixelListLabeller::labels_2d)
       ;
+
+    def("merge_labels_3d", &merge_labels_3d, (
+      arg("pixel"),
+      arg("labels"),
+      arg("block_start")));
   }
 
 }}} // namespace dials::model::boost_python
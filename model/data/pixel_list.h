@@ -11,6 +11,8 @@
 #ifndef DIALS_MODEL_DATA_PIXEL_LIST_H
 #define DIALS_MODEL_DATA_PIXEL_LIST_H
 
+#include <algorithm>
+#include <vector>
 #include <scitbx/vec3.h>
 #include <scitbx/array_family/tiny_types.h>
 #include <dials/array_family/scitbx_shared_and_versa.h>
@@ -39,6 +41,18 @@ namespace dials { namespace model {
             : false));
     }
 
+    /**
+     * Find the root of an element in a union-find forest with path halving
+     */
+    inline
+    int find_root(std::vector<int> &parent, int i) {
+      while (parent[i] != i) {
+        parent[i] = parent[parent[i]];
+        i = parent[i];
+      }
+      return i;
+    }
+
   }
 
   /**
@@ -398,6 +412,95 @@ namespace dials { namespace model {
   };
 
 
+  /**
+   * Merge the 3D labels computed separately on contiguous blocks of frames.
+   *
+   * Each block of frames is labelled independently, so the labels in each
+   * block start from zero and components touching the first or last frame of
+   * a block may continue in the neighbouring block. The labels are made
+   * unique across the blocks and the components containing the same pixel on
+   * either side of a block boundary are joined with a union-find. The result
+   * is numbered in order of the first pixel in each component, so it is the
+   * same as labelling all the frames together.
+   *
+   * @param pixel The pixel labeller containing all the frames
+   * @param labels The concatenated labels of each block
+   * @param block_start The first frame of each block after the first
+   * @returns The labels of the pixels
+   */
+  inline
+  af::shared<int> merge_labels_3d(
+      const PixelListLabeller &pixel,
+      const af::const_ref<int> &labels,
+      const af::const_ref<int> &block_start) {
+
+    af::shared< vec3<int> > coords = pixel.coords();
+    DIALS_ASSERT(labels.size() == coords.size());
+    if (coords.size() == 0) {
+      return af::shared<int>();
+    }
+    for (std::size_t i = 1; i < block_start.size(); ++i) {
+      DIALS_ASSERT(block_start[i-1] < block_start[i]);
+    }
+
+    // Offset the labels in each block so they are unique
+    std::vector<int> global(labels.size());
+    std::size_t block = 0;
+    int offset = 0;
+    int num = 0;
+    for (std::size_t i = 0; i < labels.size(); ++i) {
+      for (; block < block_start.size() && coords[i][0] >= block_start[block]; ++block) {
+        offset = num;
+      }
+      DIALS_ASSERT(labels[i] >= 0);
+      global[i] = offset + labels[i];
+      if (global[i] >= num) {
+        num = global[i] + 1;
+      }
+    }
+
+    // Join the components with the same pixel on either side of a boundary
+    std::vector<int> parent(num);
+    for (int i = 0; i < num; ++i) {
+      parent[i] = i;
+    }
+    for (std::size_t b = 0; b < block_start.size(); ++b) {
+      int frame = block_start[b];
+      std::size_t i0 = std::lower_bound(coords.begin(), coords.end(),
+          vec3<int>(frame-1, 0, 0), detail::lessthan) - coords.begin();
+      std::size_t i1 = std::lower_bound(coords.begin(), coords.end(),
+          vec3<int>(frame, 0, 0), detail::lessthan) - coords.begin();
+      std::size_t i2 = std::lower_bound(coords.begin(), coords.end(),
+          vec3<int>(frame+1, 0, 0), detail::lessthan) - coords.begin();
+      for (std::size_t i = i0, j = i1; i < i1 && j < i2; ++i) {
+        vec3<int> a(frame, coords[i][1], coords[i][2]);
+        for (; j < i2 && detail::lessthan(coords[j], a); ++j);
+        if (j < i2 && coords[j] == a) {
+          int ra = detail::find_root(parent, global[i]);
+          int rb = detail::find_root(parent, global[j]);
+          if (ra < rb) {
+            parent[rb] = ra;
+          } else {
+            parent[ra] = rb;
+          }
+        }
+      }
+    }
+
+    // Number the components in order of their first pixel
+    std::vector<int> compact(num, -1);
+    af::shared<int> result(labels.size());
+    int next = 0;
+    for (std::size_t i = 0; i < labels.size(); ++i) {
+      int r = detail::find_root(parent, global[i]);
+      if (compact[r] < 0) {
+        compact[r] = next++;
+      }
+      result[i] = compact[r];
+    }
+    return result;
+  }
+
 }} // namespace dials::model
 
 #endif /* DIALS_MODEL_DATA_PIXEL_LIST_H */
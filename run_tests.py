@@ -106,6 +106,7 @@
     "$D/test/command_line/tst_filter_reflections.py",
     "$D/test/command_line/tst_find_hot_pixels.py",
     "$D/test/command_line/tst_find_spots_server_client.py",
+    "$D/test/command_line/tst_find_spots_stream.py",
     "$D/test/command_line/tst_generate_mask.py",
     "$D/test/command_line/tst_idials.py",
     "$D/test/command_line/tst_import.py",
@@ -144,6 +145,10 @@
     "$D/test/util/tst_nexus_multi_experiment.py",
     "$D/test/util/tst_masking.py",
     "$D/test/algorithms/indexing/tst_phi_scan.py",
+    "$D/test/algorithms/indexing/tst_map_centroids.py",
+    "$D/test/algorithms/indexing/tst_real_fft3d.py",
+    "$D/test/algorithms/indexing/tst_real_space_grid_search_functional.py",
+    "$D/test/algorithms/indexing/tst_refine_candidates.py",
     ["$D/test/algorithms/indexing/tst_index.py", "1"],
     ["$D/test/algorithms/indexing/tst_index.py", "2"],
     ["$D/test/algorithms/indexing/tst_index.py", "3"],
@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division
+
+#
+# Benchmark the dispersion threshold algorithms on simulated images the size
+# of a Pilatus 6M and an Eiger 16M. The images are thresholded on a single
+# core so the rate is the number of images per second per core.
+#
+# Usage: libtbx.python benchmark_dispersion.py [num_images]
+#
+
+# The image sizes (slow, fast)
+DETECTORS = [
+  ('Pilatus 6M', (2527, 2463)),
+  ('Eiger 16M', (4371, 4150)),
+]
+
+
+def simulate_images(size, num_images, mean=5):
+  '''
+  Simulate background images with a few bright pixels and a mask with
+  module gaps
+
+  '''
+  from dials.array_family import flex
+  images = []
+  for i in range(num_images):
+    image = flex.random_int_gaussian_distribution(size[0] * size[1], mean, 2)
+    bright = flex.random_selection(len(image), len(image) // 1000)
+    image.set_selected(bright, 1000)
+    image.reshape(flex.grid(size))
+    images.append(image)
+  mask = flex.bool(flex.grid(size), True)
+  for j in range(195, size[0], 212):
+    mask[j:j+17,:] = flex.bool(flex.grid(min(17, size[0]-j), size[1]), False)
+  for i in range(487, size[1], 494):
+    mask[:,i:i+7] = flex.bool(flex.grid(size[0], min(7, size[1]-i)), False)
+  return images, mask
+
+
+def benchmark(name, create, images, mask):
+  '''
+  Time thresholding the images with an algorithm
+
+  '''
+  from dials.array_family import flex
+  from time import time
+  algorithm = create(images[0].all())
+  result = flex.bool(flex.grid(images[0].all()))
+  algorithm(images[0], mask, result)
+  st = time()
+  for image in images:
+    algorithm(image, mask, result)
+  elapsed = time() - st
+  print '  %-24s %8.3f s/image %8.2f images/s/core' % (
+    name, elapsed / len(images), len(images) / elapsed)
+  return result
+
+
+def run(num_images):
+  from dials.algorithms.image.threshold import DispersionThreshold
+  from dials.algorithms.image.threshold import DispersionThresholdStaticMask
+
+  kernel_size = (3, 3)
+  nsig_b = 6
+  nsig_s = 3
+  min_count = 2
+  algorithms = [
+    ('standard', lambda size: DispersionThreshold(
+      size, kernel_size, nsig_b, nsig_s, 0, min_count)),
+    ('static mask', lambda size: DispersionThresholdStaticMask(
+      size, kernel_size, nsig_b, nsig_s, 0, min_count, False)),
+    ('static mask (float32)', lambda size: DispersionThresholdStaticMask(
+      size, kernel_size, nsig_b, nsig_s, 0, min_count, True)),
+  ]
+
+  for detector, size in DETECTORS:
+    print '%s (%d x %d), %d images' % (detector, size[1], size[0], num_images)
+    images, mask = simulate_images(size, num_images)
+    results = []
+    for name, create in algorithms:
+      results.append(benchmark(name, create, images, mask))
+    for (name, create), result in zip(algorithms[1:], results[1:]):
+      num_diff = (result != results[0]).count(True)
+      print '  %-24s %8d pixels differ from standard on last image' % (
+        name, num_diff)
+
+
+if __name__ == '__main__':
+  import sys
+  if len(sys.argv) > 1:
+    num_images = int(sys.argv[1])
+  else:
+    num_images = 10
+  run(num_images)
@@ -26,6 +26,9 @@ def run(self):
     self.tst_dispersion_w_gain()
     self.tst_dispersion_debug()
     self.tst_dispersion_threshold()
+    self.tst_dispersion_threshold_static_mask()
+    self.tst_dispersion_threshold_strategy_regions()
+    self.tst_dispersion_threshold_strategy_panels()
 
   def tst_niblack(self):
     from dials.algorithms.image.threshold import niblack
@@ -144,6 +147,172 @@ def tst_dispersion_threshold(self):
 
     print 'OK'
 
+  def tst_dispersion_threshold_static_mask(self):
+    from dials.algorithms.image.threshold import DispersionThreshold
+    from dials.algorithms.image.threshold import DispersionThresholdStaticMask
+    from dials.array_family import flex
+    nsig_b = 3
+    nsig_s = 3
+    algorithm1 = DispersionThreshold(
+      self.image.all(),
+      self.size,
+      nsig_b,
+      nsig_s,
+      0,
+      self.min_count)
+    algorithm2 = DispersionThresholdStaticMask(
+      self.image.all(),
+      self.size,
+      nsig_b,
+      nsig_s,
+      0,
+      self.min_count)
+
+    # The result should be the same for several images with the same mask
+    for i in range(3):
+      image = flex.random_double(len(self.image), 10)
+      image.reshape(flex.grid(self.image.all()))
+      result1 = flex.bool(flex.grid(self.image.all()))
+      result2 = flex.bool(flex.grid(self.image.all()))
+      algorithm1(image, self.mask, result1)
+      algorithm2(image, self.mask, result2)
+      assert(result1.all_eq(result2))
+      algorithm1(image, self.mask, self.gain, result1)
+      algorithm2(image, self.mask, self.gain, result2)
+      assert(result1.all_eq(result2))
+    assert algorithm2.num_mask_updates() == 1
+
+    # The mask terms should be recomputed when the mask changes
+    mask = flex.random_bool(len(self.mask), 0.9)
+    mask.reshape(flex.grid(self.mask.all()))
+    result1 = flex.bool(flex.grid(self.image.all()))
+    result2 = flex.bool(flex.grid(self.image.all()))
+    algorithm1(self.image, mask, result1)
+    algorithm2(self.image, mask, result2)
+    assert(result1.all_eq(result2))
+    assert algorithm2.num_mask_updates() == 2
+
+    # Integer images with a pixel too large for the summed area table
+    image = flex.random_int_gaussian_distribution(len(self.image), 10, 3)
+    image[1000] = 1 << 25
+    image.reshape(flex.grid(self.image.all()))
+    algorithm1(image, mask, result1)
+    algorithm2(image, mask, result2)
+    assert(result1.all_eq(result2))
+    assert algorithm2.num_fallback() == 1
+
+    # In single precision almost all pixels should be the same
+    algorithm3 = DispersionThresholdStaticMask(
+      self.image.all(),
+      self.size,
+      nsig_b,
+      nsig_s,
+      0,
+      self.min_count,
+      use_float=True)
+    image = flex.random_int_gaussian_distribution(len(self.image), 10, 3)
+    image.reshape(flex.grid(self.image.all()))
+    result3 = flex.bool(flex.grid(self.image.all()))
+    algorithm1(image, mask, result1)
+    algorithm3(image, mask, result3)
+    assert (result1 != result3).count(True) <= 0.001 * len(result1)
+
+    print 'OK'
+
+  def tst_dispersion_threshold_strategy_regions(self):
+    from dials.algorithms.image.threshold import DispersionThreshold
+    from dials.algorithms.spot_finding.threshold import DispersionThresholdStrategy
+    from dials.array_family import flex
+    nsig_b = 3
+    nsig_s = 3
+    algorithm = DispersionThreshold(
+      (200, 200),
+      self.size,
+      nsig_b,
+      nsig_s,
+      0,
+      self.min_count)
+    strategy = DispersionThresholdStrategy(
+      kernel_size=self.size,
+      n_sigma_b=nsig_b,
+      n_sigma_s=nsig_s,
+      min_count=self.min_count,
+      static_mask=True)
+
+    # Two regions of the same size with different masks
+    masks = []
+    for region in range(2):
+      mask = flex.random_bool(200 * 200, 0.9)
+      mask.reshape(flex.grid(200, 200))
+      masks.append(mask)
+
+    # Each region should keep its own static mask terms
+    for i in range(3):
+      for region, mask in enumerate(masks):
+        image = flex.random_double(200 * 200, 10)
+        image.reshape(flex.grid(200, 200))
+        expected = flex.bool(flex.grid(200, 200))
+        algorithm(image, mask, expected)
+        result = strategy(image, mask, region)
+        assert(result.all_eq(expected))
+    assert len(strategy.algorithm) == 2
+    for a in strategy.algorithm.itervalues():
+      assert a.num_mask_updates() == 1
+
+    print 'OK'
+
+  def tst_dispersion_threshold_strategy_panels(self):
+    from dials.algorithms.spot_finding.finder import extract_pixels
+    from dials.algorithms.spot_finding.threshold import DispersionThresholdStrategy
+    from dials.array_family import flex
+
+    class ThresholdFunction(object):
+      def __init__(self, strategy):
+        self.strategy = strategy
+      def compute_threshold(self, image, mask, region=None):
+        return self.strategy(image, mask, region)
+
+    strategy = DispersionThresholdStrategy(
+      kernel_size=self.size,
+      n_sigma_b=3,
+      n_sigma_s=3,
+      min_count=self.min_count,
+      static_mask=True)
+    threshold_function = ThresholdFunction(strategy)
+
+    # Three panels of the same size with different masks
+    masks = []
+    for panel in range(3):
+      mask = flex.random_bool(100 * 100, 0.9)
+      mask.reshape(flex.grid(100, 100))
+      masks.append(mask)
+    masks = tuple(masks)
+
+    def images():
+      result = []
+      for panel in range(3):
+        image = flex.random_double(100 * 100, 10)
+        image.reshape(flex.grid(100, 100))
+        result.append(image)
+      return tuple(result)
+
+    # Whole panels: the static mask terms are computed once for each panel
+    for frame in range(4):
+      extract_pixels(frame, images(), masks, threshold_function)
+    assert len(strategy.algorithm) == 3
+    for a in strategy.algorithm.itervalues():
+      assert a.num_mask_updates() == 1
+
+    # A region of interest on each panel is kept separately
+    for frame in range(4):
+      extract_pixels(frame, images(), masks, threshold_function,
+                     region_of_interest=(10, 60, 20, 90))
+    assert len(strategy.algorithm) == 6
+    for a in strategy.algorithm.itervalues():
+      assert a.num_mask_updates() == 1
+
+    print 'OK'
+
 if __name__ == '__main__':
   from dials.test import cd_auto
   with cd_auto(__file__):
@@ -0,0 +1,117 @@
+from __future__ import absolute_import, division
+
+#
+# Benchmark the real space grid search functional on simulated reciprocal
+# lattice points. The functional is evaluated for every search vector on the
+# hemisphere grid with the original loop over vectors and with the batched
+# function, and the ranking of the vectors is checked to be the same.
+#
+# Usage: libtbx.python benchmark_real_space_grid_search.py [num_rlps] [nproc]
+#
+
+# The search grid spacing (radians) and the unit cell lengths (A)
+CHARACTERISTIC_GRID = 0.02
+CELL_DIMENSIONS = (57.8, 57.8, 150.0)
+
+
+def simulate_reciprocal_lattice_points(num_rlps, d_min=2.0):
+  '''
+  Simulate reciprocal lattice points from a random orientation of the unit
+  cell with a little noise
+
+  '''
+  import random
+  from scitbx import matrix
+  from scitbx.math import euler_angles_as_matrix
+  from dials.array_family import flex
+  U = matrix.sqr(euler_angles_as_matrix(
+    [random.uniform(0, 360) for i in range(3)]))
+  B = matrix.sqr((
+    1/CELL_DIMENSIONS[0], 0, 0,
+    0, 1/CELL_DIMENSIONS[1], 0,
+    0, 0, 1/CELL_DIMENSIONS[2]))
+  UB = U * B
+  hmax = [int(c / d_min) for c in CELL_DIMENSIONS]
+  rlps = flex.vec3_double()
+  while len(rlps) < num_rlps:
+    hkl = matrix.col([random.randint(-h, h) for h in hmax])
+    s = UB * hkl
+    if s.length() == 0 or 1 / s.length() < d_min:
+      continue
+    noise = matrix.col([random.gauss(0, 1e-4) for i in range(3)])
+    rlps.append((s + noise).elems)
+  return rlps
+
+
+def search_vectors():
+  '''
+  The search vectors for each direction on the hemisphere grid and each
+  unique cell length
+
+  '''
+  from scitbx import matrix
+  from dials.array_family import flex
+  from rstbx.dps_core import SimpleSamplerTool
+  SST = SimpleSamplerTool(CHARACTERISTIC_GRID)
+  SST.construct_hemisphere_grid(SST.incr)
+  vectors = flex.vec3_double()
+  for direction in SST.angles:
+    for l in set(CELL_DIMENSIONS):
+      vectors.append((matrix.col(direction.dvec) * l).elems)
+  return vectors
+
+
+def loop_functional(rlps, vectors):
+  '''
+  Evaluate the functional with a loop over the vectors as in the original
+  real space grid search
+
+  '''
+  import math
+  from dials.array_family import flex
+  function_values = flex.double()
+  for v in vectors:
+    two_pi_S_dot_v = 2 * math.pi * rlps.dot(v)
+    function_values.append(flex.sum(flex.cos(two_pi_S_dot_v)))
+  return function_values
+
+
+def run(num_rlps, nproc):
+  from time import time
+  from dials.array_family import flex
+  from dials.algorithms.indexing import real_space_grid_search_functional
+
+  rlps = simulate_reciprocal_lattice_points(num_rlps)
+  vectors = search_vectors()
+  print '%d reciprocal lattice points, %d search vectors' % (
+    len(rlps), len(vectors))
+
+  st = time()
+  expected = loop_functional(rlps, vectors)
+  loop_time = time() - st
+  print '  %-24s %8.3f s' % ('loop', loop_time)
+
+  for nthreads in sorted(set([1, nproc])):
+    st = time()
+    result = real_space_grid_search_functional(
+      rlps, vectors, nthreads=nthreads)
+    elapsed = time() - st
+    print '  %-24s %8.3f s %8.1fx' % (
+      'batched (%d threads)' % nthreads, elapsed, loop_time / elapsed)
+    assert flex.max(flex.abs(result - expected)) < 1e-7 * len(rlps)
+    perm1 = flex.sort_permutation(expected, reverse=True)
+    perm2 = flex.sort_permutation(result, reverse=True)
+    assert list(perm1[:30]) == list(perm2[:30])
+
+  print 'OK'
+
+
+if __name__ == '__main__':
+  import sys
+  num_rlps = 20000
+  nproc = 4
+  if len(sys.argv) > 1:
+    num_rlps = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    nproc = int(sys.argv[2])
+  run(num_rlps, nproc)
@@ -0,0 +1,35 @@
+from __future__ import absolute_import, division
+
+
+def run(nthreads):
+  from scitbx.array_family import flex
+  from dials.algorithms.indexing import map_centroids_to_reciprocal_space_grid
+
+  # Random reciprocal lattice points, some beyond the resolution limit and
+  # enough that some share a grid point
+  n_points = 64
+  d_min = 2.0
+  rlp = (flex.random_double(30000 * 3) - 0.5) * 1.2
+  rlp = flex.vec3_double(rlp[0::3], rlp[1::3], rlp[2::3])
+  unindexed = flex.random_bool(len(rlp), 0.8)
+
+  # The single threaded version with a boolean selection
+  expected = flex.double(flex.grid(n_points, n_points, n_points), 0)
+  selection = unindexed.deep_copy()
+  map_centroids_to_reciprocal_space_grid(
+    expected, rlp, selection, d_min, b_iso=10)
+  assert selection.count(True) > 0
+  assert selection.count(True) < unindexed.count(True)
+
+  # The threaded version with the indices of the points
+  grid = flex.double(flex.grid(n_points, n_points, n_points), 0)
+  used = map_centroids_to_reciprocal_space_grid(
+    grid, rlp, unindexed.iselection(), d_min, b_iso=10, nthreads=nthreads)
+  assert list(used) == list(selection.iselection())
+  assert grid.all_eq(expected)
+
+
+if __name__ == '__main__':
+  for nthreads in (1, 2, 5):
+    run(nthreads)
+  print 'OK'
@@ -0,0 +1,35 @@
+from __future__ import absolute_import, division
+
+
+def run(gridding):
+  from scitbx import fftpack
+  from scitbx.array_family import flex
+  from dials.algorithms.indexing import RealFFT3D
+
+  # A random real grid with a few non-zero points like a reciprocal space grid
+  grid = flex.double(flex.grid(gridding), 0)
+  selection = flex.random_selection(grid.size(), grid.size() // 10)
+  grid.as_1d().set_selected(selection, flex.random_double(len(selection)))
+
+  # The squared real part of the complex to complex FFT
+  fft = fftpack.complex_to_complex_3d(gridding)
+  expected = flex.pow2(flex.real(fft.forward(flex.complex_double(
+    reals=grid, imags=flex.double(grid.size(), 0)))))
+
+  # The real to complex FFT into a new grid and in place
+  fft = RealFFT3D(gridding)
+  assert tuple(fft.gridding()) == tuple(gridding)
+  result = flex.double(flex.grid(gridding), 0)
+  fft.squared_real_part(grid, result)
+  assert flex.max(flex.abs(result - expected)) < 1e-7 * flex.max(expected)
+
+  # The buffer is reused for the next transform
+  fft.squared_real_part(grid, grid)
+  assert flex.max(flex.abs(grid - expected)) < 1e-7 * flex.max(expected)
+
+
+if __name__ == '__main__':
+  run((8, 8, 8))
+  run((6, 10, 9))
+  run((5, 4, 15))
+  print 'OK'
@@ -0,0 +1,72 @@
+from __future__ import absolute_import, division
+
+
+def loop_functional(rlps, vectors):
+  '''
+  Evaluate the functional with a loop over the vectors as in the original
+  real space grid search
+
+  '''
+  import math
+  from scitbx.array_family import flex
+  function_values = flex.double()
+  for v in vectors:
+    two_pi_S_dot_v = 2 * math.pi * rlps.dot(v)
+    function_values.append(flex.sum(flex.cos(two_pi_S_dot_v)))
+  return function_values
+
+
+def run(num_rlps, num_vectors):
+  import random
+  from scitbx import matrix
+  from scitbx.array_family import flex
+  from dials.algorithms.indexing import real_space_grid_search_functional
+
+  # Random reciprocal lattice points and search vectors of a few lengths
+  rlps = flex.vec3_double(
+    [tuple(random.uniform(-0.4, 0.4) for j in range(3))
+     for i in range(num_rlps)])
+  vectors = flex.vec3_double()
+  for i in range(num_vectors):
+    direction = matrix.col(
+      [random.gauss(0, 1) for j in range(3)]).normalize()
+    vectors.append((direction * random.choice((20.0, 45.5, 80.0))).elems)
+  expected = loop_functional(rlps, vectors)
+
+  # Check with blocks which do not divide the number of vectors and with more
+  # threads than blocks
+  for nthreads in (1, 3, 64):
+    for block_size in (1, 5, 16, 1000):
+      result = real_space_grid_search_functional(
+        rlps, vectors, nthreads=nthreads, block_size=block_size)
+      assert len(result) == len(vectors)
+      assert flex.max(flex.abs(result - expected)) < 1e-9 * len(rlps)
+
+  # The default arguments
+  result = real_space_grid_search_functional(rlps, vectors)
+  assert flex.max(flex.abs(result - expected)) < 1e-9 * len(rlps)
+  perm1 = flex.sort_permutation(expected, reverse=True)
+  perm2 = flex.sort_permutation(result, reverse=True)
+  assert list(perm1[:10]) == list(perm2[:10])
+
+
+def tst_empty():
+  from scitbx.array_family import flex
+  from dials.algorithms.indexing import real_space_grid_search_functional
+  result = real_space_grid_search_functional(
+    flex.vec3_double(), flex.vec3_double([(1, 0, 0), (0, 1, 0)]), nthreads=2)
+  assert list(result) == [0, 0]
+  result = real_space_grid_search_functional(
+    flex.vec3_double([(1, 0, 0)]), flex.vec3_double(), nthreads=2)
+  assert len(result) == 0
+
+
+if __name__ == '__main__':
+  import random
+  random.seed(12345)
+
+  # Fewer points than one chunk and more than two chunks
+  run(100, 37)
+  run(2500, 53)
+  tst_empty()
+  print 'OK'
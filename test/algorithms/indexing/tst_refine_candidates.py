@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division
+
+
+def fake_refinement(index):
+  '''
+  Stand in for run_one_refinement: each candidate is a tuple of the number of
+  reflections it indexes and whether its refinement fails
+
+  '''
+  from dials.algorithms.indexing.indexer import _candidates, Solution
+  n_indexed, fails = _candidates[index]
+  if fails:
+    return index, None
+  return index, Solution(n_indexed=n_indexed, model_likelihood=1.0/n_indexed)
+
+
+def refine(candidates, nproc, min_n_indexed_fraction=0.05):
+  from dials.algorithms.indexing.indexer import refine_candidates
+  n_indexed = [n for n, fails in candidates]
+  return refine_candidates(
+    candidates, n_indexed, min_n_indexed_fraction, nproc,
+    refine=fake_refinement)
+
+
+def filtered(results, min_n_indexed_fraction=0.05):
+  '''
+  The solutions kept by the solution filter, in the order of the candidates
+
+  '''
+  solutions = [s for s in results if s is not None]
+  best_n_indexed = max(s.n_indexed for s in solutions)
+  return [(s.n_indexed, s.model_likelihood) for s in solutions
+          if s.n_indexed >= min_n_indexed_fraction * best_n_indexed]
+
+
+def n_refined(results):
+  return [r.n_indexed if r is not None else None for r in results]
+
+
+def tst_search_order():
+  # Candidates in no particular order: once the best has been refined the
+  # candidates indexing fewer than 5 reflections are skipped
+  candidates = [(60, False), (100, False), (3, False), (80, False),
+                (1, False), (90, False), (2, False)]
+  serial = refine(candidates, nproc=1)
+  assert n_refined(serial) == [60, 100, None, 80, None, 90, None]
+
+  # Only nproc candidates are taken before the first result comes back, so
+  # the parallel search skips the same candidates
+  for nproc in (2, 3):
+    parallel = refine(candidates, nproc=nproc)
+    assert n_refined(parallel) == n_refined(serial)
+    assert filtered(parallel) == filtered(serial)
+
+  # Without a cut-off every candidate is refined
+  for nproc in (1, 2):
+    results = refine(candidates, nproc=nproc, min_n_indexed_fraction=0)
+    assert n_refined(results) == [n for n, fails in candidates]
+
+
+def tst_early_termination():
+  # The serial search stops straight after the best candidate
+  candidates = [(4, False), (100, False), (3, False)]
+  serial = refine(candidates, nproc=1)
+  assert n_refined(serial) == [None, 100, None]
+
+  # The parallel search may also refine the candidates taken before the first
+  # result came back, but the solution filter leaves the same solutions
+  parallel = refine(candidates, nproc=3)
+  assert n_refined(parallel)[1] == 100
+  assert filtered(parallel) == filtered(serial) == [(100, 0.01)]
+
+  # If the best candidate fails to refine the next best sets the cut-off
+  candidates = [(2, False), (100, True), (90, False), (3, False)]
+  serial = refine(candidates, nproc=1)
+  assert n_refined(serial) == [None, None, 90, None]
+  for nproc in (2, 4):
+    parallel = refine(candidates, nproc=nproc)
+    assert parallel[1] is None
+    assert filtered(parallel) == filtered(serial) == [(90, 1/90)]
+
+
+def tst_candidates_released():
+  from dials.algorithms.indexing.indexer import _candidates
+  for nproc in (1, 2):
+    refine([(10, False), (20, False)], nproc=nproc)
+    assert len(_candidates) == 0
+
+
+if __name__ == '__main__':
+  tst_search_order()
+  tst_early_termination()
+  tst_candidates_released()
+  print 'OK'
@@ -0,0 +1,147 @@
+from __future__ import absolute_import, division
+
+#
+# Benchmark the setup of integration jobs on a large reflection table.
+#
+# A table of random bounding boxes is generated in memory, so no test data are
+# needed. The block size estimation (the percentile of the number of frames
+# each reflection covers) and the per-frame and number of frames histograms
+# are timed and checked against the pure Python implementations, which are
+# also timed unless reference=False. The results are written as JSON so the
+# setup time can be compared between releases.
+#
+# Usage: libtbx.python benchmark_integration_setup.py [parameters]
+#
+# e.g.   libtbx.python benchmark_integration_setup.py num_reflections=1000000
+#
+
+from libtbx.phil import parse
+
+phil_scope = parse('''
+  num_reflections = 10000000
+    .type = int(value_min=1)
+    .help = "The number of reflections"
+
+  num_frames = 3600
+    .type = int(value_min=1)
+    .help = "The number of frames"
+
+  max_nframes = 20
+    .type = int(value_min=1)
+    .help = "The maximum number of frames covered by a reflection"
+
+  threshold = 0.99
+    .type = float(value_min=0.0, value_max=1.0)
+    .help = "The fraction of reflections used to compute the block size"
+
+  seed = 0
+    .type = int
+    .help = "The random seed"
+
+  reference = True
+    .type = bool
+    .help = "Time and check against the pure Python implementations"
+
+  output = integration_setup_benchmark.json
+    .type = path
+    .help = "The JSON file to write the results to"
+''')
+
+
+def simulate_bbox(params):
+  '''
+  Generate bounding boxes starting on random frames and covering a random
+  number of frames, skewed towards small numbers as for real data
+
+  '''
+  from dials.array_family import flex
+  from scitbx.random import variate, uniform_distribution, set_random_seed
+  set_random_seed(params.seed)
+  n = params.num_reflections
+  uniform = variate(uniform_distribution(0, 1))
+  z0 = (uniform(n) * params.num_frames).iround()
+  z0.set_selected(z0 >= params.num_frames, params.num_frames - 1)
+  u = uniform(n)
+  z1 = z0 + (u * u * params.max_nframes).iround() + 1
+  z1.set_selected(z1 > params.num_frames, params.num_frames)
+  zero = flex.int(n, 0)
+  ten = flex.int(n, 10)
+  return flex.int6(zero, ten, zero, ten, z0, z1)
+
+
+class Timer(object):
+  '''
+  Record the time taken by each stage
+
+  '''
+
+  def __init__(self, num_reflections):
+    self.num_reflections = num_reflections
+    self.results = []
+
+  def __call__(self, stage, function):
+    from time import time
+    st = time()
+    result = function()
+    elapsed = time() - st
+    self.results.append({
+      'stage' : stage,
+      'seconds' : elapsed,
+    })
+    print '  %-32s %8.3f s' % (stage, elapsed)
+    return result
+
+
+def run(args):
+  from dials.algorithms.integration.processor import nframes_percentile
+  from dials.algorithms.integration.integrator import frame_hist
+  from dials.algorithms.integration.integrator import nframes_hist
+  from dials.algorithms.integration.integrator import hist
+  from dials.util.options import OptionParser
+  import json
+  import platform
+  import time
+
+  parser = OptionParser(phil=phil_scope)
+  params, options = parser.parse_args(args=args, show_diff_phil=True)
+
+  print 'Simulating %d reflections on %d frames' % (
+    params.num_reflections, params.num_frames)
+  bbox = simulate_bbox(params)
+  timer = Timer(len(bbox))
+
+  print 'Stages:'
+  block_size = timer('nframes_percentile', lambda: nframes_percentile(
+    bbox, params.threshold))
+  frames = timer('frame_hist', lambda: frame_hist(bbox))
+  nframes = timer('nframes_hist', lambda: nframes_hist(bbox))
+
+  # Check against the pure Python implementations
+  if params.reference:
+    def reference_percentile():
+      data = sorted([b[5] - b[4] for b in bbox])
+      return data[int(params.threshold * len(data))]
+    assert timer('reference_percentile', reference_percentile) == block_size
+    assert timer('reference_frame_hist', lambda: hist(
+      [z for b in bbox for z in range(b[4], b[5])])) == frames
+    assert timer('reference_nframes_hist', lambda: hist(
+      [b[5] - b[4] for b in bbox])) == nframes
+
+  # Write the results
+  result = {
+    'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'platform' : platform.platform(),
+    'processor' : platform.processor(),
+    'num_reflections' : params.num_reflections,
+    'num_frames' : params.num_frames,
+    'max_nframes' : params.max_nframes,
+    'results' : timer.results,
+  }
+  with open(params.output, 'w') as outfile:
+    json.dump(result, outfile, indent=2)
+  print 'Wrote results to %s' % params.output
+
+
+if __name__ == '__main__':
+  import sys
+  run(sys.argv[1:])
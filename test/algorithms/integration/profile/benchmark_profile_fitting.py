@@ -0,0 +1,194 @@
+from __future__ import absolute_import, division
+
+#
+# Benchmark profile fitting of many reflections against one reference profile.
+#
+# Shoeboxes on the reference profile grid are simulated in memory from a
+# gaussian profile with random intensities, backgrounds and masked pixels, so
+# no test data are needed. The reflections are fitted one at a time with
+# ProfileFitter, as in the gaussian rs profile modeller, and all at once with
+# BatchProfileFitter, and the results are checked to be the same. The results
+# are written as JSON so the fitting time can be compared between releases.
+#
+# Usage: libtbx.python benchmark_profile_fitting.py [parameters]
+#
+# e.g.   libtbx.python benchmark_profile_fitting.py num_reflections=10000
+#
+
+from libtbx.phil import parse
+
+phil_scope = parse('''
+  num_reflections = 20000
+    .type = int(value_min=1)
+    .help = "The number of reflections"
+
+  grid_size = 5
+    .type = int(value_min=1)
+    .help = "The half size of the profile grid"
+
+  max_intensity = 10000
+    .type = float(value_min=0)
+    .help = "The maximum intensity of a reflection"
+
+  max_background = 10
+    .type = float(value_min=0)
+    .help = "The maximum background of a reflection"
+
+  masked_fraction = 0.05
+    .type = float(value_min=0.0, value_max=1.0)
+    .help = "The fraction of pixels that are masked"
+
+  seed = 0
+    .type = int
+    .help = "The random seed"
+
+  output = profile_fitting_benchmark.json
+    .type = path
+    .help = "The JSON file to write the results to"
+''')
+
+
+def simulate_profile(params):
+  '''
+  Generate a normalized gaussian reference profile
+
+  '''
+  from dials.array_family import flex
+  from math import exp
+  n = 2 * params.grid_size + 1
+  c = params.grid_size
+  sigma = params.grid_size / 3.0
+  profile = flex.double(flex.grid(n, n, n))
+  for k in range(n):
+    for j in range(n):
+      for i in range(n):
+        r2 = (k - c)**2 + (j - c)**2 + (i - c)**2
+        profile[k, j, i] = exp(-r2 / (2.0 * sigma**2))
+  return profile / flex.sum(profile)
+
+
+def simulate_shoeboxes(params, profile):
+  '''
+  Generate the data, background and mask arrays of the reflections with
+  dimensions (num_reflections, Z, Y, X)
+
+  '''
+  from dials.array_family import flex
+  import numpy
+  numpy.random.seed(params.seed)
+  n = params.num_reflections
+  p = profile.as_numpy_array()
+  shape = (n,) + p.shape
+  intensity = numpy.random.uniform(0, params.max_intensity, n)
+  background = numpy.random.uniform(0, params.max_background, n)
+  b = numpy.ones(shape) * background.reshape(n, 1, 1, 1)
+  d = numpy.random.poisson(b + intensity.reshape(n, 1, 1, 1) * p)
+  data = flex.double(d.astype(numpy.float64).ravel())
+  background = flex.double(b.ravel())
+  mask = flex.double(numpy.random.uniform(0, 1, b.size)) >= params.masked_fraction
+  grid = flex.grid(shape)
+  data.reshape(grid)
+  background.reshape(grid)
+  mask.reshape(grid)
+  return data, background, mask
+
+
+class Timer(object):
+  '''
+  Record the time taken by each stage
+
+  '''
+
+  def __init__(self):
+    self.results = []
+
+  def __call__(self, stage, function):
+    from time import time
+    st = time()
+    result = function()
+    elapsed = time() - st
+    self.results.append({
+      'stage' : stage,
+      'seconds' : elapsed,
+    })
+    print '  %-32s %8.3f s' % (stage, elapsed)
+    return result
+
+
+def run(args):
+  from dials.algorithms.integration.fit import ProfileFitter
+  from dials.algorithms.integration.fit import BatchProfileFitter
+  from dials.util.options import OptionParser
+  import json
+  import platform
+  import time
+
+  parser = OptionParser(phil=phil_scope)
+  params, options = parser.parse_args(args=args, show_diff_phil=True)
+
+  print 'Simulating %d reflections on a %d^3 grid' % (
+    params.num_reflections, 2 * params.grid_size + 1)
+  profile = simulate_profile(params)
+  data, background, mask = simulate_shoeboxes(params, profile)
+  n = params.num_reflections
+  size = len(profile)
+
+  def fit_single():
+    data_1d = data.as_1d()
+    background_1d = background.as_1d()
+    mask_1d = mask.as_1d()
+    result = []
+    for k in range(n):
+      c = data_1d[k*size:(k+1)*size]
+      b = background_1d[k*size:(k+1)*size]
+      m = mask_1d[k*size:(k+1)*size]
+      c.reshape(profile.accessor())
+      b.reshape(profile.accessor())
+      m.reshape(profile.accessor())
+      try:
+        fit = ProfileFitter(c, b, m, profile, 1e-3, 100)
+        result.append((fit.intensity()[0], fit.variance()[0], fit.correlation()))
+      except RuntimeError:
+        result.append(None)
+    return result
+
+  def fit_batch():
+    return BatchProfileFitter(data, background, mask, profile, 1e-3, 100)
+
+  print 'Stages:'
+  timer = Timer()
+  batch = timer('BatchProfileFitter', fit_batch)
+  single = timer('ProfileFitter', fit_single)
+
+  # Check the results are the same
+  for k, result in enumerate(single):
+    if result is None:
+      assert not batch.success()[k]
+    else:
+      assert batch.success()[k]
+      assert result == (
+        batch.intensity()[k],
+        batch.variance()[k],
+        batch.correlation()[k])
+  speedup = timer.results[1]['seconds'] / max(timer.results[0]['seconds'], 1e-9)
+  print 'Speed up: %.2f' % speedup
+
+  # Write the results
+  result = {
+    'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'platform' : platform.platform(),
+    'processor' : platform.processor(),
+    'num_reflections' : params.num_reflections,
+    'grid_size' : params.grid_size,
+    'num_fitted' : batch.success().count(True),
+    'speedup' : speedup,
+    'results' : timer.results,
+  }
+  with open(params.output, 'w') as outfile:
+    json.dump(result, outfile, indent=2)
+  print 'Wrote results to %s' % params.output
+
+
+if __name__ == '__main__':
+  import sys
+  run(sys.argv[1:])
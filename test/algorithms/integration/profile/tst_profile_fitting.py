@@ -24,6 +24,8 @@ def run(self):
     self.tst_with_no_background_partial()
     self.tst_with_flat_background_partial()
 
+    self.tst_batch()
+
     #self.tst_deconvolve_zero()
 
     self.tst_deconvolve_3_with_no_background()
@@ -548,6 +550,62 @@ def tst_deconvolve_7_with_flat_background(self):
 
     print 'OK'
 
+  def tst_batch(self):
+
+    from dials.algorithms.integration.fit import ProfileFitter
+    from dials.algorithms.integration.fit import BatchProfileFitter
+    from scitbx.array_family import flex
+    from numpy.random import seed, randint
+    seed(0)
+
+    # Create profile
+    p = gaussian((9, 9, 9), 1, (4, 4, 4), (2, 2, 2))
+    s = flex.sum(p)
+    p = p / s
+
+    # Create the reflections with different intensities and backgrounds and
+    # some masked pixels. The last one has negative data so can't be fitted.
+    n = 40
+    data = []
+    for k in range(n):
+      b = flex.double(flex.grid(9, 9, 9), k % 5)
+      c = add_poisson_noise(10 * k * p) + add_poisson_noise(b)
+      m = flex.bool(flex.grid(9, 9, 9), True)
+      for i in randint(0, len(m), 20):
+        m[int(i)] = False
+      data.append((c, b, m))
+    data[-1][0][0] = -1
+    data[-1][2][0] = True
+
+    # Stack the reflections into single arrays
+    cs = flex.double()
+    bs = flex.double()
+    ms = flex.bool()
+    for c, b, m in data:
+      cs.extend(c.as_1d())
+      bs.extend(b.as_1d())
+      ms.extend(m.as_1d())
+    cs.reshape(flex.grid(n, 9, 9, 9))
+    bs.reshape(flex.grid(n, 9, 9, 9))
+    ms.reshape(flex.grid(n, 9, 9, 9))
+
+    # Fit
+    fit = BatchProfileFitter(cs, bs, ms, p, maxiter=100)
+    assert len(fit) == n
+    assert fit.success().count(True) == n - 1
+    assert not fit.success()[n-1]
+
+    # Test the results are the same as fitting each reflection
+    for k, (c, b, m) in enumerate(data[:-1]):
+      single = ProfileFitter(c, b, m, p, maxiter=100)
+      assert fit.intensity()[k] == single.intensity()[0]
+      assert fit.variance()[k] == single.variance()[0]
+      assert fit.correlation()[k] == single.correlation()
+      assert fit.niter()[k] == single.niter()
+      assert fit.niter()[k] < fit.maxiter()
+
+    print 'OK'
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,92 @@
+from __future__ import absolute_import, division, print_function
+
+from dials.array_family import flex
+from libtbx import group_args
+import pytest
+
+
+class MemoryInfo(object):
+  def __init__(self, total):
+    self.total = total
+
+  def memory_total(self):
+    return self.total
+
+
+class Job(object):
+  def __init__(self, frames):
+    self._frames = frames
+
+  def frames(self):
+    return self._frames
+
+
+def make_manager(monkeypatch, total_memory, max_memory_usage, nproc,
+                 nframes, threshold=0.99):
+  '''
+  A manager for 100 frames where each job needs 1 byte per frame of shoebox
+  memory, with reflections covering the given numbers of frames
+
+  '''
+  import libtbx.introspection
+  from dials.algorithms.integration.processor import Manager
+  monkeypatch.setattr(
+    libtbx.introspection, 'machine_memory_info',
+    lambda: MemoryInfo(total_memory))
+
+  manager = Manager.__new__(Manager)
+  manager.params = group_args(
+    block = group_args(
+      size             = 100,
+      units            = 'frames',
+      threshold        = threshold,
+      max_memory_usage = max_memory_usage),
+    mp = group_args(
+      method = 'multiprocessing',
+      nproc  = nproc))
+  manager.reflections = flex.reflection_table()
+  manager.reflections['bbox'] = flex.int6(
+    [(0, 10, 0, 10, 0, n) for n in nframes])
+  manager.block_sizes = []
+
+  def compute_jobs():
+    size = int(manager.params.block.size)
+    manager.block_sizes.append(size)
+    manager.jobs = [Job((i, min(i + size, 100))) for i in range(0, 100, size)]
+
+  def compute_max_memory_usage():
+    return max(j.frames()[1] - j.frames()[0] for j in manager.jobs)
+
+  manager.compute_jobs = compute_jobs
+  manager.compute_max_memory_usage = compute_max_memory_usage
+  compute_jobs()
+  return manager
+
+
+def test_compute_processors_splits_blocks_to_fit_memory(monkeypatch):
+  manager = make_manager(
+    monkeypatch, total_memory=100, max_memory_usage=0.25, nproc=4,
+    nframes=[3] * 100)
+  manager.compute_processors()
+
+  # The blocks are halved until one job fits and only one job fits at once
+  assert manager.block_sizes == [100, 50, 25]
+  assert manager.params.mp.nproc == 1
+
+
+def test_compute_processors_does_not_split_below_reflection_depth(monkeypatch):
+  # Most reflections cover 3 frames, so blocks are not split below 6 frames
+  manager = make_manager(
+    monkeypatch, total_memory=100, max_memory_usage=0.05, nproc=4,
+    nframes=[3] * 95 + [40] * 5, threshold=0.9)
+  with pytest.raises(RuntimeError) as e:
+    manager.compute_processors()
+  assert manager.block_sizes == [100, 50, 25, 12, 6]
+  assert 'minimum 6 frames' in str(e.value)
+
+  # A slightly larger budget fits the minimum block
+  manager = make_manager(
+    monkeypatch, total_memory=100, max_memory_usage=0.07, nproc=4,
+    nframes=[3] * 95 + [40] * 5, threshold=0.9)
+  manager.compute_processors()
+  assert manager.block_sizes == [100, 50, 25, 12, 6]
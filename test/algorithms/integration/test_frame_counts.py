@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function
+
+import random
+from collections import Counter
+
+from dials.array_family import flex
+
+def random_bbox(n, num_frames=50, max_nframes=8):
+  random.seed(0)
+  bbox = flex.int6()
+  for i in range(n):
+    z0 = random.randint(0, num_frames - 1)
+    z1 = min(z0 + random.randint(1, max_nframes), num_frames)
+    bbox.append((0, 10, 0, 10, z0, z1))
+  return bbox
+
+def test_count_reflections_per_frame():
+  from dials.algorithms.integration.processor import count_reflections_per_frame
+  bbox = random_bbox(1000)
+  expected = sorted(Counter(
+    z for b in bbox for z in range(b[4], b[5])).items())
+  assert count_reflections_per_frame(bbox) == expected
+
+def test_count_reflections_per_nframes():
+  from dials.algorithms.integration.processor import count_reflections_per_nframes
+  bbox = random_bbox(1000)
+  expected = sorted(Counter(b[5] - b[4] for b in bbox).items())
+  assert count_reflections_per_nframes(bbox) == expected
+
+def test_nframes_percentile():
+  from dials.algorithms.integration.processor import nframes_percentile
+  bbox = random_bbox(1000)
+  nframes = sorted(b[5] - b[4] for b in bbox)
+  for threshold in [0.01, 0.5, 0.9, 0.99]:
+    expected = nframes[int(threshold * len(nframes))]
+    assert nframes_percentile(bbox, threshold) == expected
+  assert nframes_percentile(bbox, 1.0) == nframes[-1]
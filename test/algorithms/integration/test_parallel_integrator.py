@@ -431,3 +431,82 @@ def check_job(index):
   check_job(2)
   check_job(3)
   check_job(4)
+
+
+def test_stage_timing_info(tmpdir):
+  from dials.algorithms.integration.parallel_integrator import StageTimingInfo
+  import json
+
+  class Profiler(object):
+    ''' Mimic the C++ IntegrationProfiler '''
+    def __init__(self, nthreads):
+      self.nthreads = nthreads
+    def num_threads(self):
+      return self.nthreads
+    def num_stages(self):
+      return 3
+    def stage_name(self, stage):
+      return ["extract", "mask", "background"][stage]
+    def time(self, thread, stage):
+      return 0.5 * (thread + 1)
+    def count(self, thread, stage):
+      return 10 * (thread + 1)
+    def pixels(self, thread, stage):
+      return 1000 * (thread + 1)
+
+  job1 = StageTimingInfo.from_profiler(Profiler(2))
+  job1.add_job(0, read_time=1.0)
+  job2 = StageTimingInfo.from_profiler(Profiler(3))
+  job2.add_job(1, read_time=2.0)
+
+  total = StageTimingInfo()
+  total.update(job1)
+  total.update(job2)
+
+  assert total.stages == ["extract", "mask", "background"]
+  assert len(total.threads) == 3
+  assert total.threads[0]["mask"]["reflections"] == 20
+  assert total.threads[2]["mask"]["reflections"] == 30
+  for name, stage in total.totals():
+    assert stage["reflections"] == 30 + 60
+    assert stage["pixels"] == 3000 + 6000
+    assert stage["time"] == pytest.approx(1.5 + 3.0)
+  assert [job["index"] for job in total.jobs] == [0, 1]
+  assert "background" in str(total)
+
+  filename = tmpdir.join("timing.json").strpath
+  total.as_json(filename)
+  with open(filename) as infile:
+    result = json.load(infile)
+  assert [stage["name"] for stage in result["stages"]] == total.stages
+  assert len(result["threads"]) == 3
+  assert result["jobs"][1]["read_time"] == 2.0
+
+
+def test_stage_timing_info_from_integration_profiler():
+  from dials.algorithms.integration.parallel_integrator import \
+    IntegrationProfiler, IntegrationProfilerCounters, StageTimingInfo
+
+  names = [IntegrationProfiler.stage_name(i)
+           for i in range(IntegrationProfiler.num_stages())]
+  assert names == ["extract", "mask", "background", "centroid", "summation",
+                   "fitting", "finalize"]
+
+  # Time every stage of three reflections on this thread
+  profiler = IntegrationProfiler()
+  assert profiler.num_threads() == 0
+  for i in range(3):
+    counters = IntegrationProfilerCounters()
+    counters.start()
+    for stage in range(len(names)):
+      counters.tick(stage, 100 * (i + 1))
+    profiler.accumulate(counters)
+  assert profiler.num_threads() == 1
+
+  timing = StageTimingInfo.from_profiler(profiler)
+  assert timing.stages == names
+  assert len(timing.threads) == 1
+  for name, stage in timing.totals():
+    assert stage["reflections"] == 3
+    assert stage["pixels"] == 600
+    assert stage["time"] >= 0
@@ -87,12 +87,44 @@ def __init__(self):
   def run(self):
     from dials.array_family import flex
     #self.test_for_reference()
+    self.test_pixel_lookup()
     for filename in self.refl_filenames:
       refl = flex.reflection_table.from_pickle(filename)
       refl.compute_partiality(self.experiments)
       refl['id'] = flex.int(len(refl),0)
       self.test_for_reflections(refl, filename)
 
+  def test_pixel_lookup(self):
+    from dials.array_family import flex
+
+    # Model the reference profiles with and without the pixel lookup
+    experiment = self.experiments[0]
+    fitting = experiment.profile.params.gaussian_rs.fitting
+    modellers = []
+    for pixel_lookup in (True, False):
+      fitting.pixel_lookup = pixel_lookup
+      modeller = experiment.profile.fitting_class()(experiment)
+      assert modeller.pixel_lookup() == pixel_lookup
+      modeller.model(self.reference.copy())
+      modeller.finalize()
+      modellers.append(modeller)
+    fitting.pixel_lookup = True
+
+    # The profiles should agree to within the lookup tolerance
+    m1, m2 = modellers
+    assert len(m1) == len(m2)
+    num_valid = 0
+    for i in range(len(m1)):
+      assert m1.valid(i) == m2.valid(i)
+      if not m1.valid(i):
+        continue
+      d1 = m1.data(i)
+      d2 = m2.data(i)
+      assert flex.max(flex.abs(d1 - d2)) <= 1e-3 * flex.max(d2)
+      num_valid += 1
+    assert num_valid > 0
+    print 'OK'
+
   def mv3n_tolerance_interval(self, x):
       from math import sqrt, pi, erf, exp
       g32 = sqrt(pi) / 2.0
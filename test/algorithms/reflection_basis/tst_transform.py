@@ -77,6 +77,7 @@ def __call__(self):
     self.tst_conservation_of_counts()
     #self.tst_transformed_centroid()
     self.tst_transform_with_background()
+    self.tst_transform_with_pixel_lookup()
 
   def tst_conservation_of_counts(self):
 
@@ -347,6 +348,76 @@ def tst_transform_with_background(self):
     # Test passed
     print 'OK'
 
+  def tst_transform_with_pixel_lookup(self):
+
+    from scitbx import matrix
+    from random import uniform
+    from dials.algorithms.profile_model.gaussian_rs import CoordinateSystem
+    from dials.algorithms.profile_model.gaussian_rs import transform
+    from scitbx.array_family import flex
+    import cPickle as pickle
+    assert(len(self.detector) == 1)
+    s0 = self.beam.get_s0()
+    m2 = self.gonio.get_rotation_axis()
+    s0_length = matrix.col(self.beam.get_s0()).length()
+
+    # Create a spec using the interpolated pixel coordinates
+    spec = transform.TransformSpec(
+        self.beam, self.detector, self.gonio, self.scan,
+        self.sigma_divergence, self.mosaicity,
+        self.n_sigma+1, self.grid_size)
+    assert(not spec.use_pixel_lookup())
+    spec.enable_pixel_lookup(16, 1e-3)
+    assert(spec.use_pixel_lookup())
+
+    # Check the lookup survives pickling
+    spec2 = pickle.loads(pickle.dumps(spec))
+    assert(spec2.use_pixel_lookup())
+    assert(spec2.pixel_lookup_region_size() == 16)
+    assert(abs(spec2.pixel_lookup_tolerance() - 1e-3) < 1e-12)
+
+    for i in range(100):
+
+      # Get random x, y, z
+      x = uniform(300, 1800)
+      y = uniform(300, 1800)
+      z = uniform(0, 9)
+
+      # Get random s1, phi, panel
+      s1 = matrix.col(self.detector[0].get_pixel_lab_coord(
+          (x, y))).normalize() * s0_length
+      phi = self.scan.get_angle_from_array_index(z, deg=False)
+      panel = 0
+
+      # Calculate the bounding box
+      bbox = self.calculate_bbox(s1, z, panel)
+      x0, x1, y0, y1, z0, z1 = bbox
+
+      # Create the coordinate system
+      cs = CoordinateSystem(m2, s0, s1, phi)
+
+      # Create the image
+      image = gaussian((z1 - z0, y1 - y0, x1 - x0), 10.0,
+          (z - z0, y - y0, x - x0), (2.0, 2.0, 2.0))
+      mask = flex.bool(flex.grid(image.all()), True)
+
+      # Transform with and without the lookup
+      grid1 = transform.TransformForward(self.spec, cs, bbox, 0,
+          image.as_double(), mask).profile()
+      grid2 = transform.TransformForward(spec, cs, bbox, 0,
+          image.as_double(), mask).profile()
+
+      # The profiles should agree to well within the tolerance
+      eps = 1e-3 * flex.max(grid1)
+      try:
+        assert(flex.max(flex.abs(grid1 - grid2)) <= eps)
+      except Exception:
+        print "Failed for: ", (x, y, z)
+        raise
+
+    # Test passed
+    print 'OK'
+
 
 #class TestReverse(object):
 #    def __init__(self, filename):
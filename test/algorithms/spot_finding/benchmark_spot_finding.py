@@ -0,0 +1,292 @@
+from __future__ import absolute_import, division
+
+#
+# Benchmark the stages of the spot finding pipeline on synthetic images.
+#
+# The images are generated in memory with a Poisson background and Gaussian
+# spots spread over a few images, using the simulation helpers in
+# dials.algorithms.simulation, so no test data are needed. Each stage
+# (thresholding, extracting the pixel lists, labelling in 2D and 3D, creating
+# the shoeboxes and the reflection table) is timed separately, followed by
+# the whole of ExtractSpots for each value of nproc with and without
+# shoeboxes. The results are written as JSON so the throughput can be
+# compared between releases.
+#
+# Usage: libtbx.python benchmark_spot_finding.py [parameters]
+#
+# e.g.   libtbx.python benchmark_spot_finding.py image_size=4150,4371 nproc=1,4,16
+#
+
+from libtbx.phil import parse
+
+phil_scope = parse('''
+  image_size = 2463 2527
+    .type = ints(size=2, value_min=1)
+    .help = "The image size (fast, slow)"
+
+  num_images = 20
+    .type = int(value_min=1)
+    .help = "The number of images"
+
+  background = 1.0
+    .type = float(value_min=0)
+    .help = "The mean background counts per pixel"
+
+  spot_density = 1.0e-4
+    .type = float(value_min=0)
+    .help = "The number of spots per pixel on each image"
+
+  spot_intensity = 1000
+    .type = float(value_min=0)
+    .help = "The total counts in each spot"
+
+  spot_sigma = 1.0 1.0
+    .type = floats(size=2, value_min=0)
+    .help = "The standard deviation of the spots (pixels, images)"
+
+  seed = 0
+    .type = int
+    .help = "The random seed"
+
+  nproc = 1 2 4
+    .type = ints(value_min=1)
+    .help = "The numbers of processes to run ExtractSpots with"
+
+  output = spot_finding_benchmark.json
+    .type = path
+    .help = "The JSON file to write the results to"
+
+  include scope dials.algorithms.spot_finding.factory.phil_scope
+''', process_includes=True)
+
+
+class SyntheticImageSet(object):
+  '''
+  An in-memory imageset providing the parts of the interface used in spot
+  finding
+
+  '''
+
+  def __init__(self, detector, images, mask):
+    self.detector = detector
+    self.images = images
+    self.mask = mask
+
+  def __len__(self):
+    return len(self.images)
+
+  def __getitem__(self, item):
+    assert isinstance(item, slice)
+    return SyntheticImageSet(self.detector, self.images[item], self.mask)
+
+  def get_detector(self):
+    return self.detector
+
+  def get_raw_data(self, index):
+    return (self.images[index].iround(),)
+
+  def get_corrected_data(self, index):
+    return (self.images[index],)
+
+  def get_mask(self, index):
+    return self.mask
+
+  def indices(self):
+    return list(range(len(self.images)))
+
+  def reader(self):
+    return self
+
+  def is_single_file_reader(self):
+    return False
+
+
+def simulate_images(params):
+  '''
+  Simulate images with the helpers in dials.algorithms.simulation: a flat
+  Poisson background from random_background_plane2 and Gaussian spots from
+  simple_gaussian_spots, each spot shoebox added to the images at a random
+  position
+
+  '''
+  from dials.array_family import flex
+  from dials.algorithms.simulation.generate_test_reflections import \
+    master_phil, random_background_plane2, simple_gaussian_spots
+  from dxtbx.model import DetectorFactory
+  from scitbx.random import set_random_seed
+  from math import ceil
+  import random
+
+  random.seed(params.seed)
+  set_random_seed(params.seed)
+  width, height = params.image_size
+  sigma_xy, sigma_z = params.spot_sigma
+
+  detector = DetectorFactory.simple(
+    'PAD', 200, (width * 0.0865, height * 0.0865), '+x', '-y',
+    (0.172, 0.172), (width, height), (-1, 1e6))
+
+  # The background of each image
+  images = []
+  for k in range(params.num_images):
+    image = flex.double(flex.grid(1, height, width), 0)
+    if params.background > 0:
+      random_background_plane2(image, params.background, 0, 0, 0)
+    image.reshape(flex.grid(height, width))
+    images.append(image)
+
+  # The spot shoeboxes, extending 3 sigma either side of the centre
+  num_spots = int(params.spot_density * width * height * params.num_images)
+  spot_params = master_phil.extract()
+  spot_params.nrefl = num_spots
+  spot_params.shoebox_size.x = min(2 * int(ceil(3 * sigma_xy)) + 1, width)
+  spot_params.shoebox_size.y = min(2 * int(ceil(3 * sigma_xy)) + 1, height)
+  spot_params.shoebox_size.z = min(
+    2 * int(ceil(3 * sigma_z)) + 1, params.num_images)
+  spot_params.spot_size.x = sigma_xy
+  spot_params.spot_size.y = sigma_xy
+  spot_params.spot_size.z = sigma_z
+  spot_params.counts = int(params.spot_intensity)
+  spots = simple_gaussian_spots(spot_params)
+
+  # Add the spots to the images
+  nx = spot_params.shoebox_size.x
+  ny = spot_params.shoebox_size.y
+  nz = spot_params.shoebox_size.z
+  for shoebox in spots['shoebox']:
+    data = shoebox.data.as_double()
+    x0 = random.randint(0, width - nx)
+    y0 = random.randint(0, height - ny)
+    z0 = random.randint(0, params.num_images - nz)
+    for k in range(nz):
+      section = data[k:k+1,0:ny,0:nx]
+      section.reshape(flex.grid(ny, nx))
+      image = images[z0 + k]
+      image[y0:y0+ny,x0:x0+nx] = image[y0:y0+ny,x0:x0+nx] + section
+  mask = (flex.bool(flex.grid(height, width), True),)
+  return SyntheticImageSet(detector, images, mask), num_spots
+
+
+class Timer(object):
+  '''
+  Record the time taken by each stage
+
+  '''
+
+  def __init__(self, num_images):
+    self.num_images = num_images
+    self.results = []
+
+  def __call__(self, stage, function, nproc=1):
+    from time import time
+    st = time()
+    result = function()
+    elapsed = time() - st
+    self.results.append({
+      'stage' : stage,
+      'nproc' : nproc,
+      'seconds' : elapsed,
+      'images_per_second' : self.num_images / elapsed if elapsed > 0 else None,
+    })
+    print '  %-32s nproc=%-3d %8.3f s %10.2f images/s' % (
+      stage, nproc, elapsed, self.num_images / max(elapsed, 1e-9))
+    return result
+
+
+def run(args):
+  from dials.algorithms.spot_finding.factory import SpotFinderFactory
+  from dials.algorithms.spot_finding.finder import ExtractSpots
+  from dials.algorithms.spot_finding.finder import extract_pixels
+  from dials.algorithms.spot_finding.finder import ShoeboxesToReflectionTable
+  from dials.model.data import PixelListLabeller
+  from dials.array_family import flex
+  from dials.util.options import OptionParser
+  from libtbx import Auto
+  import json
+  import platform
+  import time
+
+  parser = OptionParser(phil=phil_scope)
+  params, options = parser.parse_args(args=args, show_diff_phil=True)
+  if params.spotfinder.filter.min_spot_size is Auto:
+    params.spotfinder.filter.min_spot_size = 3
+
+  print 'Simulating %d images of %d x %d pixels' % (
+    params.num_images, params.image_size[0], params.image_size[1])
+  imageset, num_spots = simulate_images(params)
+  print 'Simulated %d spots' % num_spots
+
+  threshold_function = SpotFinderFactory.configure_threshold(params, None)
+  filter_spots = SpotFinderFactory.configure_filter(params)
+  min_spot_size = params.spotfinder.filter.min_spot_size
+  max_spot_size = params.spotfinder.filter.max_spot_size
+  timer = Timer(len(imageset))
+
+  # Time the individual stages
+  print 'Stages:'
+  timer('threshold', lambda: [
+    threshold_function.compute_threshold(imageset.get_corrected_data(i)[0],
+                                         imageset.get_mask(i)[0])
+    for i in range(len(imageset))])
+  pixel_lists = timer('extract_pixels', lambda: [
+    extract_pixels(i, imageset.get_corrected_data(i), imageset.get_mask(i),
+                   threshold_function)[0]
+    for i in range(len(imageset))])
+  def add_pixel_lists():
+    labeller = PixelListLabeller()
+    for pixel_list in pixel_lists:
+      labeller.add(pixel_list[0])
+    return labeller
+  labeller = timer('add_pixel_lists', add_pixel_lists)
+  timer('labels_2d', labeller.labels_2d)
+  labels = timer('labels_3d', labeller.labels_3d)
+  def create_shoeboxes():
+    creator = flex.PixelListShoeboxCreator(
+      labeller, labels, 0, 0, min_spot_size, max_spot_size, False)
+    shoeboxes = creator.result()
+    return shoeboxes.select(shoeboxes.is_allocated())
+  shoeboxes = timer('shoeboxes', create_shoeboxes)
+  timer('reflection_table', lambda: ShoeboxesToReflectionTable(filter_spots)(
+    imageset, shoeboxes))
+
+  # Time the whole of ExtractSpots
+  print 'ExtractSpots:'
+  for nproc in params.nproc:
+    for no_shoeboxes_2d in (False, True):
+      extract_spots = ExtractSpots(
+        threshold_function        = threshold_function,
+        mp_method                 = 'multiprocessing',
+        max_strong_pixel_fraction = 1.0,
+        mp_nproc                  = nproc,
+        mp_chunksize              = Auto,
+        min_spot_size             = min_spot_size,
+        max_spot_size             = max_spot_size,
+        filter_spots              = filter_spots,
+        no_shoeboxes_2d           = no_shoeboxes_2d,
+        min_chunksize             = 1)
+      if no_shoeboxes_2d:
+        stage = '_find_spots_2d_no_shoeboxes'
+      else:
+        stage = '_find_spots'
+      timer(stage, lambda: extract_spots(imageset), nproc=nproc)
+
+  # Write the results
+  result = {
+    'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'platform' : platform.platform(),
+    'processor' : platform.processor(),
+    'image_size' : list(params.image_size),
+    'num_images' : params.num_images,
+    'background' : params.background,
+    'spot_density' : params.spot_density,
+    'num_spots' : num_spots,
+    'results' : timer.results,
+  }
+  with open(params.output, 'w') as outfile:
+    json.dump(result, outfile, indent=2)
+  print 'Wrote results to %s' % params.output
+
+
+if __name__ == '__main__':
+  import sys
+  run(sys.argv[1:])
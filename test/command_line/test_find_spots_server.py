@@ -0,0 +1,42 @@
+from __future__ import absolute_import, division
+
+class FormatParent(object):
+  '''A general format understanding every image'''
+  @staticmethod
+  def understand(filename):
+    return True
+
+class FormatChild(FormatParent):
+  '''A more specific format understanding only some of the images'''
+  @staticmethod
+  def understand(filename):
+    return 'child' in filename
+
+def test_worker_cache_format_class_prefers_registry_child(monkeypatch):
+  from dxtbx.format.Registry import Registry
+  from dials.command_line.find_spots_server import WorkerCache
+
+  searched = []
+  def find(filename):
+    searched.append(filename)
+    for format_class in (FormatChild, FormatParent):
+      if format_class.understand(filename):
+        return format_class
+  monkeypatch.setattr(Registry, 'find', find)
+
+  cache = WorkerCache()
+
+  # The parent class is found once for its template and then reused
+  assert cache.format_class('/data/parent_00001.cbf') is FormatParent
+  assert cache.format_class('/data/parent_00002.cbf') is FormatParent
+  assert searched == ['/data/parent_00001.cbf']
+
+  # The cached parent also understands these images, but the registry gives
+  # them to the child class
+  assert cache.format_class('/data/child_00001.cbf') is FormatChild
+  assert cache.format_class('/data/child_00002.cbf') is FormatChild
+  assert searched == ['/data/parent_00001.cbf', '/data/child_00001.cbf']
+
+  # Each template keeps its own class
+  assert cache.format_class('/data/parent_00003.cbf') is FormatParent
+  assert len(searched) == 2
@@ -128,6 +128,29 @@ def exercise_client(port):
                   for node in xmldoc.getElementsByTagName('d_min')])
   assert d_min == sorted([1.45, 1.47, 1.55, 1.55, 1.56, 1.59, 1.61, 1.61, 1.64]), d_min
 
+  # Send the images to the batch endpoint as a template and image range
+  from dials.command_line.find_spots_client import work_batch
+  import json
+  request = {
+    'template': os.path.join(data_dir, "centroid_####.cbf"),
+    'image_range': [1, 9],
+    'params': ['min_spot_size=3']}
+  import urllib2
+  response = urllib2.urlopen(urllib2.Request(
+    "http://localhost:%i/batch" %port, data=json.dumps(request)))
+  results = [json.loads(line) for line in response.readlines()]
+  assert sorted(r['image'] for r in results) == filenames
+  assert sorted(r['n_spots_total'] for r in results) == sorted(
+    [203, 196, 205, 209, 195, 205, 203, 207, 189])
+  for r in results:
+    assert 'error' not in r
+    for stage in ('read', 'spotfinding', 'resolution', 'total'):
+      assert stage in r['timings']
+
+  # And as a list of filenames
+  results = list(work_batch('localhost', port, filenames[:3], ['min_spot_size=3']))
+  assert sorted(r['image'] for r in results) == filenames[:3]
+
 
 if __name__ == '__main__':
   from dials.test import cd_auto
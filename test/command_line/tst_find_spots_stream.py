@@ -0,0 +1,162 @@
+from __future__ import absolute_import, division, print_function
+import json
+import os
+import socket
+import subprocess
+import libtbx.load_env
+from libtbx import easy_run
+
+have_dials_regression = libtbx.env.has_module("dials_regression")
+if have_dials_regression:
+  dials_regression = libtbx.env.find_in_repositories(
+    relative_path="dials_regression",
+    test=os.path.isdir)
+
+
+class ReplayStream(object):
+  '''
+  A local ZMQ PUSH socket replaying CBF files as an EIGER stream with
+  uncompressed image data
+
+  '''
+
+  def __init__(self, port):
+    import zmq
+    self.context = zmq.Context()
+    self.socket = self.context.socket(zmq.PUSH)
+    self.socket.bind("tcp://*:%d" % port)
+
+  def send_header(self, imageset):
+    beam = imageset.get_beam()
+    panel = imageset.get_detector()[0]
+    scan = imageset.get_scan()
+    beam_x, beam_y = panel.get_beam_centre_px(beam.get_s0())
+    nx, ny = panel.get_image_size()
+    configuration = {
+      'beam_center_x' : beam_x,
+      'beam_center_y' : beam_y,
+      'count_time' : scan.get_exposure_times()[0],
+      'detector_distance' : panel.get_distance() / 1000,
+      'frame_time' : scan.get_exposure_times()[0],
+      'nimages' : len(imageset),
+      'ntrigger' : 1,
+      'omega_increment' : scan.get_oscillation()[1],
+      'omega_start' : scan.get_oscillation()[0],
+      'sensor_material' : 'Si',
+      'sensor_thickness' : panel.get_thickness() / 1000,
+      'wavelength' : beam.get_wavelength(),
+      'x_pixel_size' : panel.get_pixel_size()[0] / 1000,
+      'y_pixel_size' : panel.get_pixel_size()[1] / 1000,
+      'x_pixels_in_detector' : nx,
+      'y_pixels_in_detector' : ny,
+      'count_rate_correction_count_cutoff' : int(panel.get_trusted_range()[1]),
+      'description' : 'Dectris Eiger 16M',
+    }
+    self.socket.send_multipart([
+      json.dumps({'htype' : 'dheader-1.0', 'header_detail' : 'basic', 'series' : 1}),
+      json.dumps(configuration)])
+
+  def send_image(self, frame, data):
+    ny, nx = data.all()
+    raw = data.as_numpy_array().astype('int32').tostring()
+    self.socket.send_multipart([
+      json.dumps({'htype' : 'dimage-1.0', 'frame' : frame, 'hash' : '', 'series' : 1}),
+      json.dumps({'htype' : 'dimage_d-1.0', 'shape' : [ny, nx], 'type' : 'int32',
+                  'encoding' : '<', 'size' : len(raw)}),
+      raw,
+      json.dumps({'htype' : 'dconfig-1.0', 'start_time' : 0, 'stop_time' : 0,
+                  'real_time' : 0})])
+
+  def send_endofseries(self):
+    self.socket.send_multipart([
+      json.dumps({'htype' : 'dseries_end-1.0', 'series' : 1})])
+
+  def close(self):
+    self.socket.close(linger=10000)
+    self.context.term()
+
+
+def run():
+  if not have_dials_regression:
+    print("Skipping tst_find_spots_stream: dials_regression not available.")
+    return
+  try:
+    import zmq
+  except ImportError:
+    print("Skipping tst_find_spots_stream: zmq not available.")
+    return
+  import glob
+  from dxtbx.datablock import DataBlockFactory
+  from dials.array_family import flex
+
+  data_dir = os.path.join(dials_regression, "centroid_test_data")
+  filenames = sorted(glob.glob(os.path.join(data_dir, "centroid_*.cbf")))
+  datablock = DataBlockFactory.from_filenames(filenames)[0]
+  imageset = datablock.extract_imagesets()[0]
+
+  # The reference spots found from the files
+  result = easy_run.fully_buffered(
+    "dials.find_spots %s min_spot_size=3 output.reflections=reference.pickle"
+    % " ".join(filenames)).raise_if_errors()
+  reference = flex.reflection_table.from_pickle("reference.pickle")
+
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  s.bind(("", 0))
+  port = s.getsockname()[1]
+  s.close()
+
+  stream = ReplayStream(port)
+  command = " ".join([
+    "dials.find_spots_stream",
+    "input.host=localhost",
+    "input.port=%d" % port,
+    "output.directory=stream_images",
+    "output.spot_counts=spot_counts.json",
+    "output.hot_mask=stream_hot_mask.pickle",
+    "min_spot_size=3",
+    "nproc=3"])
+  print(command)
+  process = subprocess.Popen(command, shell=True)
+  try:
+    stream.send_header(imageset)
+    for i in range(len(imageset)):
+      stream.send_image(i, imageset.get_raw_data(i)[0])
+    stream.send_endofseries()
+    assert process.wait() == 0
+  finally:
+    stream.close()
+    if process.poll() is None:
+      process.kill()
+
+  # The spot counts are written as each image is processed
+  with open("spot_counts.json") as infile:
+    counts = [json.loads(line) for line in infile]
+  assert sorted(c['image'] for c in counts) == list(range(1, len(imageset)+1))
+
+  # The hot pixels should be those found by dials.find_spots
+  import cPickle as pickle
+  result = easy_run.fully_buffered(
+    "dials.find_spots %s write_hot_mask=True output.reflections=hot.pickle"
+    % " ".join(filenames)).raise_if_errors()
+  with open("hot_mask_0.pickle", "rb") as infile:
+    reference_mask = pickle.load(infile)
+  with open("stream_hot_mask.pickle", "rb") as infile:
+    hot_mask = pickle.load(infile)
+  assert len(hot_mask) == len(reference_mask)
+  for m1, m2 in zip(hot_mask, reference_mask):
+    assert m1.all_eq(m2)
+
+  # The strong spots should be the same as from the files
+  reflections = flex.reflection_table.from_pickle("strong.pickle")
+  assert len(reflections) == len(reference), (len(reflections), len(reference))
+  from libtbx.test_utils import approx_equal
+  for c1, c2 in zip(reflections['xyzobs.px.value'].parts(),
+                    reference['xyzobs.px.value'].parts()):
+    assert approx_equal(flex.sum(c1), flex.sum(c2))
+  print("OK")
+
+
+if __name__ == '__main__':
+  from dials.test import cd_auto
+  with cd_auto(__file__):
+    run()
@@ -25,6 +25,9 @@ def run(self):
     self.test_multi_sweep()
     self.test_multi_lattice()
     self.test_output_rubbish()
+    self.test_shoebox_cache()
+    self.test_share_frames()
+    self.test_stage_timing()
 
   def test1(self):
     from os.path import join, exists
@@ -329,6 +332,116 @@ def test_output_rubbish(self):
     self.table = table
     print 'OK'
 
+  def test_shoebox_cache(self):
+    from os.path import join
+    from libtbx import easy_run
+    from libtbx.test_utils import approx_equal
+    import os
+
+    # Integrate reading the images for each pass and from the shoebox cache
+    for filename, cache in [('nocache.pickle', False),
+                            ('cache.pickle', True)]:
+      result = easy_run.fully_buffered([
+        'dials.integrate',
+        join(self.path, 'experiments.json'),
+        'integrator=3d',
+        'nproc=2',
+        'cache.shoeboxes=%s' % cache,
+        'cache.directory=shoebox_cache',
+        'output.reflections=%s' % filename,
+      ]).raise_if_errors()
+    assert not os.listdir('shoebox_cache')
+
+    # The profile modelling and integration passes use the same jobs as the
+    # pass which filled the cache, so both should process every image from
+    # the cache rather than reading it again
+    import re
+    match = re.search(
+      r"Shoebox cache: read (\d+) images once and processed (\d+) images",
+      "\n".join(result.stdout_lines))
+    assert match is not None
+    images_read, images_cached = map(int, match.groups())
+    assert images_read > 0
+    assert images_cached >= 2 * images_read, (images_read, images_cached)
+
+    import cPickle as pickle
+    table1 = pickle.load(open('nocache.pickle', 'rb'))
+    table2 = pickle.load(open('cache.pickle', 'rb'))
+    assert 'cache_index' not in table2
+    assert len(table1) == len(table2)
+    assert approx_equal(table1['intensity.sum.value'],
+                        table2['intensity.sum.value'])
+    if 'intensity.prf.value' in table1:
+      assert approx_equal(table1['intensity.prf.value'],
+                          table2['intensity.prf.value'])
+    print 'OK'
+
+  def test_share_frames(self):
+    from os.path import join
+    from libtbx import easy_run
+    from libtbx.test_utils import approx_equal
+
+    # Integrate with each block reading its own images and with the images
+    # shared between overlapping blocks, counting the images read by all the
+    # passes over the images
+    import re
+    images_read = {}
+    for filename, share in [('noshare.pickle', False),
+                            ('share.pickle', True)]:
+      result = easy_run.fully_buffered([
+        'dials.integrate',
+        join(self.path, 'experiments.json'),
+        'integrator=3d',
+        'nproc=2',
+        'block.size=2',
+        'block.share_frames=%s' % share,
+        'output.reflections=%s' % filename,
+      ]).raise_if_errors()
+      assert any('Read amplification' in line for line in result.stdout_lines)
+      images_read[share] = sum(
+        int(re.search(r'Images read\D*(\d+)', line).group(1))
+        for line in result.stdout_lines if 'Images read' in line)
+
+    # Sharing the frames should read fewer images
+    assert images_read[False] > 0
+    assert images_read[True] < images_read[False], images_read
+
+    import cPickle as pickle
+    table1 = pickle.load(open('noshare.pickle', 'rb'))
+    table2 = pickle.load(open('share.pickle', 'rb'))
+    assert len(table1) == len(table2)
+    assert approx_equal(table1['intensity.sum.value'],
+                        table2['intensity.sum.value'])
+    if 'intensity.prf.value' in table1:
+      assert approx_equal(table1['intensity.prf.value'],
+                          table2['intensity.prf.value'])
+    print 'OK'
+
+  def test_stage_timing(self):
+    from os.path import join, exists
+    from libtbx import easy_run
+    import json
+
+    # Integrate with the default integrator recording the per stage timings
+    easy_run.fully_buffered([
+      'dials.integrate',
+      join(self.path, 'experiments.json'),
+      'integrator=3d',
+      'nproc=1',
+      'output.reflections=timing.pickle',
+      'output.timing=timing.json',
+    ]).raise_if_errors()
+    assert exists('timing.json')
+    with open('timing.json') as infile:
+      timing = json.load(infile)
+    stages = dict((stage['name'], stage) for stage in timing['stages'])
+    for name in ['mask', 'background', 'centroid', 'summation']:
+      assert stages[name]['reflections'] > 0
+      assert stages[name]['pixels'] > 0
+    assert len(timing['jobs']) > 0
+    assert timing['algorithms']['background'] is not None
+    print 'OK'
+
 
 if __name__ == '__main__':
   from dials.test import cd_auto
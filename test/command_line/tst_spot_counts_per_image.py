@@ -33,6 +33,13 @@ def run():
     " d_min | d_min (distl method 1) | d_min (distl method 2) |"
     in result.stdout_lines), result.stdout_lines
 
+  # the per-image analysis in parallel should give the same table
+  cmd = "dials.spot_counts_per_image datablock.json strong.pickle nproc=1"
+  serial = easy_run.fully_buffered(cmd).raise_if_errors()
+  cmd = "dials.spot_counts_per_image datablock.json strong.pickle nproc=3"
+  parallel = easy_run.fully_buffered(cmd).raise_if_errors()
+  assert serial.stdout_lines == parallel.stdout_lines
+
 
 if __name__ == '__main__':
   from dials.test import cd_auto
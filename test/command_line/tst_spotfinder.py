@@ -42,6 +42,46 @@ def exercise_spotfinder():
     assert "shoebox" not in reflections
   print 'OK'
 
+  # now with a resolution filter, thresholding the whole image
+  args = ["dials.find_spots", "filter.d_min=2", "filter.d_max=15",
+          "threshold_spans=False",
+          ' '.join(template), "output.reflections=spotfinder_full.pickle", "output.shoeboxes=False"]
+  result = easy_run.fully_buffered(command=" ".join(args)).raise_if_errors()
+  assert os.path.exists("spotfinder_full.pickle")
+  with open("spotfinder_full.pickle", "rb") as f:
+    reflections_full = pickle.load(f)
+    assert len(reflections_full) == len(reflections)
+    assert approx_equal(reflections_full['xyzobs.px.value'],
+                        reflections['xyzobs.px.value'])
+  print 'OK'
+
+  # now with a tight resolution cut, so that only the spans within the
+  # resolution limit are thresholded rather than the whole image
+  args = ["dials.find_spots", "filter.d_min=4", "filter.d_max=15",
+          ' '.join(template), "output.reflections=spotfinder.pickle", "output.shoeboxes=False"]
+  result = easy_run.fully_buffered(command=" ".join(args)).raise_if_errors()
+  lines = [l for l in result.stdout_lines
+           if l.startswith("Thresholding") and "of the pixels" in l]
+  assert len(lines) == 1, lines
+  percentage = float(lines[0].split()[1].rstrip('%'))
+  assert percentage < 90, percentage
+  assert os.path.exists("spotfinder.pickle")
+  with open("spotfinder.pickle", "rb") as f:
+    reflections = pickle.load(f)
+  args = ["dials.find_spots", "filter.d_min=4", "filter.d_max=15",
+          "threshold_spans=False",
+          ' '.join(template), "output.reflections=spotfinder_full.pickle", "output.shoeboxes=False"]
+  result = easy_run.fully_buffered(command=" ".join(args)).raise_if_errors()
+  assert not any(l.startswith("Thresholding") for l in result.stdout_lines)
+  assert os.path.exists("spotfinder_full.pickle")
+  with open("spotfinder_full.pickle", "rb") as f:
+    reflections_full = pickle.load(f)
+    assert len(reflections) > 0
+    assert len(reflections_full) == len(reflections)
+    assert approx_equal(reflections_full['xyzobs.px.value'],
+                        reflections['xyzobs.px.value'])
+  print 'OK'
+
   # now write a hot mask
   args = ["dials.find_spots", "write_hot_mask=True",
           ' '.join(template), "output.reflections=spotfinder.pickle", "output.shoeboxes=False"]
@@ -74,6 +114,47 @@ def exercise_spotfinder():
     assert mask[0].count(False) == 12, mask[0].count(False)
   print 'OK'
 
+  # now with the shared memory transport
+  args = ["dials.find_spots", "nproc=3", "mp.transport=shared_memory",
+          ' '.join(template), "output.reflections=spotfinder.pickle", "output.shoeboxes=True"]
+  result = easy_run.fully_buffered(command=" ".join(args)).raise_if_errors()
+  assert os.path.exists("spotfinder.pickle")
+  with open("spotfinder.pickle", "rb") as f:
+    reflections = pickle.load(f)
+    assert len(reflections) == 653, len(reflections)
+    refl = reflections[0]
+    assert approx_equal(refl['intensity.sum.value'], 42)
+    assert approx_equal(refl['bbox'], (1398, 1400, 513, 515, 0, 1))
+  print 'OK'
+
+  # now with the shared memory transport, with more images than slots and a
+  # chunk size larger than the number of slots
+  args = ["dials.find_spots", "nproc=2", "mp.transport=shared_memory",
+          "mp.chunksize=5",
+          ' '.join(template), "output.reflections=spotfinder.pickle", "output.shoeboxes=False"]
+  assert len(template) > 2 * 2 # the transport has 2 * nproc slots
+  result = easy_run.fully_buffered(command=" ".join(args)).raise_if_errors()
+  assert os.path.exists("spotfinder.pickle")
+  with open("spotfinder.pickle", "rb") as f:
+    reflections = pickle.load(f)
+    assert len(reflections) == 653, len(reflections)
+  print 'OK'
+
+  # now with the labelling done on blocks of images in parallel
+  args = ["dials.find_spots", "nproc=3", "mp.chunked_labelling=True",
+          ' '.join(template), "output.reflections=spotfinder.pickle", "output.shoeboxes=True"]
+  result = easy_run.fully_buffered(command=" ".join(args)).raise_if_errors()
+  assert os.path.exists("spotfinder.pickle")
+  with open("spotfinder.pickle", "rb") as f:
+    reflections = pickle.load(f)
+    assert len(reflections) == 653, len(reflections)
+    refl = reflections[0]
+    assert approx_equal(refl['intensity.sum.value'], 42)
+    assert approx_equal(refl['bbox'], (1398, 1400, 513, 515, 0, 1))
+    assert approx_equal(refl['xyzobs.px.value'],
+                        (1399.1190476190477, 514.2142857142857, 0.5))
+  print 'OK'
+
   # now with more generous parameters
   args = ["dials.find_spots", "min_spot_size=3",
           "max_separation=3",
@@ -10,6 +10,7 @@ def run(self):
     self.tst_add_image()
     self.tst_labels_3d()
     self.tst_labels_2d()
+    self.tst_merge_labels_3d()
     self.tst_with_no_points()
 
   def tst_pickle(self):
@@ -159,6 +160,36 @@ def tst_labels_2d(self):
     # Test passed
     print 'OK'
 
+  def tst_merge_labels_3d(self):
+    from dials.model.data import PixelList, PixelListLabeller, merge_labels_3d
+    from scitbx.array_family import flex
+    size = (200, 200)
+    sf = 5
+    labeller = PixelListLabeller()
+
+    # Label blocks of frames separately
+    blocks = [(0, 2), (2, 3), (3, 6)]
+    block_labels = flex.int()
+    for first, last in blocks:
+      block_labeller = PixelListLabeller()
+      for i in range(first, last):
+        image = flex.random_int_gaussian_distribution(size[0]*size[1], 100, 5)
+        mask = flex.random_bool(size[0]*size[1], 0.5)
+        image.reshape(flex.grid(size))
+        mask.reshape(flex.grid(size))
+        pl = PixelList(sf+i, image, mask)
+        labeller.add(pl)
+        block_labeller.add(pl)
+      block_labels.extend(block_labeller.labels_3d())
+
+    # The merged labels should be the same as labelling all frames together
+    block_start = flex.int(sf + first for first, last in blocks[1:])
+    labels = merge_labels_3d(labeller, block_labels, block_start)
+    assert labels.all_eq(labeller.labels_3d())
+
+    # Test passed
+    print 'OK'
+
   def tst_with_no_points(self):
 
     from dials.model.data import PixelList, PixelListLabeller
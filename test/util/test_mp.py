@@ -0,0 +1,108 @@
+from __future__ import absolute_import, division
+
+from multiprocessing import Manager
+from dials.util.mp import bounded_parallel_map
+
+def square(x):
+  return x * x
+
+def test_bounded_parallel_map_takes_items_lazily():
+  created = []
+  results = []
+
+  def iterable():
+    for i in range(20):
+      created.append(i)
+      yield i
+
+  def callback(result):
+    assert len(created) - len(results) <= 4
+    results.append(result)
+
+  bounded_parallel_map(
+    func        = square,
+    iterable    = iterable(),
+    nproc       = 2,
+    callback    = callback,
+    max_pending = 4)
+  assert results == [i * i for i in range(20)]
+
+class WaitOnFirst(object):
+  '''
+  Square the item, holding the first item until the event is set
+
+  '''
+  def __init__(self, event):
+    self.event = event
+
+  def __call__(self, x):
+    if x == 0:
+      assert self.event.wait(60)
+    return x * x
+
+def fail_on_three(x):
+  if x == 3:
+    raise ValueError("Item three")
+  return x
+
+def test_bounded_parallel_map_in_completion_order():
+  created = []
+  results = []
+
+  def iterable():
+    for i in range(20):
+      created.append(i)
+      yield i
+
+  # The first item is held until another result has been returned
+  manager = Manager()
+  event = manager.Event()
+
+  def callback(result):
+    assert len(created) - len(results) <= 4
+    results.append(result)
+    event.set()
+
+  try:
+    bounded_parallel_map(
+      func           = WaitOnFirst(event),
+      iterable       = iterable(),
+      nproc          = 2,
+      callback       = callback,
+      max_pending    = 4,
+      preserve_order = False)
+  finally:
+    manager.shutdown()
+
+  # The slow first item does not hold up the others
+  assert sorted(results) == [i * i for i in range(20)]
+  assert results[0] != 0
+
+def test_bounded_parallel_map_in_completion_order_raises():
+  import pytest
+  with pytest.raises(RuntimeError) as e:
+    bounded_parallel_map(
+      func           = fail_on_three,
+      iterable       = range(10),
+      nproc          = 2,
+      preserve_order = False)
+  assert "Item three" in str(e.value)
+
+def kill_on_three(x):
+  import os
+  import signal
+  if x == 3:
+    os.kill(os.getpid(), signal.SIGKILL)
+  return x
+
+def test_bounded_parallel_map_raises_if_worker_killed():
+  import pytest
+  from dials.util.mp import WorkerDied
+  for preserve_order in (True, False):
+    with pytest.raises(WorkerDied):
+      bounded_parallel_map(
+        func           = kill_on_three,
+        iterable       = range(10),
+        nproc          = 2,
+        preserve_order = preserve_order,
+        poll_interval  = 0.1)
@@ -143,8 +143,9 @@ def __init__(self, params):
     ''' Set the parameters. '''
     self.params = params
 
-  def generate(self, imageset):
-    ''' Generate the mask. '''
+  def generate(self, imageset, image=None):
+    ''' Generate the mask, optionally given the image data to use instead of
+    reading the first image of the imageset. '''
     from dials.util.ext import ResolutionMaskGenerator
     from dials.util.ext import mask_untrusted_rectangle
     from dials.util.ext import mask_untrusted_circle
@@ -156,7 +157,8 @@ def generate(self, imageset):
     beam = imageset.get_beam()
 
     # Get the first image
-    image = imageset.get_raw_data(0)
+    if image is None:
+      image = imageset.get_raw_data(0)
     assert(len(detector) == len(image))
 
     # Create the mask for each image
@@ -265,6 +265,139 @@ def batch_multi_node_parallel_map(
     preserve_exception_message = True)
 
 
+class CaptureException(object):
+  '''
+  A wrapper which returns a (success, result) tuple rather than raising, so
+  that a failed call is still reported through the apply_async callback. On
+  failure the result is the formatted traceback.
+
+  '''
+
+  def __init__(self, func):
+    self.func = func
+
+  def __call__(self, item):
+    try:
+      return True, self.func(item)
+    except Exception:
+      import traceback
+      return False, traceback.format_exc()
+
+
+class WorkerDied(RuntimeError):
+  '''
+  Raised when a process of the pool exits while items are still pending
+
+  '''
+  pass
+
+
+def _wait_for_result(get, pool, workers, poll_interval):
+  '''
+  Call get(timeout) until it returns, checking between calls that none of the
+  original pool processes have died. The pool replaces a killed process but
+  the item it was working on is lost, so without this check the wait for the
+  item would never finish.
+
+  '''
+  from Queue import Empty
+  from multiprocessing import TimeoutError
+  while True:
+    try:
+      return get(poll_interval)
+    except (Empty, TimeoutError):
+      pass
+    for process in workers:
+      if process.exitcode is not None:
+        raise WorkerDied(
+          "Process %d exited with code %d while items were pending" % (
+            process.pid, process.exitcode))
+
+
+def bounded_parallel_map(
+    func,
+    iterable,
+    nproc=1,
+    callback=None,
+    max_pending=None,
+    preserve_order=True,
+    poll_interval=1.0):
+  '''
+  A parallel map on a local multiprocessing pool which takes items from the
+  iterable only as results come back, so that at most max_pending items
+  (default 2 * nproc) have been taken from the iterable and not yet returned.
+  This allows the iterable to be a generator creating large items lazily.
+
+  If preserve_order is True the results are passed to the callback in the
+  order of the iterable. Otherwise they are passed in the order in which they
+  complete, so a long running item does not stop the next items being taken
+  from the iterable while the other processes are free.
+
+  While waiting for a result the pool processes are checked every
+  poll_interval seconds and a WorkerDied exception is raised if any of them
+  has exited (e.g. killed by the OOM killer).
+
+  '''
+  from multiprocessing import Pool
+  from collections import deque
+  from Queue import Queue
+  if max_pending is None:
+    max_pending = 2 * nproc
+  assert nproc > 0, "Invalid number of processors"
+  assert max_pending >= nproc, "Fewer pending items than processors"
+  pool = Pool(processes=nproc)
+  workers = list(pool._pool)
+  try:
+    if preserve_order:
+      pending = deque()
+      def next_result():
+        return _wait_for_result(
+          pending.popleft().get, pool, workers, poll_interval)
+      for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        del item
+        if len(pending) >= max_pending:
+          result = next_result()
+          if callback is not None:
+            callback(result)
+      while len(pending) > 0:
+        result = next_result()
+        if callback is not None:
+          callback(result)
+    else:
+      completed = Queue()
+      num_pending = 0
+      def next_result():
+        success, result = _wait_for_result(
+          lambda timeout: completed.get(timeout=timeout),
+          pool, workers, poll_interval)
+        if not success:
+          raise RuntimeError(result)
+        return result
+      for item in iterable:
+        pool.apply_async(CaptureException(func), (item,),
+                         callback=completed.put)
+        del item
+        num_pending += 1
+        while num_pending >= max_pending or (
+            num_pending > 0 and not completed.empty()):
+          result = next_result()
+          num_pending -= 1
+          if callback is not None:
+            callback(result)
+      while num_pending > 0:
+        result = next_result()
+        num_pending -= 1
+        if callback is not None:
+          callback(result)
+    pool.close()
+  except Exception:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
 if __name__ == '__main__':
 
   def func(x):
@@ -59,6 +59,49 @@ def close(self):
     return self.receiver.close()
 
 
+def decode_image_data(data, info):
+  '''
+  Decode the data of an image message into a tuple of panel images. The data
+  can be any object supporting the buffer interface so that the buffers of the
+  frames received with copy=False can be decoded directly.
+
+  :param data: The image data
+  :param info: The image info from the message
+  :return: The tuple of panel images
+
+  '''
+  import numpy
+  from dials.array_family import flex
+
+  # The image shape (slow, fast) and data type
+  shape = tuple(info['shape'])
+  dtype = numpy.dtype(info['type'])
+  encoding = info['encoding']
+
+  # Decompress the data
+  if encoding == '<':
+    array = numpy.frombuffer(data, dtype=dtype)
+  elif encoding == 'lz4<':
+    import lz4.block
+    size = shape[0] * shape[1] * dtype.itemsize
+    array = numpy.frombuffer(
+      lz4.block.decompress(data, uncompressed_size=size), dtype=dtype)
+  elif encoding == 'bs32-lz4<':
+    from bitshuffle import decompress_lz4
+    # 8 byte uncompressed size and 4 byte block size (in bytes) header
+    blob = numpy.frombuffer(data, dtype=numpy.uint8, offset=12)
+    block_size = int(numpy.frombuffer(
+      data, dtype='>u4', count=1, offset=8)[0]) // dtype.itemsize
+    array = decompress_lz4(blob, shape, dtype, block_size)
+  else:
+    raise RuntimeError('Unknown image encoding %s' % encoding)
+
+  # Convert to an integer image
+  image = flex.int(array.astype(numpy.int32).ravel())
+  image.reshape(flex.grid(*shape))
+  return (image,)
+
+
 class Result(object):
   '''
   A class to represent a result
@@ -168,15 +211,15 @@ def __init__(self, frames, header):
 
     super(Image, self).__init__()
 
-    # Load stuff
+    # Load stuff. The image data is kept as the frame received from zmq so
+    # that it can be decoded from the buffer without copying it.
     head = json.loads(frames[0].bytes)
     info = json.loads(frames[1].bytes)
-    data = frames[2].bytes
     time = json.loads(frames[3].bytes)
 
     # The image number and data
     self.count = head['frame']
-    self.data = data
+    self.frame = frames[2]
     self.info = info
 
     # The dimensions
@@ -203,6 +246,29 @@ def __init__(self, frames, header):
     # else:
     #   raise RuntimeError('Unknown compression')
 
+  @property
+  def data(self):
+    '''
+    The compressed image data as a string
+
+    '''
+    return self.frame.bytes
+
+  @property
+  def buffer(self):
+    '''
+    The compressed image data as a buffer without copying
+
+    '''
+    return self.frame.buffer
+
+  def decode(self):
+    '''
+    Decode the image data
+
+    '''
+    return decode_image_data(self.buffer, self.info)
+
   def is_image(self):
     '''
     Return that the object is an image